@@ -4,21 +4,33 @@ import os
 import re
 import json
 import time
-import fnmatch
+import hashlib
+import functools
+import itertools
 import requests
 import threading
 import subprocess
+import contextlib
 from pathlib import Path
+from types import MappingProxyType
 from datetime import datetime
-from typing import Dict, List, Set, Optional, Tuple, TypedDict
+from collections import Counter, OrderedDict, deque
+from typing import Callable, Dict, FrozenSet, List, Mapping, Set, Optional, Tuple, TypedDict
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
+from scripts.pathfilter import IgnoreMatcher, walk
 
 # Configuration
 class FileCache(TypedDict):
     files: Dict[str, Dict[str, str|float]]
     last_updated: str
 
+class CachedContent(TypedDict):
+    text: str
+    tokens: int
+    mtime: float
+    size: int
+
 class TechStack(TypedDict):
     next: str
     prisma: str
@@ -32,9 +44,35 @@ CONFIG = {
     "MAX_FILE_SIZE": 8000,
     "MAX_CONTEXT_FILES": 10,
     "MAX_CONTEXT_TOKENS": 12000,
+    "SELECTOR_PROMPT_TOKENS": 3000,
+    "CONTENT_CACHE_BYTES": 32 * 1024 * 1024,
+    "MINIFY_CACHE_BYTES": 8 * 1024 * 1024,
+    "MINIFY_CONTEXT": False,
+    "DIFF_CONTEXT_LINES": 3,
+    "DIFF_SYMBOL_LINES": 2,
     "IGNORED_DIRS": {"node_modules", ".next", ".git", "dist", "__tests__", "public", "build", ".cache"},
     "IGNORED_FILE_PATTERNS": ["*.spec.*", "*.test.*", "*.d.ts"],
     "SUPPORTED_EXTENSIONS": (".ts", ".tsx", ".js", ".jsx", ".prisma", ".graphql", ".gql"),
+    "IGNORE_FILES": (".gitignore", ".dockerignore"),
+    "WALK_WORKERS": 4,
+    "INDEX_SNAPSHOT": ".ai-assistant/ask_index.snapshot",
+    "INDEX_MAX_SCAN_BYTES": 256 * 1024,
+    "SELECTION_CACHE": ".ai-assistant/selection_cache.json",
+    "SELECTION_CACHE_SIZE": 256,
+    "SELECTION_CACHE_THRESHOLD": 0.6,
+    "SUMMARY_BACKGROUND": True,
+    "SUMMARY_CACHE": ".ai-assistant/summaries.json",
+    "SUMMARY_IDLE_SECONDS": 15,
+    "SUMMARY_TOKENS_PER_MINUTE": 20000,
+    "SUMMARY_MAX_FILE_CHARS": 6000,
+    "WORKSPACE_ROOTS": [],
+    "SHARD_DIR": ".ai-assistant/shards",
+    "SHARD_IDLE_SECONDS": 900,
+    "SHARD_ROUTING_TERMS": 2000,
+    "SHARD_ROUTING_FILES": 50,
+    "CONVERSATION_DB": ".ai-assistant/conversations.db",
+    "HTTP_POOL_SIZE": 8,
+    "MODEL_SLOTS": {"default": 1},
     "OLLAMA_ENDPOINT": "http://localhost:11434/api/generate",
     "FALLBACK_OLLAMA_ENDPOINT": "http://localhost:11434/api/generate",
     "MODELS": {
@@ -42,6 +80,13 @@ CONFIG = {
         "fallback": "gemma3:4b",
         "file_selector": "gemma3:4b"
     },
+    "NUM_CTX_BUCKETS": (2048, 4096, 8192, 16384, 32768),
+    "NUM_PREDICT": {
+        "file_selector": 256,
+        "summary": 48,
+        "generate": 2048
+    },
+    "TELEMETRY_SIZE": 200,
     "PROJECT_DESCRIPTION": "A multi-tenant Computerized Maintenance Management System (CMMS) with Next.js, Prisma, and PostgreSQL",
     "DEFAULT_TECH_STACK": {
         "next": "14",
@@ -65,97 +110,1506 @@ OLLAMA_PARAMS = {
     #"temperature": 0.7,
     #"top_k": 50,
     #"top_p": 0.9,
-    #"num_ctx": 16384,
-    #"num_predict": 2048
+    # num_ctx and num_predict are sized per request by OllamaClient.options_for
 }
 
+STOPWORDS = {
+    "the", "and", "for", "with", "that", "this", "from", "into", "how", "what", "why",
+    "when", "where", "which", "can", "does", "should", "would", "could", "add", "make",
+    "use", "using", "need", "want", "are", "not", "all", "new", "get", "set", "file", "files"
+}
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) used for prompt budgeting."""
+    return (len(text) + 3) // 4
+
+def lexical_terms(text: str) -> Set[str]:
+    """Lowercased search terms from free text, splitting camelCase and dropping stopwords."""
+    words = re.findall(r'[A-Z]?[a-z0-9]+|[A-Z]+(?![a-z])', text)
+    terms = set()
+    for word in words:
+        word = word.lower()
+        if len(word) < 3 or word in STOPWORDS:
+            continue
+        if len(word) > 4 and word.endswith("s") and not word.endswith(("ss", "us")):
+            word = word[:-1]
+        terms.add(word)
+    return terms
+
+@functools.lru_cache(maxsize=None)
+def matcher_for(root: str) -> IgnoreMatcher:
+    """Ignore rules compiled once per workspace root from CONFIG plus the root's ignore files."""
+    return IgnoreMatcher(
+        root,
+        dir_names=CONFIG["IGNORED_DIRS"],
+        patterns=CONFIG["IGNORED_FILE_PATTERNS"],
+        ignore_files=CONFIG["IGNORE_FILES"]
+    )
+
+def project_matcher() -> IgnoreMatcher:
+    return matcher_for(".")
+
+def iter_source_files(max_depth: Optional[int] = None, root: str = ".") -> List[Path]:
+    """Supported, non-ignored source files under ``root``, walked with ignored subtrees pruned."""
+    return [Path(item.path) for item in walk(root, matcher_for(root), max_depth=max_depth,
+                                             workers=CONFIG["WALK_WORKERS"])
+            if item.rel_path.endswith(CONFIG["SUPPORTED_EXTENSIONS"])]
+
 class FileHandler:
     @staticmethod
-    def is_valid_file(file_path: Path) -> bool:
-        return (file_path.exists() and 
-                file_path.suffix in CONFIG["SUPPORTED_EXTENSIONS"] and
-                not any(fnmatch.fnmatch(file_path.name, pattern) 
-                       for pattern in CONFIG["IGNORED_FILE_PATTERNS"]) and
-                not any(ignored in str(file_path) 
-                       for ignored in CONFIG["IGNORED_DIRS"]))
+    def is_valid_file(file_path: Path, matcher: Optional[IgnoreMatcher] = None) -> bool:
+        return (file_path.suffix in CONFIG["SUPPORTED_EXTENSIONS"] and
+                not (matcher or project_matcher()).matches(file_path) and
+                file_path.exists())
 
 class OllamaClient:
-    @staticmethod
-    def call(model: str, prompt: str, max_retries: int = 3) -> Optional[str]:
+    # Recent request telemetry, newest last.
+    telemetry: "deque[dict]" = deque(maxlen=CONFIG["TELEMETRY_SIZE"])
+    # Per-model ratio of server-reported prompt tokens to estimate_tokens().
+    _token_ratio: Dict[str, float] = {}
+    _session: Optional[requests.Session] = None
+    _slots: Dict[str, threading.BoundedSemaphore] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def session(cls) -> requests.Session:
+        """Process-wide keep-alive session; concurrent streams draw from one connection pool."""
+        with cls._lock:
+            if cls._session is None:
+                adapter = requests.adapters.HTTPAdapter(pool_maxsize=CONFIG["HTTP_POOL_SIZE"])
+                cls._session = requests.Session()
+                cls._session.mount("http://", adapter)
+                cls._session.mount("https://", adapter)
+            return cls._session
+
+    @classmethod
+    def slot(cls, model: str) -> threading.BoundedSemaphore:
+        """Per-model request cap; CONFIG["MODEL_SLOTS"] should match the server's OLLAMA_NUM_PARALLEL.
+
+        Requests over the cap would only queue inside Ollama, so callers wait here instead,
+        where waiting can still be cancelled.
+        """
+        with cls._lock:
+            if model not in cls._slots:
+                slots = CONFIG["MODEL_SLOTS"]
+                cls._slots[model] = threading.BoundedSemaphore(max(1, slots.get(model, slots["default"])))
+            return cls._slots[model]
+
+    @classmethod
+    def measure_prompt(cls, model: str, prompt: str) -> int:
+        return int(estimate_tokens(prompt) * cls._token_ratio.get(model, 1.0)) + 1
+
+    @classmethod
+    def options_for(cls, model: str, prompt: str, request_type: str = "generate") -> dict:
+        """OLLAMA_PARAMS plus num_ctx/num_predict sized for this prompt.
+
+        num_ctx is rounded up to a bucket from CONFIG["NUM_CTX_BUCKETS"] so the server can
+        keep reusing an already loaded context of the same size.
+        """
+        num_predict = CONFIG["NUM_PREDICT"].get(request_type, CONFIG["NUM_PREDICT"]["generate"])
+        prompt_tokens = cls.measure_prompt(model, prompt)
+        buckets = CONFIG["NUM_CTX_BUCKETS"]
+        num_ctx = next((bucket for bucket in buckets if bucket >= prompt_tokens + num_predict), buckets[-1])
+        # Ollama truncates an oversized prompt silently and then reports the truncated count,
+        # so the overflow can only be detected here, before sending.
+        if prompt_tokens + num_predict > num_ctx:
+            print(f"⚠️ Prompt (~{prompt_tokens} tokens) plus {num_predict} to generate exceeds num_ctx "
+                  f"{num_ctx}; the server will truncate it")
+        return {**OLLAMA_PARAMS, "num_ctx": num_ctx, "num_predict": num_predict}
+
+    @classmethod
+    def record(cls, model: str, request_type: str, prompt: str, options: dict,
+               started: float, result: Optional[dict] = None, **extra):
+        """Append a telemetry entry and calibrate the token estimate from server counts."""
+        result = result or {}
+        estimated = estimate_tokens(prompt)
+        prompt_tokens = result.get("prompt_eval_count")
+        # A prompt-cache hit or a truncated prompt reports fewer tokens than were sent; learning
+        # from those would shrink later num_ctx buckets and bring the truncation back.
+        truncated = options.get("num_ctx") and prompt_tokens and prompt_tokens >= options["num_ctx"]
+        if prompt_tokens and estimated and prompt_tokens >= estimated and not truncated:
+            ratio = prompt_tokens / estimated
+            cls._token_ratio[model] = 0.8 * cls._token_ratio.get(model, ratio) + 0.2 * ratio
+        entry = {
+            "timestamp": datetime.now().isoformat(),
+            "model": model,
+            "request_type": request_type,
+            "prompt_tokens": prompt_tokens or cls.measure_prompt(model, prompt),
+            "num_ctx": options.get("num_ctx"),
+            "num_predict": options.get("num_predict"),
+            "eval_tokens": result.get("eval_count"),
+            "eval_rate": result["eval_count"] / (result["eval_duration"] / 1e9) if result.get("eval_duration") else None,
+            "duration": time.perf_counter() - started,
+            **extra
+        }
+        cls.telemetry.append(entry)
+        return entry
+
+    @classmethod
+    def loaded_models(cls) -> List[dict]:
+        """Models currently resident on the server, as reported by ``/api/ps``."""
+        response = cls.session().get(CONFIG["OLLAMA_ENDPOINT"].replace("/api/generate", "/api/ps"), timeout=2)
+        response.raise_for_status()
+        return response.json().get("models", [])
+
+    @classmethod
+    def call(cls, model: str, prompt: str, max_retries: int = 3, request_type: str = "generate") -> Optional[str]:
+        options = cls.options_for(model, prompt, request_type)
         for attempt in range(max_retries):
+            started = time.perf_counter()
             try:
-                response = requests.post(
-                    CONFIG["OLLAMA_ENDPOINT"],
-                    json={
-                        "model": model,
-                        "prompt": prompt,
-                        "stream": True,
-                        "options": OLLAMA_PARAMS
-                    },
-                    timeout=30
-                )
-                response.raise_for_status()
-                return response.json().get("response")
-            except requests.exceptions.RequestException:
+                with cls.slot(model):
+                    started = time.perf_counter()
+                    # Streamed so the timeout bounds the gap between tokens rather than the whole
+                    # num_predict-long generation.
+                    response = cls.session().post(
+                        CONFIG["OLLAMA_ENDPOINT"],
+                        json={
+                            "model": model,
+                            "prompt": prompt,
+                            "stream": True,
+                            "options": options
+                        },
+                        timeout=30,
+                        stream=True
+                    )
+                    with response:
+                        response.raise_for_status()
+                        parts: List[str] = []
+                        result: dict = {}
+                        for line in response.iter_lines():
+                            if line:
+                                chunk = json.loads(line.decode('utf-8'))
+                                parts.append(chunk.get("response", ""))
+                                if chunk.get("done"):
+                                    result = chunk
+                cls.record(model, request_type, prompt, options, started, result)
+                return "".join(parts)
+            except requests.exceptions.RequestException as e:
+                cls.record(model, request_type, prompt, options, started, error=str(e))
                 if attempt == max_retries - 1:
                     raise
                 time.sleep(1 + attempt)
         return None
 
-class ProjectContextManager:
+class FileContentCache:
+    """Byte-bounded LRU of decoded file contents keyed by path, validated by mtime and size.
+
+    Entries below a root registered with ``watch`` are served without touching the filesystem,
+    and the file watcher is responsible for calling ``invalidate``; anything else is re-stat'ed.
+    A read is only cached if no ``invalidate``/``clear`` touched its path while it was in
+    flight, so an event racing the read can't leave stale text that is never re-checked.
+    Background readers pass ``store=False`` so their reads neither insert nor promote
+    entries and cannot evict the files interactive requests are using.
+    """
+
+    def __init__(self, max_bytes: int = CONFIG["CONTENT_CACHE_BYTES"]):
+        self.max_bytes = max_bytes
+        self._watched: List[str] = []
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, CachedContent]" = OrderedDict()
+        # Bumped by invalidate() per path and by clear() for everything.
+        self._generations: Dict[str, int] = {}
+        self._epoch = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(file_path) -> str:
+        return os.path.abspath(file_path)
+
+    def get(self, file_path, store: bool = True) -> Optional[CachedContent]:
+        key = self._key(file_path)
+        with self._lock:
+            generation = (self._epoch, self._generations.get(key, 0))
+            entry = self._entries.get(key)
+            if entry is not None and key.startswith(tuple(self._watched)):
+                if store:
+                    self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+
+        try:
+            stat = os.stat(key)
+            if entry is not None and entry["mtime"] == stat.st_mtime and entry["size"] == stat.st_size:
+                with self._lock:
+                    if store and key in self._entries:
+                        self._entries.move_to_end(key)
+                    self.hits += 1
+                return entry
+            text = Path(key).read_text(encoding='utf-8')
+        except FileNotFoundError:
+            self.invalidate(key)
+            return None
+        except Exception as e:
+            print(f"⚠️ Error reading file {file_path}: {e}")
+            return None
+
+        entry = {"text": text, "tokens": estimate_tokens(text), "mtime": stat.st_mtime, "size": stat.st_size}
+        with self._lock:
+            self.misses += 1
+            if generation != (self._epoch, self._generations.get(key, 0)):
+                return entry  # invalidated while it was being read; serve it once, don't cache it
+            self._discard(key)
+            if store and stat.st_size <= self.max_bytes:
+                self._entries[key] = entry
+                self.total_bytes += stat.st_size
+                while self.total_bytes > self.max_bytes:
+                    _, evicted = self._entries.popitem(last=False)
+                    self.total_bytes -= evicted["size"]
+        return entry
+
+    def invalidate(self, file_path):
+        key = self._key(file_path)
+        with self._lock:
+            self._generations[key] = self._generations.get(key, 0) + 1
+            self._discard(key)
+
+    def watch(self, root: str):
+        """Trust cached entries below ``root``; call once a watcher covers it."""
+        self.clear(root)  # entries read before the watcher started may already be stale
+        with self._lock:
+            self._watched.append(os.path.join(os.path.abspath(root), ""))
+
+    def unwatch(self, root: str):
+        with self._lock:
+            prefix = os.path.join(os.path.abspath(root), "")
+            if prefix in self._watched:
+                self._watched.remove(prefix)
+
+    def clear(self, root: Optional[str] = None):
+        """Drop every entry, or only those below ``root``."""
+        with self._lock:
+            self._epoch += 1
+            if root is None:
+                self._entries.clear()
+                self.total_bytes = 0
+                return
+            prefix = os.path.join(os.path.abspath(root), "")
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                self._discard(key)
+
+    def _discard(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry["size"]
+
+_TS_PARSERS: Dict[str, object] = {}
+_SYMBOL_RE = re.compile(
+    r'^\s*(export\s+)?(default\s+)?(declare\s+)?(async\s+)?'
+    r'(function\*?|class|interface|type|enum|const|let|var|model|generator|datasource)\s+[\w$]+'
+)
+_DIRECTIVE_RE = re.compile(r'^\s*(["\'])use (client|server)\1;?\s*$')
+
+def _ts_parser(suffix: str):
+    """Return a cached tree-sitter parser for the suffix, or None if tree-sitter is not installed."""
+    grammar = "tsx" if suffix in (".tsx", ".jsx", ".js") else "typescript"
+    if grammar not in _TS_PARSERS:
+        try:
+            from tree_sitter import Language, Parser
+            import tree_sitter_typescript
+            parser = Parser()
+            parser.language = Language(
+                tree_sitter_typescript.language_tsx() if grammar == "tsx"
+                else tree_sitter_typescript.language_typescript()
+            )
+            _TS_PARSERS[grammar] = parser
+        except Exception:
+            _TS_PARSERS[grammar] = None
+    return _TS_PARSERS[grammar]
+
+def _ends_in_template(line: str, in_template: bool) -> bool:
+    """Whether a template literal is still open at the end of ``line``."""
+    quote = "`" if in_template else None
+    i = 0
+    while i < len(line):
+        ch = line[i]
+        if ch == "\\":
+            i += 2
+            continue
+        if quote:
+            if ch == quote:
+                quote = None
+        elif ch in "'\"`":
+            quote = ch
+        elif line.startswith("//", i):
+            break
+        i += 1
+    return quote == "`"
+
+def _strip_ts_comments(text: str, suffix: str) -> str:
+    parser = _ts_parser(suffix)
+    if parser is None:
+        # Without tree-sitter only remove comments that own their whole line, which is safe
+        # without knowing where strings and regex literals are; lines inside a multi-line
+        # template literal are string content and always kept.
+        kept, in_block, in_template = [], False, False
+        for line in text.splitlines():
+            stripped = line.strip()
+            if in_template:
+                kept.append(line)
+                in_template = _ends_in_template(line, True)
+                continue
+            if in_block:
+                in_block = "*/" not in stripped
+                continue
+            if stripped.startswith("/*") and not stripped.startswith("/*#"):
+                in_block = "*/" not in stripped
+                if in_block or stripped.endswith("*/"):
+                    continue
+            if stripped.startswith("//") and not stripped.startswith("///"):
+                continue
+            kept.append(line)
+            in_template = _ends_in_template(line, False)
+        return "\n".join(kept)
+
+    source = text.encode("utf-8")
+    tree = parser.parse(source)
+    ranges, stack = [], [tree.root_node]
+    while stack:
+        node = stack.pop()
+        if node.type == "comment":
+            if not source[node.start_byte:node.end_byte].startswith(b"///"):
+                ranges.append((node.start_byte, node.end_byte))
+        else:
+            stack.extend(node.children)
+
+    pieces, last = [], 0
+    for start, end in sorted(ranges):
+        pieces.append(source[last:start])
+        last = end
+    pieces.append(source[last:])
+    return b"".join(pieces).decode("utf-8", errors="replace")
+
+def _strip_prisma_comments(text: str) -> str:
+    lines = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith("//") and not stripped.startswith("///"):
+            continue
+        # Drop trailing comments and column alignment outside of string literals.
+        out, in_string, i = [], False, 0
+        while i < len(line):
+            ch = line[i]
+            if ch == '"' and (i == 0 or line[i - 1] != "\\"):
+                in_string = not in_string
+            elif not in_string and line.startswith("//", i) and not line.startswith("///", i):
+                break
+            elif not in_string and ch in " \t" and out and out[-1] in " \t":
+                i += 1
+                continue
+            out.append(ch)
+            i += 1
+        lines.append("".join(out))
+    return "\n".join(lines)
+
+class _MinifiedCache:
+    """Minified sources keyed by content hash, bounded by the bytes of minified text held."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: "OrderedDict[Tuple[str, str], str]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple[str, str]) -> Optional[str]:
+        with self._lock:
+            minified = self._entries.get(key)
+            if minified is not None:
+                self._entries.move_to_end(key)
+            return minified
+
+    def put(self, key: Tuple[str, str], minified: str):
+        with self._lock:
+            if key in self._entries or len(minified) > self.max_bytes:
+                return
+            self._entries[key] = minified
+            self.total_bytes += len(minified)
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+_MINIFIED = _MinifiedCache(CONFIG["MINIFY_CACHE_BYTES"])
+
+def minify_source(suffix: str, text: str) -> str:
+    """Strip comments and collapse whitespace for TS/JS (tree-sitter) and Prisma (line-based) sources."""
+    key = (suffix, hashlib.sha1(text.encode("utf-8")).hexdigest())
+    minified = _MINIFIED.get(key)
+    if minified is not None:
+        return minified
+    if suffix == ".prisma":
+        text = _strip_prisma_comments(text)
+    elif suffix in (".ts", ".tsx", ".js", ".jsx"):
+        text = _strip_ts_comments(text, suffix)
+    minified = "\n".join(line.rstrip() for line in text.splitlines() if line.strip())
+    _MINIFIED.put(key, minified)
+    return minified
+
+def split_import_block(text: str) -> Tuple[str, str]:
+    """Split leading directives/imports from the rest of a (minified) TS/JS source."""
+    lines = text.splitlines()
+    i, in_import = 0, False
+    while i < len(lines):
+        stripped = lines[i].strip()
+        if in_import:
+            in_import = not (stripped.endswith(";") or re.search(r"\bfrom\s+['\"]", stripped))
+        elif stripped.startswith("import ") or stripped.startswith("import{"):
+            in_import = not (stripped.endswith(";") or re.search(r"\bfrom\s+['\"]|^import\s+['\"]", stripped))
+        elif not _DIRECTIVE_RE.match(stripped):
+            break
+        i += 1
+    return "\n".join(lines[:i]), "\n".join(lines[i:])
+
+class ContextMinifier:
+    """Minifies context files and replaces repeated import blocks/files with back-references."""
+
     def __init__(self):
+        self._seen_imports: Dict[str, str] = {}
+        self._seen_bodies: Dict[str, str] = {}
+        self.report: List[Tuple[str, int, int]] = []
+
+    def minify(self, file_path: Path, text: str, tokens: int) -> str:
+        minified = minify_source(file_path.suffix, text)
+        body_hash = hashlib.sha1(minified.encode("utf-8")).hexdigest()
+        if body_hash in self._seen_bodies:
+            minified = f"// identical to {self._seen_bodies[body_hash]}"
+        else:
+            self._seen_bodies[body_hash] = str(file_path)
+            imports, rest = split_import_block(minified)
+            if imports and imports.count("\n") >= 1:
+                if imports in self._seen_imports:
+                    minified = f"// imports: same as {self._seen_imports[imports]}\n{rest}"
+                else:
+                    self._seen_imports[imports] = str(file_path)
+
+        self.report.append((str(file_path), tokens, estimate_tokens(minified)))
+        return minified
+
+    def print_report(self):
+        for path, before, after in self.report:
+            saved = before - after
+            print(f"✂️ {path}: {before} → {after} tokens (-{saved}, {saved / max(1, before):.0%})")
+        total_before = sum(before for _, before, _ in self.report)
+        total_after = sum(after for _, _, after in self.report)
+        if self.report:
+            print(f"✂️ Context minified: {total_before} → {total_after} tokens")
+
+_DECLARATION_NAME_RE = re.compile(
+    r'\b(?:function\*?|class|interface|type|enum|const|let|model)\s+([A-Za-z_$][\w$]*)'
+)
+
+class IndexRecord(TypedDict):
+    mtime_ns: int
+    size: int
+    terms: List[str]
+
+class ProjectIndex:
+    """File index with per-file lexical terms and scoring features, persisted as a snapshot.
+
+    The snapshot also stores a cheap tree fingerprint: the mtime of every walked directory
+    plus git's HEAD and index mtime. When all of those still match, the set of files can't
+    have changed, so only the paths git reports as modified or untracked are re-stat'ed.
+    Otherwise (or outside git) every non-ignored source file is stat'ed once; files whose
+    mtime and size match the snapshot reuse their stored terms, and only new or changed
+    files are re-read.
+    """
+
+    VERSION = 2  # 2: ignore files evaluated in order (last match wins)
+
+    def __init__(self, snapshot_path: str = CONFIG["INDEX_SNAPSHOT"], root: str = "."):
+        self.snapshot_path = Path(snapshot_path)
+        self.root = root
+        self.matcher = matcher_for(root)
+        # (files, postings) published together as one immutable snapshot; see refresh().
+        self._state: Tuple[Mapping[str, IndexRecord], Mapping[str, FrozenSet[str]]] = (
+            MappingProxyType({}), MappingProxyType({})
+        )
+        self._write_lock = threading.Lock()
+        self._tree: dict = {}
+        self.dirty = False
+
+    @property
+    def files(self) -> Mapping[str, IndexRecord]:
+        return self._state[0]
+
+    @property
+    def postings(self) -> Mapping[str, FrozenSet[str]]:
+        return self._state[1]
+
+    def _config_key(self) -> str:
+        rules = json.dumps([sorted(CONFIG["IGNORED_DIRS"]), CONFIG["IGNORED_FILE_PATTERNS"],
+                            list(CONFIG["SUPPORTED_EXTENSIONS"]), list(CONFIG["IGNORE_FILES"]), self.root])
+        for name in CONFIG["IGNORE_FILES"]:
+            try:
+                rules += (Path(self.root) / name).read_text(encoding="utf-8")
+            except OSError:
+                pass
+        return hashlib.sha1(rules.encode("utf-8")).hexdigest()
+
+    def _read_snapshot(self) -> Optional[dict]:
+        try:
+            raw = self.snapshot_path.read_bytes()
+        except OSError:
+            return None
+        try:
+            try:
+                import msgpack
+                data = msgpack.unpackb(raw, raw=False)
+            except ImportError:
+                data = json.loads(raw.decode("utf-8"))
+        except Exception as e:
+            print(f"⚠️ Ignoring unreadable index snapshot: {e}")
+            return None
+        if data.get("version") != self.VERSION or data.get("config") != self._config_key():
+            return None
+        return data
+
+    def save(self, force: bool = False):
+        if not (self.dirty or force):
+            return
+        data = {"version": self.VERSION, "config": self._config_key(), "tree": self._tree,
+                "files": dict(self.files)}
+        try:
+            try:
+                import msgpack
+                payload = msgpack.packb(data, use_bin_type=True)
+            except ImportError:
+                payload = json.dumps(data, separators=(",", ":")).encode("utf-8")
+            self.snapshot_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.snapshot_path.with_suffix(".tmp")
+            tmp_path.write_bytes(payload)
+            os.replace(tmp_path, self.snapshot_path)
+            self.dirty = False
+        except Exception as e:
+            print(f"⚠️ Error saving index snapshot: {e}")
+
+    def _git(self, *args: str) -> Optional[str]:
+        try:
+            result = subprocess.run(["git", "-C", self.root, *args], capture_output=True, text=True,
+                                    encoding="utf-8", errors="replace", timeout=30)
+        except (OSError, subprocess.SubprocessError):
+            return None
+        return result.stdout if result.returncode == 0 else None
+
+    def _git_state(self) -> Optional[dict]:
+        """HEAD and index mtime; staging, commits and checkouts all change one of them."""
+        output = self._git("rev-parse", "HEAD", "--git-path", "index")
+        if output is None:
+            return None
+        try:
+            head, index_path = output.splitlines()[:2]
+            return {"head": head, "index_mtime_ns": (Path(self.root) / index_path).stat().st_mtime_ns}
+        except (ValueError, OSError):
+            return None
+
+    def _reconcile_unchanged_tree(self, previous: Dict[str, IndexRecord], tree: dict,
+                                  git_state: Optional[dict]) -> Optional[Tuple[Dict[str, IndexRecord], int]]:
+        """Reuse the snapshot if its fingerprint still holds; None means a full walk is needed."""
+        if git_state is None or tree.get("git") != git_state or not tree.get("dirs"):
+            return None
+        for directory, mtime_ns in tree["dirs"].items():
+            try:
+                if os.stat(directory).st_mtime_ns != mtime_ns:
+                    return None
+            except OSError:
+                return None
+        # No directory changed, so no file was added, removed or renamed; in-place edits
+        # are the only possible change, and git lists those (tracked or untracked).
+        output = self._git("ls-files", "-z", "--modified", "--others", "--exclude-standard")
+        if output is None:
+            return None
+        files, reindexed = dict(previous), 0
+        for rel in output.split("\0"):
+            path = str(Path(self.root) / rel)
+            old = files.get(path)
+            if not rel or old is None:
+                continue
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            if old["mtime_ns"] != stat.st_mtime_ns or old["size"] != stat.st_size:
+                files[path] = self._index_file(path, stat.st_mtime_ns, stat.st_size)
+                reindexed += 1
+        return files, reindexed
+
+    def load(self) -> Tuple[int, int]:
+        """Load the snapshot and reconcile it with the tree; returns (files, reindexed)."""
+        snapshot = self._read_snapshot() or {}
+        previous: Dict[str, IndexRecord] = snapshot.get("files", {})
+        git_state = self._git_state()
+        reused = self._reconcile_unchanged_tree(previous, snapshot.get("tree", {}), git_state)
+        if reused is not None:
+            files, reindexed = reused
+            tree = snapshot["tree"]
+        else:
+            files, reindexed, tree = self._walk_tree(previous)
+            tree["git"] = git_state
+
+        postings: Dict[str, Set[str]] = {}
+        for path, record in files.items():
+            for term in record["terms"]:
+                postings.setdefault(term, set()).add(path)
+
+        with self._write_lock:
+            self._state = (MappingProxyType(files),
+                           MappingProxyType({term: frozenset(paths) for term, paths in postings.items()}))
+            # Every record not re-indexed came from the snapshot, so equal counts mean nothing was removed.
+            self._tree = tree
+            self.dirty = reindexed > 0 or len(files) != len(previous) or tree != snapshot.get("tree")
+        return len(files), reindexed
+
+    def _walk_tree(self, previous: Dict[str, IndexRecord]) -> Tuple[Dict[str, IndexRecord], int, dict]:
+        """Stat every non-ignored source file, re-indexing those the snapshot doesn't match."""
+        files: Dict[str, IndexRecord] = {}
+        dirs: Dict[str, int] = {}
+        reindexed = 0
+        # The snapshot (and the other caches next to it) are rewritten every run; their
+        # directory would never match, and it holds nothing that is indexed.
+        cache_dir = os.path.abspath(self.snapshot_path.parent)
+        try:
+            dirs[str(Path(self.root))] = os.stat(self.root).st_mtime_ns
+        except OSError:
+            pass
+
+        for item in walk(self.root, self.matcher, include_dirs=True, workers=CONFIG["WALK_WORKERS"]):
+            if not item.is_dir and not item.rel_path.endswith(CONFIG["SUPPORTED_EXTENSIONS"]):
+                continue
+            try:
+                stat = item.entry.stat()
+            except OSError:
+                continue
+            path = str(Path(item.path))
+            if item.is_dir:
+                absolute = os.path.abspath(path)
+                if absolute != cache_dir and not absolute.startswith(cache_dir + os.sep):
+                    dirs[path] = stat.st_mtime_ns
+                continue
+            old = previous.get(path)
+            if old and old["mtime_ns"] == stat.st_mtime_ns and old["size"] == stat.st_size:
+                files[path] = old
+            else:
+                files[path] = self._index_file(path, stat.st_mtime_ns, stat.st_size)
+                reindexed += 1
+        return files, reindexed, {"dirs": dirs}
+
+    @staticmethod
+    def _index_file(path: str, mtime_ns: int, size: int) -> IndexRecord:
+        terms = lexical_terms(path)
+        if size <= CONFIG["INDEX_MAX_SCAN_BYTES"]:
+            try:
+                text = Path(path).read_text(encoding="utf-8", errors="replace")
+                terms |= lexical_terms(" ".join(set(_DECLARATION_NAME_RE.findall(text))))
+            except OSError:
+                pass
+        return {"mtime_ns": mtime_ns, "size": size, "terms": sorted(terms)}
+
+    def refresh(self, file_path: str) -> bool:
+        """Re-index one file after a watcher event; returns True if it was added or dropped."""
+        rel = self.matcher.relative(file_path)
+        if rel is None:
+            return False
+        path = str(Path(self.root) / rel)
+        try:
+            stat = os.stat(path)
+            record: Optional[IndexRecord] = self._index_file(path, stat.st_mtime_ns, stat.st_size)
+        except OSError:
+            record = None
+
+        with self._write_lock:
+            files, postings = dict(self._state[0]), dict(self._state[1])
+            old = files.pop(path, None)
+            if old is None and record is None:
+                return False
+            for term in old["terms"] if old else ():
+                postings[term] = postings[term] - {path}
+                if not postings[term]:
+                    del postings[term]
+            if record is not None:
+                files[path] = record
+                for term in record["terms"]:
+                    postings[term] = postings.get(term, frozenset()) | {path}
+            self._state = (MappingProxyType(files), MappingProxyType(postings))
+            self.dirty = True
+        return (old is None) != (record is None)
+
+    def paths(self) -> List[Path]:
+        return [Path(path) for path in self.files]
+
+    def terms_for(self, path: str) -> List[str]:
+        record = self.files.get(path)
+        return record["terms"] if record else []
+
+    def lookup(self, terms: Set[str]) -> Counter:
+        """Paths ranked by how many of ``terms`` they contain (substring match on index terms)."""
+        hits: Counter = Counter()
+        postings = self.postings
+        for term in terms:
+            matched = set()
+            for indexed, paths in postings.items():
+                if term in indexed:
+                    matched |= paths
+            hits.update(matched)
+        return hits
+
+class SelectionCache:
+    """Past question -> selected files results, matched by Jaccard similarity of lexical terms."""
+
+    def __init__(self, path: str = CONFIG["SELECTION_CACHE"], max_entries: int = CONFIG["SELECTION_CACHE_SIZE"],
+                 threshold: float = CONFIG["SELECTION_CACHE_THRESHOLD"]):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False
+        self._entries: "OrderedDict[Tuple[str, ...], dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        for entry in data.get("entries", [])[-self.max_entries:]:
+            self._entries[tuple(entry["terms"])] = entry
+
+    def save(self):
+        if not self.dirty:
+            return
+        with self._lock:
+            entries = list(self._entries.values())
+            self.dirty = False
+        try:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self.path.write_text(json.dumps({"entries": entries}, indent=1), encoding="utf-8")
+        except Exception as e:
+            print(f"⚠️ Error saving selection cache: {e}")
+
+    def lookup(self, question: str, max_files: int, is_valid: Callable[[str], bool]) -> Optional[List[str]]:
+        """Files selected for the most similar past question, minus files that no longer exist."""
+        terms = lexical_terms(question)
+        if not terms:
+            return None
+        best, best_score, candidates = None, self.threshold, []
+        with self._lock:
+            for key, entry in self._entries.items():
+                score = len(terms.intersection(key)) / len(terms.union(key))
+                if score >= best_score:
+                    best, best_score = key, score
+            if best:
+                # Copied under the lock: store() may evict or replace the entry once it is released.
+                candidates = list(self._entries[best]["files"])
+
+        # is_valid touches the filesystem, so it runs outside the lock.
+        files = [f for f in candidates if is_valid(f)][:max_files]
+        with self._lock:
+            if not files:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if best in self._entries:
+                self._entries.move_to_end(best)
+        print(f"♻️ Reusing file selection from a similar question (similarity {best_score:.2f})")
+        return files
+
+    def store(self, question: str, files: List[str]):
+        key = tuple(sorted(lexical_terms(question)))
+        if not key or not files:
+            return
+        with self._lock:
+            self._entries[key] = {"terms": list(key), "question": question, "files": list(files),
+                                  "timestamp": datetime.now().isoformat()}
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self.dirty = True
+
+class FileSummarizer:
+    """One-line file summaries generated by the small model while the user is idle.
+
+    Summaries are stored by content hash, so a file is only re-summarised after its content
+    changes. Generation is throttled by a token bucket of CONFIG["SUMMARY_TOKENS_PER_MINUTE"]
+    and pauses whenever an interactive request is running or was made recently.
+    """
+
+    def __init__(self, context_manager, path: str = CONFIG["SUMMARY_CACHE"]):
+        self.context_manager = context_manager
+        self.path = Path(path)
+        self._summaries: Mapping[str, str] = MappingProxyType({})
+        # path -> [mtime_ns, size, content hash] as of the last summary
+        self._hashes: Mapping[str, list] = MappingProxyType({})
+        # path -> (mtime_ns, size) of a version that could not be read or summarised; retried once it changes
+        self._skipped: Dict[str, Tuple[int, int]] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._tokens = float(CONFIG["SUMMARY_TOKENS_PER_MINUTE"])
+        self._refilled = time.monotonic()
+        self._unsaved = 0
+        self._save_lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            data = json.loads(self.path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        self._summaries = MappingProxyType(data.get("summaries", {}))
+        self._hashes = MappingProxyType(data.get("files", {}))
+
+    def save(self):
+        # Called from the summarizer thread and from stop(); the lock keeps the two from
+        # interleaving, and the atomic replace means a process exit mid-write can't leave
+        # a truncated file behind.
+        with self._save_lock:
+            if not self._unsaved:
+                return
+            unsaved = self._unsaved
+            live = set(self._hashes[path][2] for path in self._hashes)
+            data = {"summaries": {h: text for h, text in self._summaries.items() if h in live},
+                    "files": dict(self._hashes)}
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = self.path.with_suffix(".tmp")
+                tmp_path.write_text(json.dumps(data, indent=1), encoding="utf-8")
+                os.replace(tmp_path, self.path)
+                self._unsaved -= unsaved
+            except Exception as e:
+                print(f"⚠️ Error saving file summaries: {e}")
+
+    def summary_for(self, path: str) -> Optional[str]:
+        """Summary for the file's current content, or None if missing or stale."""
+        record = self.context_manager.index_record(path)
+        known = self._hashes.get(path)
+        if not record or not known or known[0] != record["mtime_ns"] or known[1] != record["size"]:
+            return None
+        return self._summaries.get(known[2])
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="FileSummarizer")
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            if self._thread.is_alive():
+                print("⚠️ File summarizer is still waiting on the model; saving the summaries made so far")
+        self.save()
+
+    def _take_tokens(self, needed: int) -> bool:
+        now = time.monotonic()
+        rate = CONFIG["SUMMARY_TOKENS_PER_MINUTE"] / 60
+        self._tokens = min(CONFIG["SUMMARY_TOKENS_PER_MINUTE"], self._tokens + (now - self._refilled) * rate)
+        self._refilled = now
+        if self._tokens < needed:
+            self._stop.wait((needed - self._tokens) / rate)
+            return False
+        self._tokens -= needed
+        return True
+
+    def _pending(self) -> List[str]:
+        indexes = [shard.index for shard in self.context_manager.shards]
+        pending = [path for index in indexes if index is not None
+                   for path, record in index.files.items()
+                   if self._skipped.get(path) != (record["mtime_ns"], record["size"])
+                   and self.summary_for(path) is None]
+        weight = lambda p: self.context_manager._weight_entry(p).get("weight", 0)
+        return sorted(pending, key=weight, reverse=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            if not self.context_manager.is_idle(CONFIG["SUMMARY_IDLE_SECONDS"]):
+                self._stop.wait(1)
+                continue
+            pending = self._pending()
+            if not pending:
+                self.save()
+                self._stop.wait(30)
+                continue
+            for path in pending:
+                if self._stop.is_set() or not self.context_manager.is_idle(CONFIG["SUMMARY_IDLE_SECONDS"]):
+                    break
+                if not self._summarize(path):
+                    break
+            if self._unsaved >= 20:
+                self.save()
+
+    def _summarize(self, path: str) -> bool:
+        record = self.context_manager.index_record(path)
+        if not record:
+            return True
+        cached = self.context_manager.content_cache.get(path, store=False)
+        if cached is None:
+            self._skipped[path] = (record["mtime_ns"], record["size"])
+            return True
+        digest = hashlib.sha1(cached["text"].encode("utf-8")).hexdigest()
+        summary = self._summaries.get(digest)
+
+        if summary is None:
+            prompt = (
+                "<start_of_turn>user\n"
+                "Summarize this file in one line of at most 20 words: its purpose and main exports.\n"
+                f"File: {path}\n```\n{cached['text'][:CONFIG['SUMMARY_MAX_FILE_CHARS']]}\n```<end_of_turn>\n"
+                "<start_of_turn>model>"
+            )
+            model = CONFIG["MODELS"]["file_selector"]
+            if not self._take_tokens(OllamaClient.measure_prompt(model, prompt) + CONFIG["NUM_PREDICT"]["summary"]):
+                return False
+            try:
+                response = OllamaClient.call(model=model, prompt=prompt, max_retries=1, request_type="summary")
+            except Exception:
+                self._stop.wait(60)
+                return False
+            summary = " ".join((response or "").split())[:200]
+            if not summary:
+                self._skipped[path] = (record["mtime_ns"], record["size"])
+                return True
+            self._summaries = MappingProxyType({**self._summaries, digest: summary})
+
+        self._hashes = MappingProxyType({**self._hashes, path: [record["mtime_ns"], record["size"], digest]})
+        self._unsaved += 1
+        return True
+
+class ProjectMap:
+    """Cached directory tree rendered as a compressed, relevance-trimmed map for the selector prompt."""
+
+    def __init__(self, role_for, root: str = ".", index: Optional[ProjectIndex] = None,
+                 summary_for: Optional[Callable[[str], Optional[str]]] = None):
+        self.root = Path(root)
+        self._role_for = role_for
+        self._index = index
+        self._summary_for = summary_for or (lambda path: None)
+        self._tree: Optional[dict] = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._tree = None
+
+    def tree(self) -> dict:
+        tree = self._tree
+        if tree is None:
+            with self._lock:
+                if self._tree is None:
+                    self._tree = self._build()
+                tree = self._tree
+        return tree
+
+    @staticmethod
+    def _node(path: Path) -> dict:
+        return {"path": path, "dirs": {}, "files": [], "roles": Counter()}
+
+    def _build(self) -> dict:
+        root = self._node(self.root)
+        files = self._index.paths() if self._index is not None else iter_source_files(root=str(self.root))
+        for file_path in sorted(files, key=lambda p: p.parts):
+            role = self._role_for(file_path)
+            parts = file_path.relative_to(self.root).parts
+            node = root
+            node["roles"][role] += 1
+            for depth in range(1, len(parts)):
+                node = node["dirs"].setdefault(parts[depth - 1], self._node(self.root.joinpath(*parts[:depth])))
+                node["roles"][role] += 1
+            node["files"].append((str(file_path), role))
+        return root
+
+    def render(self, question: str, token_budget: int, weights: Optional[Dict] = None) -> str:
+        """Render the map, expanding only branches whose paths lexically match the question.
+
+        Lines are ranked so that top-level summaries survive first, then matching files,
+        then collapsed subtrees; the lowest-ranked lines are dropped to fit ``token_budget``.
+        """
+        terms = lexical_terms(question)
+        weights = weights or {}
+        order = itertools.count()
+        lines: List[Tuple[float, int, str]] = []
+
+        indexed = self._index.lookup(terms) if self._index is not None and terms else Counter()
+
+        def describe(path: str, role: str) -> str:
+            return self._summary_for(path) or role
+
+        def file_score(path: str, role: str) -> int:
+            haystack = f"{path} {describe(path, role)}".lower()
+            return max(indexed.get(path, 0), sum(1 for term in terms if term in haystack))
+
+        def subtree_score(node: dict) -> int:
+            score = sum(file_score(p, r) for p, r in node["files"])
+            return score + sum(subtree_score(child) for child in node["dirs"].values())
+
+        def summary(node: dict) -> str:
+            roles = ", ".join(f"{count} {role}" for role, count in node["roles"].most_common(3))
+            extra = len(node["roles"]) - 3
+            if extra > 0:
+                roles += f", +{extra} more roles"
+            return f"{node['path'].as_posix()}/ [{sum(node['roles'].values())} files: {roles}]"
+
+        def visit(node: dict, depth: int, score: int) -> float:
+            # Fold pass-through directories (no files, single child) into their child.
+            while depth > 0 and not node["files"] and len(node["dirs"]) == 1:
+                node = next(iter(node["dirs"].values()))
+            position = next(order)
+            best = 1000.0 - depth if depth <= 1 else (100.0 + score if score else 10.0 - depth)
+
+            # A header always outranks its children so no line is kept without its parent.
+            if depth <= 1 or score > 0:
+                for path, role in node["files"]:
+                    hits = file_score(path, role)
+                    bonus = min(float(weights.get(path, {}).get("weight", 0)), 50) / 100
+                    priority = (200.0 + hits if hits else 1.0) + bonus
+                    lines.append((priority, next(order), f"{'  ' * (depth + 1)}{path} - {describe(path, role)}"))
+                    best = max(best, priority)
+                for child in node["dirs"].values():
+                    best = max(best, visit(child, depth + 1, subtree_score(child)))
+
+            priority = best + 0.5
+            lines.append((priority, position, f"{'  ' * depth}{summary(node)}"))
+            return priority
+
+        visit(self.tree(), 0, 1)
+
+        kept: List[Tuple[int, str]] = []
+        used = 0
+        for priority, position, line in sorted(lines, key=lambda x: (-x[0], x[1])):
+            cost = estimate_tokens(line) + 1
+            if used + cost > token_budget:
+                break
+            kept.append((position, line))
+            used += cost
+
+        omitted = len(lines) - len(kept)
+        rendered = [line for _, line in sorted(kept)]
+        if omitted:
+            rendered.append(f"... ({omitted} entries omitted)")
+        return "\n".join(rendered)
+
+class WorkspaceShard:
+    """One workspace root with its own index, project map, weights and file watch.
+
+    Secondary roots keep their snapshot and weights under CONFIG["SHARD_DIR"], are loaded
+    the first time a question or tracked file touches them and are unloaded again after
+    CONFIG["SHARD_IDLE_SECONDS"] without use. The primary root stays loaded for the session.
+    """
+
+    def __init__(self, context_manager, root: str, primary: bool = False):
+        self.context_manager = context_manager
+        self.root = root
+        self.primary = primary
+        self.matcher = matcher_for(root)
+        self.name = Path(self.matcher.root).name
+        if primary:
+            self.snapshot_path, self.weights_path = CONFIG["INDEX_SNAPSHOT"], CONFIG["WEIGHT_CACHE"]
+        else:
+            stem = f"{self.name}-{hashlib.sha1(self.matcher.root.encode('utf-8')).hexdigest()[:8]}"
+            self.snapshot_path = os.path.join(CONFIG["SHARD_DIR"], f"{stem}.snapshot")
+            self.weights_path = os.path.join(CONFIG["SHARD_DIR"], f"{stem}.weights.json")
+        self.index: Optional[ProjectIndex] = None
+        self.project_map: Optional[ProjectMap] = None
+        # Terms that bring the shard back into a question; kept across unloads (see _routing_terms).
+        self.vocabulary: FrozenSet[str] = frozenset(lexical_terms(self.name))
+        self.last_used = time.monotonic()
+        self._watch = None
+        self._load_lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._publish_weights({})
+
+    @property
+    def loaded(self) -> bool:
+        return self.index is not None
+
+    def contains(self, path) -> bool:
+        return self.matcher.relative(path) is not None
+
+    def load(self) -> "WorkspaceShard":
+        self.last_used = time.monotonic()
+        if self.index is not None:
+            return self
+        with self._load_lock:
+            if self.index is None:
+                started = time.perf_counter()
+                self._publish_weights({path: MappingProxyType(dict(entry))
+                                       for path, entry in self._load_cache()["files"].items()})
+                index = ProjectIndex(self.snapshot_path, self.root)
+                total, reindexed = index.load()
+                index.save()
+                self.project_map = ProjectMap(self.context_manager._file_role, self.root, index,
+                                              self.context_manager.summarizer.summary_for)
+                self.index = index
+                self.vocabulary = self._routing_terms(index)
+                self._watch = self.context_manager._watch(self)
+                print(f"📇 Indexed {total} files in {self.root} ({reindexed} updated) "
+                      f"in {(time.perf_counter() - started) * 1000:.0f} ms")
+        return self
+
+    def _routing_terms(self, index: ProjectIndex) -> FrozenSet[str]:
+        """The shard's name plus index terms no other loaded root has.
+
+        Terms shared with the primary root ("user", "service", "form") would pull the shard
+        into nearly every question, so only distinctive ones route: the
+        CONFIG["SHARD_ROUTING_TERMS"] found in most of this root's files, and those of its
+        CONFIG["SHARD_ROUTING_FILES"] highest-weighted files.
+        """
+        others: Set[str] = set()
+        for shard in self.context_manager.shards:
+            if shard is not self and shard.index is not None:
+                others.update(shard.index.postings)
+        distinctive = sorted((term for term in index.postings if term not in others),
+                             key=lambda term: len(index.postings[term]), reverse=True)
+        terms = set(lexical_terms(self.name)) | set(distinctive[:CONFIG["SHARD_ROUTING_TERMS"]])
+        weighted = sorted(self.weights["files"].items(), key=lambda item: item[1].get("weight", 0), reverse=True)
+        for path, entry in weighted[:CONFIG["SHARD_ROUTING_FILES"]]:
+            record = index.files.get(path)
+            if record and entry.get("weight", 0) > 0:
+                terms.update(term for term in record["terms"] if term not in others)
+        return frozenset(terms)
+
+    def unload(self):
+        """Persist and drop the in-memory state; the primary root is never unloaded."""
+        with self._load_lock:
+            if self.primary or self.index is None:
+                return
+            self.context_manager._unwatch(self._watch)
+            self._watch = None
+            self.save()
+            self.index = None
+            self.project_map = None
+            self._publish_weights({})
+            self.context_manager.content_cache.clear(self.root)
+            print(f"💤 Unloaded idle workspace root {self.root}")
+
+    def save(self):
+        # Under the load lock so a save at exit can't overlap the reaper's unload-and-save.
+        with self._load_lock:
+            index = self.index
+            if index is not None:
+                index.save()
+                self._save_cache()
+
+    def _load_cache(self) -> FileCache:
+        cache_file = Path(self.weights_path)
+        if cache_file.exists():
+            try:
+                with open(cache_file) as f:
+                    data = json.load(f)
+                    return {"files": data.get("files", {}), 
+                            "last_updated": datetime.now().isoformat()}
+            except Exception as e:
+                print(f"⚠️ Error loading cache: {e}")
+        return {"files": {}, "last_updated": datetime.now().isoformat()}
+
+    @property
+    def weights(self) -> Mapping:
+        """Current read-only weights snapshot; safe to iterate from any thread."""
+        return self._weights
+
+    def _publish_weights(self, files: Dict[str, Mapping]):
+        # ``files`` must be a fresh dict that nothing else holds a reference to.
+        self._weights = MappingProxyType({
+            "files": MappingProxyType(files),
+            "last_updated": datetime.now().isoformat()
+        })
+
+    def modify_weights(self, changes: Dict[str, Callable[[Mapping], dict]]):
+        """Copy-on-write update: each callback maps the old entry (or {}) to the new one."""
+        with self._write_lock:
+            files = dict(self._weights["files"])
+            for path, change in changes.items():
+                files[path] = MappingProxyType(change(files.get(path, MappingProxyType({}))))
+            self._publish_weights(files)
+
+    def _save_cache(self):
+        try:
+            with self._save_lock:
+                # Taken under the lock so a slower save of an older snapshot can't land last.
+                weights = self.weights
+                Path(self.weights_path).parent.mkdir(parents=True, exist_ok=True)
+                tmp_path = f"{self.weights_path}.tmp"
+                with open(tmp_path, "w") as f:
+                    json.dump(weights, f, indent=2, ensure_ascii=False, default=dict)
+                os.replace(tmp_path, self.weights_path)
+        except Exception as e:
+            print(f"⚠️ Error saving cache: {e}")
+
+class ProjectContextManager:
+    def __init__(self, roots: Optional[List[str]] = None):
         self.tech_stack = self._detect_tech_stack()
-        self.weights = self._load_cache()
-        self.active_files: Set[str] = set()
-        self.recent_questions: List[Tuple[str, str]] = []
+        # Shared state is published as immutable snapshots: readers take the current
+        # reference without locking, writers copy, modify and swap under _write_lock.
+        self._write_lock = threading.Lock()
+        self.active_files: FrozenSet[str] = frozenset()
+        self.summarizer = FileSummarizer(self)
+        self.content_cache = FileContentCache()
+        self.watch_events: deque = deque(maxlen=1000)
         self._init_file_watcher()
+        extra_roots = roots if roots is not None else CONFIG["WORKSPACE_ROOTS"]
+        self.shards = [WorkspaceShard(self, ".", primary=True)] + [
+            WorkspaceShard(self, root) for root in dict.fromkeys(extra_roots)
+            if os.path.abspath(root) != os.path.abspath(".")
+        ]
+        self.primary = self.shards[0].load()
+        self._interactive_requests = 0
+        self._last_interactive = time.monotonic()
+        self.selection_cache = SelectionCache()
+        self.minify_context = CONFIG["MINIFY_CONTEXT"]
+        self.last_minify_report: List[Tuple[str, int, int]] = []
+        self.last_context_timings: Dict[str, float] = {}
+        self._diff_cache: Dict[str, List[str]] = {}
+        self.recent_questions: List[Tuple[str, str]] = []
         self._init_git_info()
         self.ollama_available = self._validate_ollama_connection()
+        if self.ollama_available and CONFIG["SUMMARY_BACKGROUND"]:
+            self.summarizer.start()
+        self._reaper_stop = threading.Event()
+        self._reaper: Optional[threading.Thread] = None
+        self._cleaned_up = False
+        if len(self.shards) > 1:
+            self._reaper = threading.Thread(target=self._reap_idle_shards, daemon=True, name="ShardReaper")
+            self._reaper.start()
+
+    @property
+    def index(self) -> ProjectIndex:
+        return self.primary.index
+
+    @property
+    def project_map(self) -> ProjectMap:
+        return self.primary.project_map
+
+    @contextlib.contextmanager
+    def interactive(self):
+        """Mark an interactive request so background work yields to it."""
+        with self._write_lock:
+            self._interactive_requests += 1
+        try:
+            yield
+        finally:
+            with self._write_lock:
+                self._interactive_requests -= 1
+                self._last_interactive = time.monotonic()
+
+    def is_idle(self, seconds: float) -> bool:
+        return not self._interactive_requests and time.monotonic() - self._last_interactive >= seconds
 
     def _init_file_watcher(self):
         try:
             from watchdog.observers import Observer
-            handler = EnhancedFileChangeHandler(self)
             self.observer = Observer()
-            self.observer.schedule(handler, path='.', recursive=True)
             self.observer.start()
             print("🔍 File watcher initialized")
         except Exception as e:
             print(f"⚠️ Failed to initialize file watcher: {e}")
 
+    def _watch(self, shard: WorkspaceShard):
+        if not hasattr(self, 'observer'):
+            return None
+        try:
+            watch = self.observer.schedule(EnhancedFileChangeHandler(self, shard), path=shard.root, recursive=True)
+            self.content_cache.watch(shard.root)
+            return watch
+        except Exception as e:
+            print(f"⚠️ Failed to watch {shard.root}: {e}")
+            return None
+
+    def _unwatch(self, watch):
+        if watch is not None and hasattr(self, 'observer'):
+            self.content_cache.unwatch(watch.path)
+            try:
+                self.observer.unschedule(watch)
+            except Exception as e:
+                print(f"⚠️ Failed to stop watching: {e}")
+
+    def shard_for(self, path) -> WorkspaceShard:
+        """The innermost workspace root containing ``path``; the primary root otherwise."""
+        best = self.shards[0]
+        for shard in self.shards[1:]:
+            if len(shard.matcher.root) > len(best.matcher.root) and shard.contains(path):
+                best = shard
+        return best
+
+    def _active_shards(self, question: str) -> List[WorkspaceShard]:
+        """Roots a question touches: the primary root, roots whose name or known terms match
+        the question (loaded on demand), and roots that are still loaded."""
+        terms = lexical_terms(question)
+        shards = []
+        for shard in self.shards:
+            if shard.primary or terms & shard.vocabulary:
+                shards.append(shard.load())
+            elif shard.loaded:
+                shards.append(shard)
+        return shards
+
+    def _reap_idle_shards(self):
+        while not self._reaper_stop.wait(60):
+            if self._interactive_requests:
+                continue
+            now = time.monotonic()
+            for shard in self.shards:
+                if shard.loaded and not shard.primary and now - shard.last_used >= CONFIG["SHARD_IDLE_SECONDS"]:
+                    shard.unload()
+
+    def index_record(self, path) -> Optional[IndexRecord]:
+        index = self.shard_for(path).index
+        return index.files.get(str(Path(path))) if index is not None else None
+
     def _init_git_info(self):
         self.git_branch = self._get_git_branch()
         self.git_changes = self._get_git_changes()
 
-    def _get_git_branch(self) -> str:
+    def _run_git(self, *args: str) -> Optional[str]:
         try:
             result = subprocess.run(
-                ["git", "branch", "--show-current"],
+                ["git", *args],
                 capture_output=True,
                 text=True,
+                encoding="utf-8",
+                errors="replace",
                 check=True
             )
-            return result.stdout.strip() or "main"
+            return result.stdout
         except:
-            return "main"
+            return None
+
+    def _get_git_branch(self) -> str:
+        return (self._run_git("branch", "--show-current") or "").strip() or "main"
 
     def _get_git_changes(self) -> List[str]:
-        try:
-            result = subprocess.run(
-                ["git", "status", "--porcelain"],
-                capture_output=True,
-                text=True,
-                check=True
-            )
-            return [line.strip() for line in result.stdout.splitlines() if line.strip()]
-        except:
-            return []
+        # -uall lists each file inside a new directory instead of collapsing it to "dir/".
+        output = self._run_git("status", "--porcelain", "-uall") or ""
+        return [line.strip() for line in output.splitlines() if line.strip()]
+
+    def _get_git_diff(self, ref_range: Optional[str] = None) -> str:
+        """Unified diff of the working tree against HEAD, or of ``ref_range`` (e.g. ``main..HEAD``)."""
+        args = ["diff", "--no-color", "--no-ext-diff", f"--unified={CONFIG['DIFF_CONTEXT_LINES']}"]
+        return self._run_git(*args, ref_range or "HEAD") or ""
+
+    def _new_side_lines(self, path: str, ref_range: Optional[str]) -> List[str]:
+        """Lines of ``path`` on the new side of the diff, for locating enclosing symbols."""
+        if not ref_range or ".." not in ref_range:
+            # A single ref is diffed against the working tree.
+            cached = self.content_cache.get(path)
+            return cached["text"].splitlines() if cached else []
+        new_ref = ref_range.split("..")[-1].lstrip(".") or "HEAD"
+        return (self._run_git("show", f"{new_ref}:{path}") or "").splitlines()
+
+    def _is_context_path(self, path: str) -> bool:
+        return path.endswith(CONFIG["SUPPORTED_EXTENSIONS"]) and not project_matcher().matches(path)
+
+    def get_diff_context(self, ref_range: Optional[str] = None) -> List[str]:
+        """Context blocks built from diff hunks plus enclosing-symbol lines, cached by diff hash.
+
+        Without ``ref_range`` the working tree is diffed against HEAD and untracked source
+        files are included whole. Hunks and files are added in diff order until
+        CONFIG["MAX_CONTEXT_TOKENS"] is reached; the rest are counted in a closing note.
+        """
+        diff = self._get_git_diff(ref_range)
+        untracked = []
+        if not ref_range:
+            self.git_changes = self._get_git_changes()
+            untracked = [line[3:].strip('"') for line in self.git_changes
+                         if line.startswith("??") and self._is_context_path(line[3:].strip('"'))]
+
+        digest = hashlib.sha1((ref_range or "").encode("utf-8"))
+        digest.update(diff.encode("utf-8"))
+        for path in untracked:
+            cached = self.content_cache.get(path)
+            digest.update(f"\0{path}\0{cached['text'] if cached else ''}".encode("utf-8"))
+        key = digest.hexdigest()
+        if key in self._diff_cache:
+            return self._diff_cache[key]
+
+        blocks = []
+        budget = CONFIG["MAX_CONTEXT_TOKENS"]
+        omitted = 0
+        for path, hunks in self._parse_diff(diff):
+            if not self._is_context_path(path):
+                continue
+            if budget <= 0:
+                omitted += len(hunks)
+                continue
+            lines = self._new_side_lines(path, ref_range)
+            rendered = []
+            for header, new_start, body in hunks:
+                hunk = [header, *self._enclosing_symbol(lines, new_start, body), *body]
+                tokens = estimate_tokens("\n".join(hunk))
+                if tokens > budget:
+                    budget = 0
+                    omitted += 1
+                    continue
+                budget -= tokens
+                rendered.extend(hunk)
+            if rendered:
+                blocks.append(f"// {path} - {self._file_role(Path(path))} (diff)\n```diff\n" +
+                              "\n".join(rendered) + "\n```")
+
+        for path in untracked:
+            cached = self.content_cache.get(path)
+            if not cached:
+                continue
+            text = cached["text"][:CONFIG["MAX_FILE_SIZE"]]
+            if estimate_tokens(text) > budget:
+                budget = 0
+                omitted += 1
+                continue
+            budget -= estimate_tokens(text)
+            blocks.append(f"// {path} - {self._file_role(Path(path))} (new file)\n```typescript\n" +
+                          text + "\n```")
+        if omitted:
+            blocks.append(f"// {omitted} more hunks/new files omitted to stay within the context token budget")
+
+        if len(self._diff_cache) >= 16:
+            self._diff_cache.pop(next(iter(self._diff_cache)))
+        self._diff_cache[key] = blocks
+        return blocks
+
+    @staticmethod
+    def _parse_diff(diff: str) -> List[Tuple[str, List[Tuple[str, int, List[str]]]]]:
+        files: List[Tuple[str, List[Tuple[str, int, List[str]]]]] = []
+        hunks: Optional[List[Tuple[str, int, List[str]]]] = None
+        in_header = False
+        old_path = None
+        for line in diff.splitlines():
+            if line.startswith("diff --git "):
+                # "---"/"+++" are only file headers between here and the first "@@"; inside a
+                # hunk they are removed/added lines that happen to start with "--"/"++".
+                hunks, in_header, old_path = None, True, None
+            elif in_header and line.startswith("--- "):
+                path = line[4:].strip()
+                old_path = None if path == "/dev/null" else (path[2:] if path.startswith("a/") else path)
+            elif in_header and line.startswith("+++ "):
+                path = line[4:].strip()
+                # Deleted files are keyed by their old path.
+                path = old_path if path == "/dev/null" else (path[2:] if path.startswith("b/") else path)
+                if path is not None:
+                    hunks = []
+                    files.append((path, hunks))
+            elif line.startswith("@@") and hunks is not None:
+                in_header = False
+                match = re.match(r'@@ -\d+(?:,\d+)? \+(\d+)', line)
+                hunks.append((line, int(match.group(1)) if match else 0, []))
+            elif hunks and not in_header:
+                hunks[-1][2].append(line)
+        return [(path, hunks) for path, hunks in files if hunks]
+
+    def _enclosing_symbol(self, lines: List[str], new_start: int, body: List[str]) -> List[str]:
+        """Declaration lines enclosing a hunk that start above its leading context."""
+        indents = [len(line[1:]) - len(line[1:].lstrip()) for line in body if line[1:].strip()]
+        max_indent = min(indents, default=0)
+        first_shown = new_start - 1
+        for index in range(min(first_shown, len(lines)) - 1, -1, -1):
+            line = lines[index]
+            if len(line) - len(line.lstrip()) < max(max_indent, 1) and _SYMBOL_RE.match(line):
+                end = min(index + CONFIG["DIFF_SYMBOL_LINES"], first_shown)
+                return [f"~{number + 1}: {lines[number]}" for number in range(index, end)]
+        return []
 
     def _validate_ollama_connection(self) -> bool:
         endpoints = [CONFIG["OLLAMA_ENDPOINT"], CONFIG["FALLBACK_OLLAMA_ENDPOINT"]]
         for endpoint in endpoints:
             try:
-                response = requests.get(endpoint.replace("/api/generate", "/api/tags"), timeout=5)
+                response = OllamaClient.session().get(endpoint.replace("/api/generate", "/api/tags"), timeout=5)
                 if response.status_code == 200:
                     print(f"✅ Ollama connection established at {endpoint}")
                     return True
@@ -190,37 +1644,44 @@ class ProjectContextManager:
         
         return stack
 
-    def _load_cache(self) -> FileCache:
-        cache_file = Path(CONFIG["WEIGHT_CACHE"])
-        if cache_file.exists():
-            try:
-                with open(cache_file) as f:
-                    data = json.load(f)
-                    return {"files": data.get("files", {}), 
-                            "last_updated": datetime.now().isoformat()}
-            except Exception as e:
-                print(f"⚠️ Error loading cache: {e}")
-        return {"files": {}, "last_updated": datetime.now().isoformat()}
+    @property
+    def weights(self) -> Mapping:
+        """Weights snapshot of the primary root; see ``WorkspaceShard.weights``."""
+        return self.primary.weights
+
+    def _weight_entry(self, file_path) -> Mapping:
+        return self.shard_for(file_path).weights["files"].get(str(file_path), {})
+
+    def _modify_weights(self, changes: Dict[str, Callable[[Mapping], dict]]):
+        """Copy-on-write weight update, routed to the workspace root owning each path."""
+        by_shard: Dict[WorkspaceShard, Dict[str, Callable[[Mapping], dict]]] = {}
+        for path, change in changes.items():
+            by_shard.setdefault(self.shard_for(path), {})[path] = change
+        for shard, shard_changes in by_shard.items():
+            shard.load().modify_weights(shard_changes)
 
     def _save_cache(self):
-        try:
-            with open(CONFIG["WEIGHT_CACHE"], "w") as f:
-                json.dump(self.weights, f, indent=2, ensure_ascii=False)
-        except Exception as e:
-            print(f"⚠️ Error saving cache: {e}")
+        for shard in self.shards:
+            if shard.loaded:
+                shard._save_cache()
 
     def _score_file(self, file_path: Path) -> float:
         try:
-            stat = file_path.stat()
-            days_old = (datetime.now() - datetime.fromtimestamp(stat.st_mtime)).days
+            record = self.index_record(file_path)
+            if record:
+                mtime, size = record["mtime_ns"] / 1e9, record["size"]
+            else:
+                stat = file_path.stat()
+                mtime, size = stat.st_mtime, stat.st_size
+            days_old = (datetime.now() - datetime.fromtimestamp(mtime)).days
             
-            cache_entry = self.weights["files"].get(str(file_path), {})
+            cache_entry = self._weight_entry(file_path)
             freq_score = cache_entry.get("weight", 0)
             recency_score = 1 / (days_old + 0.1)
             
             role = cache_entry.get("role", "").lower()
             role_multiplier = 1.5 if "schema" in role else 1.3 if "page" in role or "api" in role else 1.0
-            size_penalty = min(1.0, (10000 / max(1, stat.st_size)))
+            size_penalty = min(1.0, (10000 / max(1, size)))
             
             return (freq_score + recency_score) * role_multiplier * size_penalty
         except Exception as e:
@@ -228,23 +1689,34 @@ class ProjectContextManager:
             return 0.0
 
     def track_file(self, file_path: str):
-        path = Path(file_path)
-        if not FileHandler.is_valid_file(path):
-            return
-            
-        path_str = str(path)
-        self.active_files.add(path_str)
-        
-        if path_str not in self.weights["files"]:
-            self.weights["files"][path_str] = {
-                "weight": 0,
-                "role": self._infer_file_role(path),
-                "last_accessed": datetime.now().isoformat()
-            }
-        
-        self.weights["files"][path_str]["weight"] += 3
-        self.weights["files"][path_str]["last_edited"] = datetime.now().isoformat()
+        self.track_files([file_path])
+
+    def track_files(self, file_paths: List[str]) -> List[str]:
+        """Bump the weights of valid files with one update and one save; returns the tracked paths."""
+        paths = [Path(file_path) for file_path in file_paths]
+        paths = [path for path in paths if FileHandler.is_valid_file(path, self.shard_for(path).matcher)]
+        if not paths:
+            return []
+
+        with self._write_lock:
+            self.active_files = self.active_files | {str(path) for path in paths}
+
+        now = datetime.now().isoformat()
+
+        def bump(role: str) -> Callable[[Mapping], dict]:
+            def update(entry: Mapping) -> dict:
+                updated = {"role": role, "last_accessed": now, **entry}
+                updated["weight"] = entry.get("weight", 0) + 3
+                updated["last_edited"] = now
+                return updated
+            return update
+
+        self._modify_weights({str(path): bump(self._infer_file_role(path)) for path in paths})
         self._save_cache()
+        return [str(path) for path in paths]
+
+    def _file_role(self, file_path: Path) -> str:
+        return self._weight_entry(file_path).get("role") or self._infer_file_role(file_path)
 
     def _infer_file_role(self, file_path: Path) -> str:
         path_str = str(file_path).lower()
@@ -283,47 +1755,40 @@ class ProjectContextManager:
         return "Project source file"
 
     def get_project_structure(self, max_depth: int = 3) -> str:
-        structure = []
-        root_path = Path(".")
-        
-        def walk_dir(path: Path, current_depth: int):
-            if current_depth > max_depth:
-                return
-            if any(ignored in str(path) for ignored in CONFIG["IGNORED_DIRS"]):
-                return
-                
-            try:
-                for item in path.iterdir():
-                    if item.is_dir():
-                        walk_dir(item, current_depth + 1)
-                    elif item.suffix in CONFIG["SUPPORTED_EXTENSIONS"]:
-                        role = self.weights["files"].get(str(item), {}).get("role", self._infer_file_role(item))
-                        structure.append(f"{item} - {role}")
-            except Exception as e:
-                print(f"⚠️ Error walking directory {path}: {e}")
-        
-        walk_dir(root_path, 0)
+        structure = [f"{item} - {self._file_role(item)}" for item in sorted(iter_source_files(max_depth))]
         return "\n".join(structure)
 
     def select_relevant_files(self, question: str, max_files: int = CONFIG["MAX_CONTEXT_FILES"]) -> List[Path]:
+        shards = self._active_shards(question)
         if not self.ollama_available:
             return self._fallback_file_selection(max_files)
+
+        cached = self.selection_cache.lookup(question, max_files, lambda f: self.index_record(f) is not None)
+        if cached:
+            return cached
             
-        project_structure = self.get_project_structure()
-        prompt = f"""<start_of_turn>user
-Project structure:
-{project_structure}
+        prompt_template = """<start_of_turn>user
+Project map (directories show file counts by role; only branches matching the request are expanded):
+{project_map}
 
 Select up to {max_files} files relevant to: {question}
-Return ONLY a JSON array of absolute file paths.
+Return ONLY a JSON array of file paths exactly as listed in the map.
 Example: ["src/app/page.tsx", "prisma/schema.prisma"]<end_of_turn>
 <start_of_turn>model>"""
+        overhead = estimate_tokens(prompt_template.format(project_map="", max_files=max_files, question=question))
+        budget = max(0, CONFIG["SELECTOR_PROMPT_TOKENS"] - overhead) // len(shards)
+        maps = [(shard.project_map, shard.weights["files"]) for shard in shards]
+        project_map = "\n".join(
+            shard_map.render(question, budget, weights) for shard_map, weights in maps if shard_map is not None
+        )
+        prompt = prompt_template.format(project_map=project_map, max_files=max_files, question=question)
         
         try:
             response = OllamaClient.call(
                 model=CONFIG["MODELS"]["file_selector"],
                 prompt=prompt,
-                max_retries=2
+                max_retries=2,
+                request_type="file_selector"
             )
             
             if not response:
@@ -332,19 +1797,16 @@ Example: ["src/app/page.tsx", "prisma/schema.prisma"]<end_of_turn>
             json_str = re.search(r'\[.*\]', response, re.DOTALL).group()
             files = json.loads(json_str)
             
-            valid_files = []
-            for f in files[:max_files]:
-                if Path(f).exists():
-                    valid_files.append(f)
-                    if f not in self.weights["files"]:
-                        self.weights["files"][f] = {
-                            "weight": 0,
-                            "role": self._infer_file_role(Path(f))
-                        }
-                    self.weights["files"][f]["weight"] += 1
-                    self.weights["files"][f]["last_accessed"] = datetime.now().isoformat()
-            
+            valid_files = [f for f in files[:max_files] if Path(f).exists()]
+            now = datetime.now().isoformat()
+
+            def touch(role: str) -> Callable[[Mapping], dict]:
+                return lambda entry: {"role": role, **entry, "weight": entry.get("weight", 0) + 1,
+                                      "last_accessed": now}
+
+            self._modify_weights({f: touch(self._infer_file_role(Path(f))) for f in valid_files})
             self._save_cache()
+            self.selection_cache.store(question, valid_files)
             return valid_files
             
         except Exception as e:
@@ -352,16 +1814,8 @@ Example: ["src/app/page.tsx", "prisma/schema.prisma"]<end_of_turn>
             return self._fallback_file_selection(max_files)
 
     def _fallback_file_selection(self, max_files: int) -> List[str]:
-        all_files = []
-        for root, _, files in os.walk("."):
-            if any(ignored in root for ignored in CONFIG["IGNORED_DIRS"]):
-                continue
-                
-            for file in files:
-                if (file.endswith(CONFIG["SUPPORTED_EXTENSIONS"]) and
-                    not any(fnmatch.fnmatch(file, pattern) for pattern in CONFIG["IGNORED_FILE_PATTERNS"])):
-                    all_files.append(Path(root) / file)
-        
+        all_files = [path for index in [shard.index for shard in self.shards] if index is not None
+                     for path in index.paths()]
         scored_files = sorted(
             [(f, self._score_file(f)) for f in all_files],
             key=lambda x: x[1],
@@ -369,18 +1823,45 @@ Example: ["src/app/page.tsx", "prisma/schema.prisma"]<end_of_turn>
         )
         return [str(f) for f, _ in scored_files[:max_files]]
 
-    def get_context(self, question: str, focus_files: List[str] = None) -> str:
-        context_files = [Path(f) for f in (focus_files or self.select_relevant_files(question)) if Path(f).exists()]
+    def get_context(self, question: str, focus_files: List[str] = None, minify: Optional[bool] = None,
+                    diff: Optional[str] = None) -> str:
+        """Build the model prompt.
+
+        ``diff`` switches to diff-scoped context: ``"WORKTREE"`` for uncommitted changes or a git
+        ref range such as ``"main..HEAD"``; whole files are then only sent for untracked files.
+        """
+        timings: Dict[str, float] = {}
+        checkpoint = time.perf_counter()
+
+        def stage(name: str):
+            nonlocal checkpoint
+            now = time.perf_counter()
+            timings[name] = timings.get(name, 0.0) + (now - checkpoint) * 1000
+            checkpoint = now
+
         file_contents = []
+        minifier = ContextMinifier() if (self.minify_context if minify is None else minify) else None
+        if diff is not None:
+            file_contents = self.get_diff_context(None if diff == "WORKTREE" else diff)
+            stage("diff")
 
-        for file in context_files[:CONFIG["MAX_CONTEXT_FILES"]]:
-            try:
-                content = file.read_text(encoding='utf-8')[:CONFIG["MAX_FILE_SIZE"]]
-                role = self.weights["files"].get(str(file), {}).get("role", self._infer_file_role(file))
-                file_contents.append(f"// {file} - {role}\n```typescript\n{content}\n```")
-            except Exception as e:
-                print(f"⚠️ Error reading file {file}: {e}")
+        selected = [] if diff is not None else focus_files or self.select_relevant_files(question)
+        stage("select")
+        for file in map(Path, selected):
+            if len(file_contents) >= CONFIG["MAX_CONTEXT_FILES"]:
+                break
+            cached = self.content_cache.get(file)
+            if cached is None:
                 continue
+            content = cached["text"]
+            if minifier:
+                stage("read")
+                content = minifier.minify(file, content, cached["tokens"])
+                stage("minify")
+            content = content[:CONFIG["MAX_FILE_SIZE"]]
+            role = self._file_role(file)
+            file_contents.append(f"// {file} - {role}\n```typescript\n{content}\n```")
+        stage("read")
 
         context = [
             "<start_of_turn>user",
@@ -399,7 +1880,7 @@ Example: ["src/app/page.tsx", "prisma/schema.prisma"]<end_of_turn>
             "[TASK DESCRIPTION]",
             f"* User Request: {question}",
             "",
-            "[CONTEXT FILES]",
+            "[CONTEXT DIFF]" if diff is not None else "[CONTEXT FILES]",
             *file_contents,
             "",
             "[INSTRUCTIONS]",
@@ -411,11 +1892,31 @@ Example: ["src/app/page.tsx", "prisma/schema.prisma"]<end_of_turn>
             "<start_of_turn>model>",
         ]
 
-        self.recent_questions.append((datetime.now().isoformat(), question))
-        if len(self.recent_questions) > 3:
-            self.recent_questions.pop(0)
+        if minifier:
+            self.last_minify_report = minifier.report
+            minifier.print_report()
+
+        with self._write_lock:
+            self.recent_questions.append((datetime.now().isoformat(), question))
+            if len(self.recent_questions) > 3:
+                self.recent_questions.pop(0)
 
-        return "\n".join(context)
+        prompt = "\n".join(context)
+        stage("assemble")
+        self.last_context_timings = timings
+        return prompt
+
+    def performance_snapshot(self) -> dict:
+        """Counters for the GUI performance view; cheap and safe to call from any thread."""
+        now = time.monotonic()
+        return {
+            "requests": list(OllamaClient.telemetry)[-10:],
+            "context_timings": dict(self.last_context_timings),
+            "content_cache": (self.content_cache.hits, self.content_cache.misses, self.content_cache.total_bytes),
+            "selection_cache": (self.selection_cache.hits, self.selection_cache.misses),
+            "watch_events": Counter(kind for at, kind in list(self.watch_events) if now - at <= 60),
+            "shards": [(shard.root, shard.loaded) for shard in self.shards],
+        }
 
     def generate_code(self, question: str, context: str = None) -> str:
         if not context:
@@ -454,61 +1955,163 @@ export function generatedFallbackImplementation() {{
 }}"""
 
     def cleanup(self):
-        try:
-            if hasattr(self, 'observer'):
-                self.observer.stop()
-                self.observer.join()
-            self._save_cache()
-        except Exception as e:
-            print(f"⚠️ Error during cleanup: {e}")
+        """Stop background threads, then flush indexes, weights, summaries and selections.
+
+        Each step runs even if an earlier one fails; calling it again does nothing.
+        """
+        if self._cleaned_up:
+            return
+        self._cleaned_up = True
+        steps = [("shard reaper", self._stop_reaper), ("summarizer", self.summarizer.stop),
+                 ("file watcher", self._stop_observer),
+                 *((f"workspace {shard.root}", shard.save) for shard in self.shards),
+                 ("selection cache", self.selection_cache.save)]
+        for name, step in steps:
+            try:
+                step()
+            except Exception as e:
+                print(f"⚠️ Error during cleanup ({name}): {e}")
+
+    def _stop_reaper(self):
+        self._reaper_stop.set()
+        if self._reaper is not None:
+            self._reaper.join()
+
+    def _stop_observer(self):
+        # Joined before the shards are saved so no late event changes them mid-save.
+        if hasattr(self, 'observer'):
+            self.observer.stop()
+            self.observer.join()
 
 class EnhancedFileChangeHandler(FileSystemEventHandler):
-    def __init__(self, context_manager):
+    def __init__(self, context_manager, shard: WorkspaceShard):
         self.context_manager = context_manager
+        self.shard = shard
         self.debounce_timer = None
         self.debounce_interval = 2
+        self._pending: Set[str] = set()
+        self._pending_lock = threading.Lock()
+
+    def on_any_event(self, event):
+        self.context_manager.watch_events.append((time.monotonic(), event.event_type))
 
     def on_modified(self, event):
         if not event.is_directory:
+            self.context_manager.content_cache.invalidate(event.src_path)
             self._debounce(event.src_path)
 
     def on_created(self, event):
+        self._invalidate_map()
         if not event.is_directory:
+            self.context_manager.content_cache.invalidate(event.src_path)
             self._debounce(event.src_path)
 
+    def on_deleted(self, event):
+        if event.is_directory:
+            self.context_manager.content_cache.clear(self.shard.root)
+            self._reload_index()
+        else:
+            self.context_manager.content_cache.invalidate(event.src_path)
+            self._refresh_index(event.src_path)
+        self._invalidate_map()
+
+    def on_moved(self, event):
+        if event.is_directory:
+            self.context_manager.content_cache.clear(self.shard.root)
+            self._reload_index()
+        else:
+            self.context_manager.content_cache.invalidate(event.src_path)
+            self._refresh_index(event.src_path)
+            self.context_manager.content_cache.invalidate(event.dest_path)
+            self._debounce(event.dest_path)
+        self._invalidate_map()
+
+    def _invalidate_map(self):
+        project_map = self.shard.project_map
+        if project_map is not None:
+            project_map.invalidate()
+
+    def _reload_index(self):
+        index = self.shard.index
+        if index is not None:
+            index.load()
+
+    def _refresh_index(self, file_path) -> bool:
+        index = self.shard.index
+        return index is not None and index.refresh(file_path)
+
     def _debounce(self, file_path):
-        if self.debounce_timer:
-            self.debounce_timer.cancel()
-        
-        self.debounce_timer = threading.Timer(
-            self.debounce_interval,
-            self._process_file_change,
-            args=(file_path,)
-        )
-        self.debounce_timer.start()
+        # Paths collect in a pending set so a burst (checkout, formatter run) is processed in full
+        # once the tree goes quiet, rather than only its last event.
+        with self._pending_lock:
+            self._pending.add(file_path)
+            if self.debounce_timer:
+                self.debounce_timer.cancel()
+            self.debounce_timer = threading.Timer(self.debounce_interval, self._flush_pending)
+            self.debounce_timer.start()
+
+    def _flush_pending(self):
+        with self._pending_lock:
+            paths, self._pending = self._pending, set()
+        for file_path in sorted(paths):
+            self._process_file_change(file_path)
 
     def _process_file_change(self, file_path):
         try:
             path = Path(file_path)
-            if FileHandler.is_valid_file(path):
+            if path.suffix in CONFIG["SUPPORTED_EXTENSIONS"] and not self.shard.matcher.matches(path):
+                if self._refresh_index(file_path):
+                    self._invalidate_map()
+            if FileHandler.is_valid_file(path, self.shard.matcher):
                 self.context_manager.track_file(file_path)
                 print(f"📦 File updated: {file_path}")
         except Exception as e:
             print(f"⚠️ Error processing file change: {e}")
 
-def main():
-    import sys
+def build_arg_parser():
     from argparse import ArgumentParser
-    
+
     parser = ArgumentParser(description="Project Context Manager")
     parser.add_argument("question", nargs="?", help="Your question or task")
     parser.add_argument("--track", metavar="FILE", help="Track a specific file")
     parser.add_argument("--list-files", action="store_true", help="List tracked files")
     parser.add_argument("--update-tech", action="store_true", help="Update tech stack")
     parser.add_argument("--interactive", "-i", action="store_true", help="Interactive mode")
-    
+    parser.add_argument("--minify", action="store_true", help="Minify context files to save prompt tokens")
+    parser.add_argument("--diff", action="store_true",
+                        help="Use git diff hunks of the working tree against HEAD as context")
+    parser.add_argument("--diff-range", metavar="REF_RANGE",
+                        help="Use git diff hunks of a ref range (e.g. main..HEAD) as context")
+    parser.add_argument("--root", action="append", default=[], metavar="PATH",
+                        help="Additional workspace root, loaded when a question touches it (repeatable)")
+    return parser
+
+def verify_ref_range(ref_range: str) -> Optional[str]:
+    """Error message if any endpoint of ``ref_range`` is not a commit, else None."""
+    for ref in filter(None, re.split(r"\.\.\.?", ref_range)):
+        try:
+            result = subprocess.run(["git", "rev-parse", "--verify", "--quiet", f"{ref}^{{commit}}"],
+                                    capture_output=True, text=True)
+        except OSError as e:
+            return f"Cannot run git to check --diff-range: {e}"
+        if result.returncode != 0:
+            return f"'{ref}' in --diff-range {ref_range} is not a known git commit"
+    return None
+
+def main():
+    parser = build_arg_parser()
     args = parser.parse_args()
-    context_manager = ProjectContextManager()
+    diff = None
+    if args.diff_range:
+        error = verify_ref_range(args.diff_range)
+        if error:
+            parser.error(error)
+        diff = args.diff_range
+    elif args.diff:
+        diff = "WORKTREE"
+    context_manager = ProjectContextManager(CONFIG["WORKSPACE_ROOTS"] + args.root)
+    if args.minify:
+        context_manager.minify_context = True
     
     try:
         if args.track:
@@ -523,18 +2126,20 @@ def main():
             context_manager.tech_stack = context_manager._detect_tech_stack()
             print("Updated Tech Stack:", json.dumps(context_manager.tech_stack, indent=2))
         elif args.question:
-            context = context_manager.get_context(args.question)
-            print("\nGenerated Code:\n")
-            print(context_manager.generate_code(args.question, context))
-        elif args.interactive or not any(vars(args).values()):
+            with context_manager.interactive():
+                context = context_manager.get_context(args.question, diff=diff)
+                print("\nGenerated Code:\n")
+                print(context_manager.generate_code(args.question, context))
+        else:
             while True:
                 try:
                     question = input("\nAsk about your project (or 'quit'): ").strip()
                     if question.lower() in ('quit', 'exit'):
                         break
                     if question:
-                        context = context_manager.get_context(question)
-                        print("\n" + context_manager.generate_code(question, context))
+                        with context_manager.interactive():
+                            context = context_manager.get_context(question, diff=diff)
+                            print("\n" + context_manager.generate_code(question, context))
                 except KeyboardInterrupt:
                     print("\nUse 'quit' to exit")
                 except Exception as e:
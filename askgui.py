@@ -3,18 +3,278 @@ import tkinter as tk
 from tkinter import scrolledtext, filedialog, ttk
 from PIL import Image, ImageTk
 import os
+import re
 import json
+import heapq
+import socket
+import sqlite3
 import threading
-from queue import Queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from queue import Queue, Empty, Full
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, NamedTuple, Optional, Tuple
 
-import requests
-from ask import ProjectContextManager, CONFIG, OLLAMA_PARAMS
+from ask import ProjectContextManager, OllamaClient, CONFIG
+
+STREAM_QUEUE_SIZE = 256   # events buffered between the HTTP reader and the Tk loop
+STREAM_BATCH_TOKENS = 64  # max tokens per event once the UI falls behind
+STREAM_TIMEOUT = (5, 120)  # (connect, read) seconds; read bounds the wait for the next token
+PERF_SAMPLE_SECONDS = 1.0
+MODEL_SAMPLE_SECONDS = 5.0  # /api/ps is polled less often than the local counters
+HISTORY_PAGE_SIZE = 10      # turns read from the store per scroll step
+PARTIAL_SAVE_SECONDS = 2.0  # how often a streaming answer is written to the store
+
+class StreamEvent(NamedTuple):
+    stream: int       # id of the generation that produced the event
+    kind: str         # "chunk", "status", "end" or "error"
+    text: str
+    tokens: int
+    produced: float   # time.perf_counter() when the event was queued
+
+def _abort_response(response):
+    """Close a streaming response, shutting the socket down first so a blocked read returns."""
+    raw = response.raw
+    sock = getattr(getattr(raw, "_connection", None), "sock", None)  # urllib3 2.x
+    if sock is None:  # urllib3 1.x
+        sock = getattr(getattr(getattr(getattr(raw, "_fp", None), "fp", None), "raw", None), "_sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+    response.close()
+
+class StreamHandle:
+    """One generation: its worker thread, open HTTP response and stop flag.
+
+    Cancelling drops the connection; Ollama aborts a generation when its client disconnects,
+    which frees the server slot.
+    """
+
+    def __init__(self, stream_id: int):
+        self.id = stream_id
+        self.stop = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+        self.response = None
+        self.tokens = 0
+        self.first_token: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def attach(self, response) -> bool:
+        """Register the open response; closes it and returns False if already cancelled."""
+        with self._lock:
+            self.response = response
+            cancelled = self.stop.is_set()
+        if cancelled:
+            _abort_response(response)
+        return not cancelled
+
+    def cancel(self):
+        with self._lock:
+            self.stop.set()
+            response = self.response
+        if response is not None:
+            _abort_response(response)
+
+class ConversationStore:
+    """Conversation turns persisted to SQLite as they happen, read back a page at a time.
+
+    A turn's answer is saved periodically while it streams and marked complete at the end,
+    so a crash loses at most a few seconds of it.
+    """
+
+    def __init__(self, path: str = CONFIG["CONVERSATION_DB"]):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("""
+                CREATE TABLE IF NOT EXISTS turns (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    conversation TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    user TEXT NOT NULL,
+                    assistant TEXT,
+                    files TEXT NOT NULL DEFAULT '[]'
+                )""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS turns_by_conversation ON turns (conversation, id)")
+            columns = {row["name"] for row in self._db.execute("PRAGMA table_info(turns)")}
+            if "complete" not in columns:  # databases written before partial saves
+                self._db.execute("ALTER TABLE turns ADD COLUMN complete INTEGER NOT NULL DEFAULT 1")
+
+    @staticmethod
+    def new_conversation() -> str:
+        return datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+
+    @staticmethod
+    def _turn(row: sqlite3.Row) -> dict:
+        turn = dict(row)
+        turn["files"] = json.loads(turn["files"])
+        return turn
+
+    def _query(self, sql: str, *params) -> List[dict]:
+        with self._lock:
+            return [self._turn(row) for row in self._db.execute(sql, params).fetchall()]
+
+    def latest_conversation(self) -> Optional[str]:
+        with self._lock:
+            row = self._db.execute("SELECT conversation FROM turns ORDER BY id DESC LIMIT 1").fetchone()
+        return row["conversation"] if row else None
+
+    def last_turn_id(self, conversation: str) -> Optional[int]:
+        with self._lock:
+            row = self._db.execute("SELECT MAX(id) AS id FROM turns WHERE conversation = ?",
+                                   (conversation,)).fetchone()
+        return row["id"]
+
+    def start_turn(self, conversation: str, user: str, files: List[str]) -> int:
+        with self._lock, self._db:
+            cursor = self._db.execute(
+                "INSERT INTO turns (conversation, timestamp, user, files, complete) VALUES (?, ?, ?, ?, 0)",
+                (conversation, datetime.now().isoformat(), user, json.dumps(files))
+            )
+        return cursor.lastrowid
+
+    def save_partial(self, turn_id: int, assistant: str):
+        with self._lock, self._db:
+            self._db.execute("UPDATE turns SET assistant = ? WHERE id = ? AND complete = 0", (assistant, turn_id))
+
+    def finish_turn(self, turn_id: int, assistant: str):
+        with self._lock, self._db:
+            self._db.execute("UPDATE turns SET assistant = ?, complete = 1 WHERE id = ?", (assistant, turn_id))
+
+    def before(self, conversation: str, turn_id: Optional[int], limit: int) -> List[dict]:
+        """Up to ``limit`` turns older than ``turn_id`` (or the newest ones), newest first."""
+        return self._query("SELECT * FROM turns WHERE conversation = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                           conversation, turn_id if turn_id is not None else 2 ** 62, limit)
+
+    def after(self, conversation: str, turn_id: int, limit: int) -> List[dict]:
+        """Up to ``limit`` turns newer than ``turn_id``, oldest first."""
+        return self._query("SELECT * FROM turns WHERE conversation = ? AND id > ? ORDER BY id LIMIT ?",
+                           conversation, turn_id, limit)
+
+    def export(self, conversation: str, path: str) -> int:
+        """Stream a conversation to JSON (or plain text for other extensions); returns the turn count."""
+        count = 0
+        last_id = 0
+        as_json = path.lower().endswith(".json")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("[" if as_json else "")
+            while True:
+                page = self.after(conversation, last_id, 200)
+                if not page:
+                    break
+                for turn in page:
+                    if as_json:
+                        f.write(("," if count else "") + "\n  " + json.dumps(turn, ensure_ascii=False))
+                    else:
+                        f.write(f"[{turn['timestamp']}]\nYou: {turn['user']}\n\n"
+                                f"Assistant: {turn['assistant'] or ''}\n\n")
+                    count += 1
+                last_id = page[-1]["id"]
+            f.write("\n]\n" if as_json else "")
+        return count
+
+_CODE_TOKEN_RE = re.compile(r"""
+    (?P<string>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*'|`(?:\\.|[^`\\])*`)
+    |(?P<comment>//.*)
+    |(?P<block>/\*)
+    |(?P<keyword>\b(?:import|export|from|default|const|let|var|function|return|if|else|for|while|do|
+        switch|case|break|continue|async|await|class|interface|type|enum|extends|implements|new|
+        try|catch|finally|throw|typeof|instanceof|in|of|as|readonly|public|private|protected|static|
+        null|undefined|true|false|this|model|datasource|generator)\b)
+    |(?P<number>\b\d+(?:\.\d+)?\b)
+""", re.VERBOSE)
+
+Span = Tuple[str, int, int]
+
+class CodeHighlighter:
+    """Incremental highlighter for fenced code blocks in streamed markdown.
+
+    Only complete lines are tokenized: feed() holds back a trailing partial line and returns
+    the length of the newly completed text with tag spans relative to its start. Fence and
+    block-comment state carry across chunks, so every character is tokenized once.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.in_fence = False
+        self.in_comment = False
+        self._partial = ""
+
+    def feed(self, text: str) -> Tuple[int, List[Span]]:
+        self._partial += text
+        cut = self._partial.rfind("\n") + 1
+        if not cut:
+            return 0, []
+        complete, self._partial = self._partial[:cut], self._partial[cut:]
+        return len(complete), self._highlight(complete)
+
+    def finish(self) -> Tuple[int, List[Span]]:
+        rest, self._partial = self._partial, ""
+        return len(rest), self._highlight(rest)
+
+    def _highlight(self, text: str) -> List[Span]:
+        spans: List[Span] = []
+        pos = 0
+        for line in text.splitlines(keepends=True):
+            content = line.rstrip("\n")
+            if content.lstrip().startswith("```"):
+                self.in_fence = not self.in_fence
+                self.in_comment = False
+                spans.append(("code_fence", pos, pos + len(content)))
+            elif self.in_fence:
+                spans.append(("code", pos, pos + len(line)))
+                spans.extend(self._tokens(content, pos))
+            pos += len(line)
+        return spans
+
+    def _tokens(self, line: str, base: int) -> List[Span]:
+        spans: List[Span] = []
+        i = 0
+        if self.in_comment:
+            end = line.find("*/")
+            if end < 0:
+                return [("code_comment", base, base + len(line))]
+            spans.append(("code_comment", base, base + end + 2))
+            i = end + 2
+            self.in_comment = False
+        while True:
+            match = _CODE_TOKEN_RE.search(line, i)
+            if not match:
+                return spans
+            if match.lastgroup == "block":
+                end = line.find("*/", match.end())
+                if end < 0:
+                    self.in_comment = True
+                    spans.append(("code_comment", base + match.start(), base + len(line)))
+                    return spans
+                spans.append(("code_comment", base + match.start(), base + end + 2))
+                i = end + 2
+            else:
+                spans.append((f"code_{match.lastgroup}", base + match.start(), base + match.end()))
+                i = match.end()
 
 class ChatWindow:
+    FRAME_INTERVAL_MS = 33  # streamed text is flushed to the widget at most ~30 times a second
+    MAX_RENDERED_TURNS = 40  # older or newer turns are dropped from the widget and paged back in
+
     def __init__(self, master):
         self.master = master
+        self._pending: List[str] = []
+        self._flush_job = None
+        self._edge_job = None
+        self.highlighter = CodeHighlighter()
+        self.page_highlighter = CodeHighlighter()
+        # Ids of the turns currently in the widget, top to bottom; each starts at mark "turn_<id>".
+        self.turns: "deque[int]" = deque()
+        self.on_scroll_edge: Optional[Callable[[str], None]] = None
         self.text_area = scrolledtext.ScrolledText(
             master,
             wrap=tk.WORD,
@@ -26,6 +286,7 @@ class ChatWindow:
             state='disabled'
         )
         self.text_area.pack(expand=True, fill="both")
+        self.text_area.configure(yscrollcommand=self._on_scroll)
         self._configure_tags()
 
     def _configure_tags(self):
@@ -34,9 +295,39 @@ class ChatWindow:
         self.text_area.tag_config("system", foreground="#e74c3c")
         self.text_area.tag_config("file", foreground="#9b59b6")
         self.text_area.tag_config("streaming", foreground="#2ecc71", font=("Helvetica", 12, "italic"))
+        # Code tags are created last so they take priority over the message tags.
+        self.text_area.tag_config("code", font=("Courier", 11), foreground="#2c3e50", background="#f6f8fa")
+        self.text_area.tag_config("code_fence", font=("Courier", 11), foreground="#95a5a6")
+        self.text_area.tag_config("code_keyword", foreground="#8e44ad")
+        self.text_area.tag_config("code_string", foreground="#c0392b")
+        self.text_area.tag_config("code_number", foreground="#d35400")
+        self.text_area.tag_config("code_comment", foreground="#7f8c8d", font=("Courier", 11, "italic"))
+
+    def _apply_highlight(self, released: Tuple[int, List[Span]], mark: str = "hl_start"):
+        """Tag spans relative to ``mark``, then move the mark past the released text."""
+        length, spans = released
+        if not length:
+            return
+        for tag, start, end in spans:
+            self.text_area.tag_add(tag, f"{mark} + {start} chars", f"{mark} + {end} chars")
+        self.text_area.mark_set(mark, f"{mark} + {length} chars")
 
-    def add_message(self, sender: str, message: str, is_streaming: bool = False):
+    def _on_scroll(self, first, last):
+        self.text_area.vbar.set(first, last)
+        if self.on_scroll_edge is None or self._edge_job is not None:
+            return
+        edge = "top" if float(first) <= 0.0 else "bottom" if float(last) >= 1.0 else None
+        if edge:
+            self._edge_job = self.text_area.after_idle(self._scroll_edge_reached, edge)
+
+    def _scroll_edge_reached(self, edge: str):
+        self._edge_job = None
+        self.on_scroll_edge(edge)
+
+    def add_message(self, sender: str, message: str, is_streaming: bool = False) -> str:
+        """Append a message and return the index where it starts."""
         self.text_area.config(state='normal')
+        message_start = self.text_area.index("end-1c")
         if not is_streaming:
             sender_label = {
                 "user": "You:",
@@ -45,21 +336,103 @@ class ChatWindow:
                 "file": "File:"
             }.get(sender, "")
             self.text_area.insert(tk.END, f"{sender_label} ", sender)
+        start = self.text_area.index("end-1c")
         self.text_area.insert(tk.END, f"{message}\n\n", "streaming" if is_streaming else sender)
+        if is_streaming or sender == "assistant":
+            self.highlighter.reset()
+            self.text_area.mark_set("hl_start", start)
+            self.text_area.mark_gravity("hl_start", tk.LEFT)
+        if sender == "assistant" and not is_streaming:
+            self._apply_highlight(self.highlighter.feed(message))
+            self._apply_highlight(self.highlighter.finish())
+        if is_streaming:
+            # Streamed text goes in before the trailing blank line; "stream_end" has right
+            # gravity and moves past every insert, "stream_start" stays put.
+            self.text_area.mark_set("stream_start", start)
+            self.text_area.mark_gravity("stream_start", tk.LEFT)
+            self.text_area.mark_set("stream_end", "end-3c")
         self.text_area.see(tk.END)
         self.text_area.config(state='disabled')
+        return message_start
 
-    def update_streaming(self, message: str):
+    def mark_turn(self, turn_id: int, start: str):
+        # Right gravity: turns paged in at "1.0" push the mark along with its text.
+        self.text_area.mark_set(f"turn_{turn_id}", start)
+        self.turns.append(turn_id)
+
+    def insert_turn(self, turn: dict, at_top: bool):
+        """Materialize a stored turn above the first or below the last rendered turn."""
         self.text_area.config(state='normal')
-        self.text_area.delete("end-2c linestart", "end-1c")
-        self.text_area.insert(tk.END, message, "streaming")
-        self.text_area.see(tk.END)
+        index = "1.0" if at_top else self.text_area.index("end-1c")
+        assistant = turn["assistant"] if turn["assistant"] is not None else "(no response)"
+        if not turn["complete"] and turn["assistant"]:
+            assistant += "\n\n(interrupted)"
+        prefix = f"You: {turn['user']}\n\nAssistant: "
+        self.text_area.insert(index, "You: ", "user", f"{turn['user']}\n\n", "user",
+                              "Assistant: ", "assistant", f"{assistant}\n\n", "assistant")
+        self.text_area.mark_set("hl_page", f"{index} + {len(prefix)} chars")
+        self.page_highlighter.reset()
+        self._apply_highlight(self.page_highlighter.feed(assistant), "hl_page")
+        self._apply_highlight(self.page_highlighter.finish(), "hl_page")
+        self.text_area.mark_set(f"turn_{turn['id']}", index)
+        if at_top:
+            self.turns.appendleft(turn["id"])
+        else:
+            self.turns.append(turn["id"])
+        self.text_area.config(state='disabled')
+
+    def drop_turn(self, oldest: bool):
+        """Remove the first (with anything above it) or the last rendered turn from the widget."""
+        if not self.turns:
+            return
+        self.text_area.config(state='normal')
+        if oldest:
+            turn_id = self.turns.popleft()
+            self.text_area.delete("1.0", f"turn_{self.turns[0]}" if self.turns else "end-1c")
+        else:
+            turn_id = self.turns.pop()
+            self.text_area.delete(f"turn_{turn_id}", "end-1c")
+        self.text_area.mark_unset(f"turn_{turn_id}")
+        self.text_area.config(state='disabled')
+
+    def clear(self):
+        self.text_area.config(state='normal')
+        self.text_area.delete("1.0", tk.END)
         self.text_area.config(state='disabled')
+        for turn_id in self.turns:
+            self.text_area.mark_unset(f"turn_{turn_id}")
+        self.turns.clear()
+
+    def append_streaming(self, text: str):
+        """Queue streamed text; queued chunks are inserted together once per frame."""
+        if not text:
+            return
+        self._pending.append(text)
+        if self._flush_job is None:
+            self._flush_job = self.text_area.after(self.FRAME_INTERVAL_MS, self.flush_streaming)
+
+    def flush_streaming(self):
+        if self._flush_job is not None:
+            self.text_area.after_cancel(self._flush_job)
+            self._flush_job = None
+        if not self._pending:
+            return
+        text = "".join(self._pending)
+        self._pending.clear()
+        follow = self.text_area.yview()[1] >= 0.999
+        self.text_area.config(state='normal')
+        self.text_area.insert("stream_end", text, "streaming")
+        self._apply_highlight(self.highlighter.feed(text))
+        self.text_area.config(state='disabled')
+        if follow:
+            self.text_area.see(tk.END)
 
     def finalize_streaming(self):
+        self.flush_streaming()
         self.text_area.config(state='normal')
-        self.text_area.tag_remove("streaming", "end-2c linestart", "end-1c")
-        self.text_area.tag_add("assistant", "end-2c linestart", "end-1c")
+        self._apply_highlight(self.highlighter.finish())
+        self.text_area.tag_remove("streaming", "stream_start", "stream_end")
+        self.text_area.tag_add("assistant", "stream_start", "stream_end")
         self.text_area.config(state='disabled')
 
 class FileAttachmentPanel:
@@ -126,13 +499,15 @@ class FileAttachmentPanel:
             remove_btn.pack(side="left", padx=(5, 0))
 
 class ToolsMenu:
-    def __init__(self, master, context_manager, on_refresh, on_clear, on_export):
+    def __init__(self, master, context_manager, on_refresh, on_clear, on_export, run_async=None):
         self.master = master
         self.context_manager = context_manager
+        self.run_async = run_async or (lambda work, on_done: on_done(work()))
         self.on_refresh = on_refresh
         self.on_clear = on_clear
         self.on_export = on_export
         self.window = None
+        self.perf_tree = None
 
     def show(self):
         if self.window and self.window.winfo_exists():
@@ -184,15 +559,115 @@ class ToolsMenu:
         ttk.Button(actions_tab, text="Refresh Tech Stack", command=self.on_refresh).pack(fill="x", padx=5, pady=5)
         ttk.Button(actions_tab, text="Clear Conversation", command=self.on_clear).pack(fill="x", padx=5, pady=5)
         ttk.Button(actions_tab, text="Export Conversation", command=self.on_export).pack(fill="x", padx=5, pady=5)
+        
+        # Performance Tab
+        perf_tab = ttk.Frame(notebook)
+        notebook.add(perf_tab, text="Performance")
+        
+        self.perf_tree = ttk.Treeview(perf_tab, columns=("value",), show="tree headings")
+        self.perf_tree.heading("#0", text="Metric")
+        self.perf_tree.heading("value", text="Value")
+        self.perf_tree.column("#0", width=170)
+        perf_vsb = ttk.Scrollbar(perf_tab, orient="vertical", command=self.perf_tree.yview)
+        self.perf_tree.configure(yscrollcommand=perf_vsb.set)
+        self.perf_tree.pack(side="left", fill="both", expand=True)
+        perf_vsb.pack(side="right", fill="y")
+        self._start_sampler()
+
+    def _start_sampler(self):
+        # Sampling (including the HTTP call to /api/ps) runs off the Tk thread; only the
+        # finished snapshot is handed to the main loop for rendering.
+        stop = threading.Event()
+        window = self.window
+        window.bind("<Destroy>", lambda event: stop.set() if event.widget is window else None)
+        threading.Thread(target=self._sample, args=(stop,), daemon=True, name="PerfSampler").start()
+
+    def _sample(self, stop: threading.Event):
+        models, sampled_models = [], 0.0
+        while not stop.is_set():
+            snapshot = self.context_manager.performance_snapshot()
+            if time.monotonic() - sampled_models >= MODEL_SAMPLE_SECONDS:
+                try:
+                    models = OllamaClient.loaded_models()
+                except Exception as e:
+                    models = f"unavailable ({e.__class__.__name__})"
+                sampled_models = time.monotonic()
+            snapshot["models"] = models
+            try:
+                self.master.after(0, self._render_performance, snapshot, stop)
+            except RuntimeError:
+                break
+            stop.wait(PERF_SAMPLE_SECONDS)
+
+    def _render_performance(self, snapshot: dict, stop: threading.Event):
+        if stop.is_set() or not self.window.winfo_exists():
+            return
+        tree = self.perf_tree
+        tree.delete(*tree.get_children())
+        
+        def section(title: str, rows):
+            parent = tree.insert("", tk.END, text=title, open=True)
+            for label, value in rows:
+                tree.insert(parent, tk.END, text=label, values=(value,))
+        
+        def fmt(value, spec: str, unit: str = "") -> str:
+            return "—" if value is None else f"{value:{spec}}{unit}"
+        
+        requests_made = snapshot["requests"]
+        generations = [entry for entry in requests_made if entry["request_type"] == "generate"]
+        if generations:
+            last = generations[-1]
+            section("Last generation", [
+                ("Model", last["model"]),
+                ("Time to first token", fmt(last.get("ttft") and last["ttft"] * 1000, ".0f", " ms")),
+                ("Tokens/sec", fmt(last.get("eval_rate"), ".1f")),
+                ("Prompt tokens", f"{last['prompt_tokens']} / num_ctx {last['num_ctx']}"),
+                ("Output tokens", fmt(last.get("eval_tokens"), "d")),
+                ("Status", "cancelled" if last.get("cancelled") else "completed"),
+            ])
+        section("Recent requests", [
+            (f"{entry['timestamp'][11:19]} {entry['request_type']}",
+             f"{entry['model']} · {entry['prompt_tokens']} prompt tok · "
+             f"{fmt(entry.get('eval_rate'), '.1f', ' tok/s')} · {entry['duration']:.1f} s")
+            for entry in reversed(requests_made)
+        ])
+        timings = snapshot["context_timings"]
+        section("Context build", [(stage, f"{ms:.1f} ms") for stage, ms in timings.items()] +
+                ([("Total", f"{sum(timings.values()):.1f} ms")] if timings else []))
+        
+        def hit_rate(hits: int, misses: int) -> str:
+            return f"{hits / (hits + misses):.0%} ({hits}/{hits + misses})" if hits + misses else "—"
+        
+        content_hits, content_misses, content_bytes = snapshot["content_cache"]
+        section("Caches", [
+            ("File contents", f"{hit_rate(content_hits, content_misses)}, {content_bytes / 2**20:.1f} MiB"),
+            ("File selection", hit_rate(*snapshot["selection_cache"])),
+        ])
+        models = snapshot["models"]
+        if isinstance(models, str):
+            section("Resident models", [("Ollama", models)])
+        else:
+            section("Resident models", [
+                (model.get("name", "?"),
+                 f"{model.get('size_vram', 0) / 2**30:.1f} GiB VRAM of {model.get('size', 0) / 2**30:.1f} GiB, "
+                 f"until {model.get('expires_at', '?')[11:19]}")
+                for model in models
+            ] or [("(none)", "")])
+        section("Watcher events/min", sorted(snapshot["watch_events"].items()) or [("(none)", "")])
+        section("Workspace roots", [(root, "loaded" if loaded else "idle") for root, loaded in snapshot["shards"]])
 
     def _populate_files(self):
-        self.files_tree.delete(*self.files_tree.get_children())
-        sorted_files = sorted(
-            self.context_manager.weights["files"].items(),
-            key=lambda x: x[1].get("weight", 0),
-            reverse=True
+        files = self.context_manager.weights["files"]
+        self.run_async(
+            lambda: heapq.nlargest(50, files.items(), key=lambda x: x[1].get("weight", 0)),
+            self._show_files
         )
-        for file_path, data in sorted_files[:50]:
+
+    def _show_files(self, top_files):
+        if not (self.window and self.window.winfo_exists()):
+            return
+        self.files_tree.delete(*self.files_tree.get_children())
+        for file_path, data in top_files:
             self.files_tree.insert(
                 "",
                 tk.END,
@@ -200,19 +675,333 @@ class ToolsMenu:
                 values=(data.get("weight", 0), data.get("role", "Unknown")[:100])
             )
 
+class ConversationTab:
+    """One conversation: its chat view, stored history and model stream.
+
+    Tabs stream independently; the context manager, conversation store, worker executor
+    and HTTP session are shared through the owning ``ContextManagerGUI``.
+    """
+
+    def __init__(self, gui: "ContextManagerGUI", conversation_id: str):
+        self.gui = gui
+        self.store = gui.store
+        self.context_manager = gui.context_manager
+        self.conversation_id = conversation_id
+        # Single pipeline per tab: its reader thread is the only producer, _update_streaming_ui
+        # on the Tk loop the only consumer. The bound makes a slow UI throttle the HTTP reader.
+        self.response_queue: "Queue[StreamEvent]" = Queue(maxsize=STREAM_QUEUE_SIZE)
+        self._current_turn: Optional[int] = None
+        self._oldest_loaded = False   # no stored turns above the first rendered one
+        self._newest_loaded = True    # no stored turns below the last rendered one
+        self.streaming_active = False
+        self.streaming_chunks: List[str] = []
+        self._partial_saved = 0.0     # monotonic time the streaming answer was last stored
+        self._stream_count = 0
+        self._stream: Optional[StreamHandle] = None
+        self.stream_stats: Dict[str, float] = {}
+        self.status = "Ready"
+        self.title = "New chat"
+
+        self.frame = tk.Frame(gui.notebook, bg="white")
+        self.chat_window = ChatWindow(self.frame)
+        self.chat_window.on_scroll_edge = self._page_history
+        gui.notebook.add(self.frame, text=self.title)
+        self.load_recent_history()
+
+    def _set_status(self, message: str):
+        self.status = message
+        self.gui._tab_status(self)
+
+    def _set_title(self, text: str):
+        text = " ".join(text.split())
+        self.title = text[:24] + "…" if len(text) > 24 else text or "New chat"
+        self._update_tab_label()
+
+    def _update_tab_label(self):
+        self.gui.notebook.tab(self.frame, text=("● " if self.streaming_active else "") + self.title)
+
+    def send(self, user_input: str, files: List[str]):
+        if self.chat_window.turns and self.chat_window.turns[-1] != self.store.last_turn_id(self.conversation_id):
+            self.load_recent_history()  # newest turns were paged out; jump back to the end
+        if not self.chat_window.turns:
+            self._set_title(user_input)
+        start = self.chat_window.add_message("user", user_input)
+        self._current_turn = self.store.start_turn(self.conversation_id, user_input, files)
+        self.chat_window.mark_turn(self._current_turn, start)
+        while len(self.chat_window.turns) > ChatWindow.MAX_RENDERED_TURNS:
+            self.chat_window.drop_turn(oldest=True)
+            self._oldest_loaded = False
+        self._start_streaming_response(user_input, files)
+
+    def _start_streaming_response(self, user_input: str, files: List[str]):
+        self.streaming_active = True
+        self.streaming_chunks = []
+        self._partial_saved = time.monotonic()
+        self._stream_count += 1
+        stream = self._stream = StreamHandle(self._stream_count)
+        self.stream_stats = {"started": time.perf_counter(), "first_token": 0.0, "tokens": 0,
+                             "events": 0, "lag_total": 0.0, "lag_max": 0.0}
+        
+        self.chat_window.add_message("assistant", "", is_streaming=True)
+        self._update_tab_label()
+        self.gui._sync_buttons()
+        
+        stream.thread = threading.Thread(
+            target=self._stream_model_response,
+            args=(user_input, files, stream),
+            daemon=True,
+            name="ModelStream"
+        )
+        stream.thread.start()
+        
+        self._update_streaming_ui()
+
+    def _update_streaming_ui(self):
+        if not self.streaming_active:
+            return
+            
+        text, terminal = [], None
+        while terminal is None:
+            try:
+                event = self.response_queue.get_nowait()
+            except Empty:
+                break
+            if event.stream != self._stream.id:
+                continue  # left over from a stopped generation
+            if event.kind == "chunk":
+                text.append(event.text)
+                self._record_stream_event(event)
+            elif event.kind == "status":
+                self._set_status(event.text)
+            else:
+                terminal = event
+        
+        if terminal is not None and terminal.kind == "error":
+            text.append(f"\n\nError: {terminal.text}")
+        if text:
+            self.streaming_chunks.extend(text)
+            self.chat_window.append_streaming("".join(text))
+            if terminal is None and time.monotonic() - self._partial_saved >= PARTIAL_SAVE_SECONDS:
+                self._partial_saved = time.monotonic()
+                self.store.save_partial(self._current_turn, "".join(self.streaming_chunks))
+        if terminal is not None:
+            self._finalize_streaming_response()
+            return
+        if self.stream_stats["tokens"]:
+            self._set_status(f"Streaming… {self._stream_summary()}")
+        self.gui.root.after(ChatWindow.FRAME_INTERVAL_MS, self._update_streaming_ui)
+
+    def _record_stream_event(self, event: StreamEvent):
+        stats = self.stream_stats
+        now = time.perf_counter()
+        if not stats["first_token"]:
+            stats["first_token"] = now
+        lag = now - event.produced
+        stats["tokens"] += event.tokens
+        stats["events"] += 1
+        stats["lag_total"] += lag
+        stats["lag_max"] = max(stats["lag_max"], lag)
+
+    def _stream_summary(self) -> str:
+        stats = self.stream_stats
+        elapsed = time.perf_counter() - stats["first_token"] if stats["first_token"] else 0
+        rate = stats["tokens"] / elapsed if elapsed > 0 else 0.0
+        lag = stats["lag_total"] / max(1, stats["events"])
+        return f"{stats['tokens']} tokens, {rate:.1f} tok/s, render lag {lag * 1000:.0f} ms (max {stats['lag_max'] * 1000:.0f})"
+
+    def _emit(self, stop: threading.Event, event: StreamEvent) -> bool:
+        """Queue an event, blocking while the queue is full unless the stream is stopped."""
+        while not stop.is_set():
+            try:
+                self.response_queue.put(event, timeout=0.1)
+                return True
+            except Full:
+                continue
+        return False
+
+    def _stream_model_response(self, user_input: str, files: List[str], stream: StreamHandle):
+        def emit(kind: str, text: str = "", tokens: int = 0) -> bool:
+            return self._emit(stream.stop, StreamEvent(stream.id, kind, text, tokens, time.perf_counter()))
+
+        with self.context_manager.interactive():
+            try:
+                context = self.context_manager.get_context(user_input, files)
+                if stream.stop.is_set():
+                    return
+                model = CONFIG["MODELS"]["primary"]
+                slot = OllamaClient.slot(model)
+                if not slot.acquire(blocking=False):
+                    emit("status", f"Waiting for a free {model} slot…")
+                    while not slot.acquire(timeout=0.1):
+                        if stream.stop.is_set():
+                            return
+                try:
+                    self._generate(model, context, stream, emit)
+                finally:
+                    slot.release()
+            except Exception as e:
+                if not stream.stop.is_set():  # reads fail once a cancelled response is closed
+                    emit("error", str(e))
+            finally:
+                if stream.response is not None:
+                    stream.response.close()
+
+    def _generate(self, model: str, context: str, stream: StreamHandle, emit: Callable[..., bool]):
+        options = OllamaClient.options_for(model, context, "generate")
+        started = time.perf_counter()
+        if stream.stop.is_set():  # cancelled while waiting for the slot; don't open a request
+            return
+    
+        response = OllamaClient.session().post(
+            CONFIG["OLLAMA_ENDPOINT"],
+            json={
+                "model": model,
+                "prompt": context,
+                "stream": True,
+                "options": options
+            },
+            timeout=STREAM_TIMEOUT,
+            stream=True
+        )
+        if not stream.attach(response):
+            OllamaClient.record(model, "generate", context, options, started, cancelled=True)
+            return
+        response.raise_for_status()
+    
+        final_chunk = None
+        batch: List[str] = []
+        for line in response.iter_lines():
+            if stream.stop.is_set():
+                break
+            if line:
+                chunk = json.loads(line.decode('utf-8'))
+                if chunk.get('response'):
+                    batch.append(chunk['response'])
+                    stream.tokens += 1
+                    if stream.first_token is None:
+                        stream.first_token = time.perf_counter() - started
+                if chunk.get('done'):
+                    final_chunk = chunk
+            # Send immediately while the UI keeps up; batch up only when it lags.
+            if batch and (self.response_queue.empty() or len(batch) >= STREAM_BATCH_TOKENS):
+                emit("chunk", "".join(batch), len(batch))
+                batch = []
+        if batch:
+            emit("chunk", "".join(batch), len(batch))
+                
+        if stream.stop.is_set():
+            OllamaClient.record(model, "generate", context, options, started,
+                                {"eval_count": stream.tokens}, ttft=stream.first_token, cancelled=True)
+            return
+        OllamaClient.record(model, "generate", context, options, started, final_chunk,
+                            ttft=stream.first_token)
+        emit("end")
+
+    def _finalize_streaming_response(self):
+        self.streaming_active = False
+        
+        if self._current_turn is not None:
+            self.store.finish_turn(self._current_turn, "".join(self.streaming_chunks))
+        
+        self.chat_window.finalize_streaming()
+        self._update_tab_label()
+        self.gui._sync_buttons()
+        self._set_status(f"Ready — {self._stream_summary()}" if self.stream_stats.get("tokens") else "Ready")
+
+    def stop_streaming(self):
+        stream = self._stream
+        if not self.streaming_active or stream is None:
+            return
+        stream.cancel()
+        self._finalize_streaming_response()
+        self._set_status("Stopping generation…")
+        threading.Thread(target=self._confirm_stopped, args=(stream,), daemon=True, name="StreamStop").start()
+
+    def cancel_stream(self):
+        """Abort the model stream without touching the UI; used when the window closes."""
+        if self._stream is not None:
+            self._stream.cancel()
+
+    def _confirm_stopped(self, stream: StreamHandle):
+        stream.thread.join(timeout=10)
+        if stream.thread.is_alive():
+            message = "⚠️ Stop requested, but the model stream has not closed yet"
+        else:
+            message = f"⏹ Generation stopped after {stream.tokens} tokens; server connection closed"
+        self.gui.root.after(0, self._confirm_stopped_ui, message)
+
+    def _confirm_stopped_ui(self, message: str):
+        if self.frame.winfo_exists():
+            self.chat_window.add_message("system", message)
+        self._set_status(message)
+
+    def load_recent_history(self):
+        self.chat_window.clear()
+        recent = self.store.before(self.conversation_id, None, HISTORY_PAGE_SIZE)
+        for turn in reversed(recent):
+            self.chat_window.insert_turn(turn, at_top=False)
+        self._oldest_loaded = len(recent) < HISTORY_PAGE_SIZE
+        self._newest_loaded = True
+        if recent:
+            self._set_title(recent[-1]["user"])
+        self.chat_window.text_area.see(tk.END)
+
+    def _page_history(self, edge: str):
+        """Page stored turns in at the edge the user scrolled to, dropping turns at the other end."""
+        turns = self.chat_window.turns
+        if not turns:
+            return
+        if edge == "top" and not self._oldest_loaded:
+            older = self.store.before(self.conversation_id, turns[0], HISTORY_PAGE_SIZE)
+            self._oldest_loaded = len(older) < HISTORY_PAGE_SIZE
+            for turn in older:
+                self.chat_window.insert_turn(turn, at_top=True)
+            # The live turn is at the bottom while streaming, so only trim the bottom when idle.
+            while older and not self.streaming_active and len(turns) > ChatWindow.MAX_RENDERED_TURNS:
+                self.chat_window.drop_turn(oldest=False)
+                self._newest_loaded = False
+        elif edge == "bottom" and not self._newest_loaded:
+            newer = self.store.after(self.conversation_id, turns[-1], HISTORY_PAGE_SIZE)
+            self._newest_loaded = len(newer) < HISTORY_PAGE_SIZE
+            for turn in newer:
+                self.chat_window.insert_turn(turn, at_top=False)
+            while newer and len(turns) > ChatWindow.MAX_RENDERED_TURNS:
+                self.chat_window.drop_turn(oldest=True)
+                self._oldest_loaded = False
+
+    def clear(self):
+        self.stop_streaming()
+        self.chat_window.clear()
+        self.conversation_id = self.store.new_conversation()
+        self._oldest_loaded = self._newest_loaded = True
+        self._set_title("")
+        self._set_status("Conversation cleared (previous conversation kept in history)")
+
+    def close(self):
+        self.stop_streaming()
+        self.gui.notebook.forget(self.frame)
+        self.frame.destroy()
+
 class ContextManagerGUI:
     def __init__(self, root, context_manager):
         self.root = root
         self.context_manager = context_manager
-        self.response_queue = Queue()
-        self.conversation_history = []
+        # Context-manager work triggered from the UI runs here, never on the Tk thread;
+        # one worker keeps weight updates ordered.
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ContextWorker")
+        self.store = ConversationStore()
+        self.tabs: Dict[str, ConversationTab] = {}  # keyed by the tab frame's widget name
         self.attached_files = []
-        self.streaming_active = False
-        self.current_streaming_message = ""
-        self.current_user_input = ""
+        
+        self._closed = False
         
         self._setup_ui()
-        self._start_response_consumer()
+        self._new_tab(self.store.latest_conversation())
+        self.root.protocol("WM_DELETE_WINDOW", self._on_close)
+
+    @property
+    def current_tab(self) -> ConversationTab:
+        return self.tabs[str(self.notebook.select())]
 
     def _setup_ui(self):
         self.root.title("CMMS Project Assistant")
@@ -238,9 +1027,10 @@ class ContextManagerGUI:
         )
         title_label.pack(side="left", padx=10)
         
-        # Chat Window
-        self.chat_window = ChatWindow(tk.Frame(self.root, bg="white"))
-        self.chat_window.master.grid(row=1, column=0, sticky="nsew", padx=10, pady=5)
+        # Conversation tabs
+        self.notebook = ttk.Notebook(self.root)
+        self.notebook.grid(row=1, column=0, sticky="nsew", padx=10, pady=5)
+        self.notebook.bind("<<NotebookTabChanged>>", self._tab_changed)
         
         # Input Area
         input_frame = tk.Frame(self.root, bg="#f0f0f0", padx=10, pady=10)
@@ -304,6 +1094,26 @@ class ContextManagerGUI:
         )
         self.tools_button.pack(side="left")
         
+        self.new_tab_button = tk.Button(
+            button_frame,
+            text="➕ New Chat",
+            command=self._new_tab,
+            bg="#3498db",
+            fg="white",
+            font=("Helvetica", 10)
+        )
+        self.new_tab_button.pack(side="left", padx=(5, 0))
+        
+        self.close_tab_button = tk.Button(
+            button_frame,
+            text="✖ Close Chat",
+            command=self._close_tab,
+            bg="#95a5a6",
+            fg="white",
+            font=("Helvetica", 10)
+        )
+        self.close_tab_button.pack(side="left", padx=(5, 0))
+        
         # Status Bar
         self.status_bar = tk.Label(
             self.root,
@@ -323,7 +1133,8 @@ class ContextManagerGUI:
             self.context_manager,
             self._refresh_tech_stack,
             self._clear_conversation,
-            self._export_conversation
+            self._export_conversation,
+            self._run_async
         )
 
     def _load_image(self, path, size):
@@ -335,6 +1146,32 @@ class ContextManagerGUI:
             img = Image.new('RGB', size, color="#2c3e50")
             return ImageTk.PhotoImage(img)
 
+    def _new_tab(self, conversation_id: Optional[str] = None):
+        tab = ConversationTab(self, conversation_id or self.store.new_conversation())
+        self.tabs[str(tab.frame)] = tab
+        self.notebook.select(tab.frame)
+
+    def _close_tab(self):
+        tab = self.current_tab
+        tab.close()
+        del self.tabs[str(tab.frame)]
+        if not self.tabs:
+            self._new_tab()
+
+    def _tab_changed(self, event=None):
+        if self.notebook.select() in self.tabs:
+            self._sync_buttons()
+            self._update_status(self.current_tab.status)
+
+    def _tab_status(self, tab: ConversationTab):
+        if self.tabs.get(str(self.notebook.select())) is tab:
+            self._update_status(tab.status)
+
+    def _sync_buttons(self):
+        streaming = self.current_tab.streaming_active
+        self.send_button.config(state='disabled' if streaming else 'normal')
+        self.stop_button.config(state='normal' if streaming else 'disabled')
+
     def _handle_enter_key(self, event):
         if not event.state & 0x1:  # If Shift not pressed
             self._send_message()
@@ -349,147 +1186,60 @@ class ContextManagerGUI:
             self.attached_files = list(files)
             self.file_panel.update_attachments(self.attached_files)
             for file_path in self.attached_files:
-                self.context_manager.track_file(file_path)
-                self.chat_window.add_message("file", f"Attached: {file_path}")
+                self.current_tab.chat_window.add_message("file", f"Attached: {file_path}")
+            self._update_status(f"Tracking {len(files)} files…")
+            self._run_async(
+                lambda: self.context_manager.track_files(files),
+                lambda tracked: self._update_status(f"Tracked {len(tracked)} of {len(files)} attached files")
+            )
+
+    def _run_async(self, work: Callable, on_done: Optional[Callable] = None):
+        """Run ``work`` on the context worker and pass its result to ``on_done`` on the Tk loop."""
+        def finished(future):
+            try:
+                result = future.result()
+            except Exception as e:
+                self.root.after(0, self._update_status, f"⚠️ {e}")
+                return
+            if on_done is not None:
+                self.root.after(0, on_done, result)
+
+        self.executor.submit(work).add_done_callback(finished)
 
     def _remove_attachment(self, index):
         if 0 <= index < len(self.attached_files):
             self.attached_files.pop(index)
             self.file_panel.update_attachments(self.attached_files)
 
-    def _start_response_consumer(self):
-        def consume_responses():
-            while True:
-                try:
-                    response = self.response_queue.get()
-                    if response == "STOP":
-                        break
-                    if self.root.winfo_exists():
-                        self.root.after(0, self._update_streaming_message, response)
-                    self.response_queue.task_done()
-                except Exception as e:
-                    print(f"Error in consumer thread: {e}")
-                    break
-                    
-        threading.Thread(
-            target=consume_responses,
-            daemon=True,
-            name="ResponseConsumer"
-        ).start()
-
     def _send_message(self):
-        if self.streaming_active:
+        tab = self.current_tab
+        if tab.streaming_active:
             return
             
         user_input = self.input_text.get("1.0", tk.END).strip()
         if not user_input and not self.attached_files:
             return
             
-        self.current_user_input = user_input
-        self.chat_window.add_message("user", user_input)
         self.input_text.delete("1.0", tk.END)
-        
-        # Start streaming response
-        self._start_streaming_response(user_input)
-
-    def _start_streaming_response(self, user_input):
-        self.streaming_active = True
-        self.send_button.config(state='disabled')
-        self.stop_button.config(state='normal')
-        self.current_streaming_message = ""
-        
-        self.chat_window.add_message("assistant", "", is_streaming=True)
-        
-        threading.Thread(
-            target=self._stream_model_response,
-            args=(user_input,),
-            daemon=True
-        ).start()
-        
-        self._update_streaming_ui()
-
-    def _update_streaming_ui(self):
-        if not self.streaming_active:
-            return
-            
-        while not self.response_queue.empty():
-            chunk = self.response_queue.get()
-            if chunk == "END":
-                self._finalize_streaming_response()
-                return
-            self.current_streaming_message += chunk
-            self.response_queue.task_done()
-        
-        self.chat_window.update_streaming(self.current_streaming_message)
-        self.root.after(100, self._update_streaming_ui)
-
-    def _stream_model_response(self, user_input):
-        try:
-            context = self.context_manager.get_context(user_input, self.attached_files)
-            
-            response = requests.post(
-                CONFIG["OLLAMA_ENDPOINT"],
-                json={
-                    "model": CONFIG["MODELS"]["primary"],
-                    "prompt": context,
-                    "stream": True,
-                    "options": OLLAMA_PARAMS
-                },
-                stream=True
-            )
-            response.raise_for_status()
-            
-            for line in response.iter_lines():
-                if not self.streaming_active:
-                    break
-                if line:
-                    chunk = json.loads(line.decode('utf-8'))
-                    if 'response' in chunk:
-                        self.response_queue.put(chunk['response'])
-                        
-            self.response_queue.put("END")
-        except Exception as e:
-            self.response_queue.put(f"\n\nError: {str(e)}")
-            self.response_queue.put("END")
-
-    def _update_streaming_message(self, chunk):
-        self.current_streaming_message += chunk
-
-    def _finalize_streaming_response(self):
-        self.streaming_active = False
-        self.send_button.config(state='normal')
-        self.stop_button.config(state='disabled')
-        
-        self.conversation_history.append({
-            "timestamp": datetime.now().isoformat(),
-            "user": self.current_user_input,
-            "assistant": self.current_streaming_message,
-            "files": self.attached_files.copy()
-        })
-        
-        self.chat_window.finalize_streaming()
-        self._update_status("Ready")
+        tab.send(user_input, list(self.attached_files))
 
     def _stop_streaming(self):
-        self.streaming_active = False
-        self.stop_button.config(state='disabled')
-        self.send_button.config(state='normal')
-        self._finalize_streaming_response()
+        self.current_tab.stop_streaming()
 
     def _show_tools_menu(self):
         self.tools_menu.show()
 
     def _refresh_tech_stack(self):
-        self.context_manager.tech_stack = self.context_manager._detect_tech_stack()
+        self._update_status("Refreshing tech stack…")
+        self._run_async(self.context_manager._detect_tech_stack, self._tech_stack_refreshed)
+
+    def _tech_stack_refreshed(self, tech_stack):
+        self.context_manager.tech_stack = tech_stack
         self.tools_menu.show()
         self._update_status("Tech stack refreshed")
 
     def _clear_conversation(self):
-        self.chat_window.text_area.config(state='normal')
-        self.chat_window.text_area.delete("1.0", tk.END)
-        self.chat_window.text_area.config(state='disabled')
-        self.conversation_history = []
-        self._update_status("Conversation cleared")
+        self.current_tab.clear()
 
     def _export_conversation(self):
         file_path = filedialog.asksaveasfilename(
@@ -497,21 +1247,39 @@ class ContextManagerGUI:
             filetypes=[("JSON Files", "*.json"), ("Text Files", "*.txt"), ("All Files", "*.*")]
         )
         if file_path:
-            try:
-                with open(file_path, "w") as f:
-                    json.dump(self.conversation_history, f, indent=2)
-                self._update_status(f"Exported to {file_path}")
-            except Exception as e:
-                self._update_status(f"Export failed: {str(e)}")
+            conversation_id = self.current_tab.conversation_id
+            self._update_status(f"Exporting to {file_path}…")
+            self._run_async(
+                lambda: self.store.export(conversation_id, file_path),
+                lambda count: self._update_status(f"Exported {count} turns to {file_path}")
+            )
 
     def _update_status(self, message):
         self.status_bar.config(text=message)
 
+    def _on_close(self):
+        self.shutdown()
+        self.root.destroy()
+
+    def shutdown(self):
+        """Stop streams and flush the context manager; safe to call more than once."""
+        if self._closed:
+            return
+        self._closed = True
+        for tab in self.tabs.values():
+            tab.cancel_stream()
+        # Let queued weight updates land before cleanup() writes them out.
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.context_manager.cleanup()
+
     def run(self):
-        self.root.mainloop()
+        try:
+            self.root.mainloop()
+        finally:
+            self.shutdown()
 
 if __name__ == "__main__":
     root = tk.Tk()
     context_manager = ProjectContextManager()
     gui = ContextManagerGUI(root, context_manager)
-    gui.run()
\ No newline at end of file
+    gui.run()
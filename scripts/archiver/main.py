@@ -1,12 +1,19 @@
 import base64
 import ctypes
+import json
+import math
 import os
+import struct
 import sys
+import tempfile
 import threading
 import time
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import uuid
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime
 from pathlib import Path
-from typing import List, Dict, Tuple
+from typing import List, Dict, Iterator, NamedTuple, Optional, Tuple
 import zstandard as zstd
 import msgpack
 import hashlib
@@ -15,6 +22,9 @@ import brotli
 import traceback
 import argparse
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from pathfilter import IgnoreMatcher, walk
+
 # --- Constants ---
 NON_CRITICAL_DIRS = {".git", "__pycache__", "node_modules", "venv", ".venv", 
                     "dist", "build", ".next", "out", ".ai-assistant", ".vscode", 
@@ -24,6 +34,66 @@ NON_CRITICAL_FILES = {".pyc", ".pyo", ".log", "py", ".cache", ".DS_Store",
                       ".mjs", ".zip", ".7z", ".tar"}
 CRITICAL_EXTENSIONS = {".ts", ".tsx", ".js", ".jsx", ".prisma", ".json", 
                        ".css", ".scss"}
+IGNORE_FILES = (".gitignore",)
+WALK_WORKERS = 8
+
+# Framed archive layout: header | one compressed frame per file | index | trailer.
+# Frames are written as each file is compressed and the index (zstd-compressed msgpack)
+# records where each one lives, so neither side holds more than a block of a file in memory.
+ARCHIVE_MAGIC = b"RRA1"
+ARCHIVE_VERSION = 3  # 2: per-file codec choice and embedded dictionaries; 3: delta archives
+ARCHIVE_HEADER = struct.Struct(">4sB3x")   # magic, format version
+ARCHIVE_TRAILER = struct.Struct(">QQ4s")   # index offset, index length, magic
+STREAM_BLOCK = 1024 * 1024
+
+# Per-file codec selection (see ProjectArchiver.choose_codec)
+PROBE_BYTES = 64 * 1024
+PROBE_LEVEL = 3
+STORED_ENTROPY_BITS = 7.5      # samples this close to random are stored as-is
+STORED_RATIO = 0.95            # ... as are those a fast zstd pass barely shrinks
+ZSTD_FULL_LEVEL_RATIO = 0.8    # only spend the full zstd level where it has something to find
+ZSTD_SMALL_FILE_LEVEL = 19     # levels 20-22 only widen the window, which costs memory but gains nothing on small files
+ZSTD_ULTRA_MIN_SIZE = 8 * 1024 * 1024
+BROTLI_QUALITY = 11
+BROTLI_PROBE_QUALITY = 5
+BROTLI_MAX_FILE_SIZE = 256 * 1024
+
+# Trained dictionaries, one per category, cached between runs (see DictionaryCache)
+DICT_CATEGORIES = {".ts": "ts", ".tsx": "tsx", ".jsx": "tsx", ".js": "js",
+                   ".json": "json", ".prisma": "prisma", ".css": "css", ".scss": "css"}
+DICT_CACHE_DIR = Path(__file__).resolve().parent / "dictionaries"
+DICT_FORMAT_VERSION = 1        # bump when training parameters change to invalidate every cached dictionary
+DICT_SIZE = 64 * 1024
+DICT_MAX_FILE_SIZE = 32 * 1024
+DICT_MIN_SAMPLES = 8
+DICT_SAMPLE_BYTES = 4 * 1024 * 1024
+DICT_DRIFT_SAMPLE_BYTES = 512 * 1024
+DICT_DRIFT_TOLERANCE = 0.10    # retrain once the cached dictionary compresses the sample 10% worse
+
+# Process-pool compression (see ProjectArchiver.save_compressed_project)
+COMPRESS_WORKERS = os.cpu_count() or 1
+BATCH_BYTES = 4 * 1024 * 1024
+BATCH_MAX_FILES = 256
+LARGE_FILE_SIZE = 16 * 1024 * 1024  # streamed in the main process instead of batched
+
+# Incremental archives (see ArchiveCache)
+ARCHIVE_CACHE = Path(__file__).resolve().parent / "cache.json"
+ARCHIVE_CACHE_VERSION = 1
+MAX_CHAIN_LENGTH = 1000
+
+# Content-defined chunk store (see ChunkStore)
+CHUNK_STORE = Path(__file__).resolve().parent / "store"
+CDC_MIN = 2 * 1024
+CDC_AVG = 8 * 1024
+CDC_MAX = 64 * 1024
+CHUNK_GC_GRACE_SECONDS = 3600
+
+def project_matcher(project_path: Path) -> IgnoreMatcher:
+    """Compiled ignore rules for a project: NON_CRITICAL_DIRS plus its .gitignore"""
+    return IgnoreMatcher(project_path, dir_names=NON_CRITICAL_DIRS, ignore_files=IGNORE_FILES)
+
+def is_critical_file(path: Path) -> bool:
+    return path.suffix in CRITICAL_EXTENSIONS or path.suffix not in NON_CRITICAL_FILES
 
 # --- Progress Bar ---
 class ProgressBar:
@@ -60,100 +130,893 @@ def take_ownership(path: Path) -> bool:
     except:
         return False
 
+# --- Codecs ---
+class CodecChoice(NamedTuple):
+    codec: str                   # "stored", "zstd", "zstd-dict" or "brotli"
+    level: int = 0               # zstd level or brotli quality
+    dict_id: Optional[int] = None
+
+STORED = CodecChoice("stored")
+
+class _Passthrough:
+    def compress(self, block: bytes) -> bytes:
+        return block
+
+    def flush(self) -> bytes:
+        return b""
+
+class _BrotliEncoder:
+    def __init__(self, quality: int, text: bool):
+        self._compressor = brotli.Compressor(quality=quality, mode=brotli.MODE_TEXT if text else brotli.MODE_GENERIC)
+
+    def compress(self, block: bytes) -> bytes:
+        return self._compressor.process(block)
+
+    def flush(self) -> bytes:
+        return self._compressor.finish()
+
+class _BrotliReader:
+    """Brotli frame as a file-like object.
+
+    Brotli >= 1.2 caps the output of each ``process`` call; older modules can't, so there a
+    single call may still expand past ``size`` (ArchiveReader.iter_blocks still stops at the
+    entry's recorded size).
+    """
+    def __init__(self, frame):
+        self._frame = frame
+        self._decompressor = brotli.Decompressor()
+        self._limited = hasattr(self._decompressor, "can_accept_more_data")
+        self._pending = b""
+        self._done = False
+
+    def read(self, size: int) -> bytes:
+        while not self._pending and not self._done:
+            if self._limited:
+                data = self._frame.read(STREAM_BLOCK) if self._decompressor.can_accept_more_data() else b""
+                out = self._decompressor.process(data, output_buffer_limit=size)
+            else:
+                data = self._frame.read(STREAM_BLOCK)
+                out = self._decompressor.process(data)
+            self._done = not data and not out
+            self._pending = out
+        block, self._pending = self._pending[:size], self._pending[size:]
+        return block
+
+class _ZlibReader:
+    """Format 1 text frames: zlib inside the zstd ``stream``, inflated at most ``size`` bytes per read"""
+    def __init__(self, stream):
+        self._stream = stream
+        self._zlib = zlib.decompressobj()
+        self._done = False
+
+    def read(self, size: int) -> bytes:
+        while not self._done:
+            if self._zlib.unconsumed_tail:
+                out = self._zlib.decompress(self._zlib.unconsumed_tail, size)
+            else:
+                data = self._stream.read(STREAM_BLOCK)
+                if not data:
+                    self._done = True
+                    return self._zlib.flush()
+                out = self._zlib.decompress(data, size)
+            if out:
+                return out
+        return b""
+
+def byte_entropy(sample: bytes) -> float:
+    """Shannon entropy of a sample in bits per byte (8.0 = indistinguishable from random)"""
+    if not sample:
+        return 0.0
+    total = len(sample)
+    return -sum(count / total * math.log2(count / total) for count in Counter(sample).values())
+
+class CodecContext:
+    """Compressor contexts for codec choices, cached per zstd level and dictionary"""
+    def __init__(self, threads: int = 0):
+        self.threads = threads
+        self.dictionaries: Dict[int, zstd.ZstdCompressionDict] = {}
+        self._cctx: Dict[Tuple[int, Optional[int]], zstd.ZstdCompressor] = {}
+
+    def add_dictionary(self, dictionary: zstd.ZstdCompressionDict) -> int:
+        dict_id = dictionary.dict_id()
+        self.dictionaries[dict_id] = dictionary
+        return dict_id
+
+    def encoder(self, choice: CodecChoice, text: bool, size: int = -1):
+        """Streaming encoder; pass the input ``size`` when known so zstd can size its window to it"""
+        if choice.codec == "stored":
+            return _Passthrough()
+        if choice.codec == "brotli":
+            return _BrotliEncoder(choice.level, text)
+        return self._compressor(choice).compressobj(size=size)
+
+    def compress(self, data: bytes, choice: CodecChoice, text: bool) -> bytes:
+        """One-shot frame for data already in memory; zstd sees its size and keeps the window to it"""
+        if choice.codec == "stored":
+            return data
+        if choice.codec == "brotli":
+            return brotli.compress(data, quality=choice.level,
+                                   mode=brotli.MODE_TEXT if text else brotli.MODE_GENERIC)
+        return self._compressor(choice).compress(data)
+
+    def _compressor(self, choice: CodecChoice) -> zstd.ZstdCompressor:
+        key = (choice.level, choice.dict_id if choice.codec == "zstd-dict" else None)
+        if key not in self._cctx:
+            self._cctx[key] = zstd.ZstdCompressor(level=choice.level, threads=self.threads,
+                                                  dict_data=self.dictionaries.get(key[1]))
+        return self._cctx[key]
+
+def frame_entry(rel_path: str, size: int, mtime: float, digest: str, choice: CodecChoice) -> dict:
+    """Index entry for a frame; ArchiveWriter fills in offset and length"""
+    entry = {"path": rel_path, "size": size, "mtime": mtime, "hash": digest,
+             "codec": choice.codec, "level": choice.level}
+    if choice.codec == "zstd-dict":
+        entry["dict"] = choice.dict_id
+    return entry
+
+def size_balanced_batches(files: List[Tuple[Path, int]], target_bytes: int = BATCH_BYTES,
+                          max_files: int = BATCH_MAX_FILES) -> List[List[Tuple[Path, int]]]:
+    """Group (path, size) pairs into batches of roughly ``target_bytes``, largest files first,
+    so the pool starts on the long jobs and finishes on many short, evenly sized ones"""
+    batches, batch, batch_bytes = [], [], 0
+    for item in sorted(files, key=lambda item: item[1], reverse=True):
+        batch.append(item)
+        batch_bytes += item[1]
+        if batch_bytes >= target_bytes or len(batch) >= max_files:
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+    if batch:
+        batches.append(batch)
+    return batches
+
+def dict_category(path: Path) -> Optional[str]:
+    return DICT_CATEGORIES.get(path.suffix.lower())
+
+def _evenly_spaced_samples(files: List[Path], limit: int) -> List[bytes]:
+    """Contents of files spread evenly over ``files`` until ``limit`` bytes are collected"""
+    samples, total = [], 0
+    if not files:
+        return samples
+    sizes = []
+    for file_path in files:
+        try:
+            sizes.append(file_path.stat().st_size)
+        except OSError:
+            sizes.append(0)
+    average = max(1, sum(sizes) // len(files))
+    step = max(1, len(files) * average // limit) if limit else 1
+    for file_path in files[::step]:
+        if total >= limit:
+            break
+        try:
+            sample = file_path.read_bytes()
+        except OSError:
+            continue
+        samples.append(sample)
+        total += len(sample)
+    return samples
+
+def _dictionary_ratio(dictionary: zstd.ZstdCompressionDict, samples: List[bytes]) -> float:
+    cctx = zstd.ZstdCompressor(level=PROBE_LEVEL, dict_data=dictionary)
+    raw = sum(len(sample) for sample in samples)
+    return sum(len(cctx.compress(sample)) for sample in samples) / raw if raw else 1.0
+
+def _dictionary_pays_off(dictionary: zstd.ZstdCompressionDict, files: List[Path]) -> bool:
+    """Whether ``dictionary`` saves more than its own size over plain zstd on ``files``, i.e.
+    whether embedding it makes an archive of those files smaller"""
+    plain = zstd.ZstdCompressor(level=PROBE_LEVEL)
+    cctx = zstd.ZstdCompressor(level=PROBE_LEVEL, dict_data=dictionary)
+    remaining = len(dictionary.as_bytes())
+    for file_path in files:
+        try:
+            data = file_path.read_bytes()
+        except OSError:
+            continue
+        remaining -= len(plain.compress(data)) - len(cctx.compress(data))
+        if remaining < 0:
+            return True
+    return False
+
+class DictionaryCache:
+    """Trained zstd dictionaries per file category, kept on disk between archive runs.
+
+    ``manifest.json`` records each dictionary's version, zstd id and the ratio it achieved on
+    a sample of its category when trained. A cached dictionary is reused until the same kind
+    of sample compresses DICT_DRIFT_TOLERANCE worse with it, and then retrained.
+    """
+    def __init__(self, directory: Path = DICT_CACHE_DIR):
+        self.directory = directory
+        self.manifest_path = directory / "manifest.json"
+        self.manifest: Dict[str, dict] = self._load_manifest()
+
+    def _load_manifest(self) -> Dict[str, dict]:
+        try:
+            manifest = json.loads(self.manifest_path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return {}
+        if manifest.get("format") != DICT_FORMAT_VERSION:
+            return {}
+        return manifest.get("categories", {})
+
+    def _save_manifest(self) -> None:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = self.manifest_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({"format": DICT_FORMAT_VERSION, "categories": self.manifest}, indent=2),
+                       encoding="utf-8")
+        os.replace(tmp, self.manifest_path)
+
+    def _path(self, category: str) -> Path:
+        return self.directory / f"{category}.zdict"
+
+    def load(self, category: str) -> Optional[zstd.ZstdCompressionDict]:
+        info = self.manifest.get(category)
+        if not info:
+            return None
+        try:
+            dictionary = zstd.ZstdCompressionDict(self._path(category).read_bytes())
+        except OSError:
+            return None
+        return dictionary if dictionary.dict_id() == info["dict_id"] else None
+
+    def _train(self, category: str, files: List[Path], drift_sample: List[bytes]) -> Optional[zstd.ZstdCompressionDict]:
+        samples = _evenly_spaced_samples(files, DICT_SAMPLE_BYTES)
+        try:
+            dictionary = zstd.train_dictionary(DICT_SIZE, samples)
+        except Exception as e:
+            print(f"⚠️ Dictionary training failed for {category}: {str(e)}")
+            return None
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = self._path(category).with_suffix(".tmp")
+        tmp.write_bytes(dictionary.as_bytes())
+        os.replace(tmp, self._path(category))
+        self.manifest[category] = {
+            "version": self.manifest.get(category, {}).get("version", 0) + 1,
+            "dict_id": dictionary.dict_id(),
+            "trained": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "samples": len(samples),
+            "ratio": _dictionary_ratio(dictionary, drift_sample),
+        }
+        self._save_manifest()
+        return dictionary
+
+    def version(self, category: str) -> int:
+        return self.manifest.get(category, {}).get("version", 0)
+
+    def dictionaries_for(self, files: List[Path]) -> Dict[str, zstd.ZstdCompressionDict]:
+        """Cached dictionaries for each category with enough small files, retraining drifted ones"""
+        by_category: Dict[str, List[Path]] = {}
+        for file_path in files:
+            category = dict_category(file_path)
+            try:
+                if category and file_path.stat().st_size <= DICT_MAX_FILE_SIZE:
+                    by_category.setdefault(category, []).append(file_path)
+            except OSError:
+                continue
+
+        dictionaries = {}
+        for category, paths in sorted(by_category.items()):
+            if len(paths) < DICT_MIN_SAMPLES:
+                continue
+            drift_sample = _evenly_spaced_samples(paths, DICT_DRIFT_SAMPLE_BYTES)
+            dictionary = self.load(category)
+            if dictionary is not None:
+                trained_ratio = self.manifest[category]["ratio"]
+                ratio = _dictionary_ratio(dictionary, drift_sample)
+                if ratio <= trained_ratio * (1 + DICT_DRIFT_TOLERANCE):
+                    dictionaries[category] = dictionary
+                    continue
+                print(f"🔁 {category} dictionary drifted (ratio {trained_ratio:.3f} → {ratio:.3f}), retraining")
+            else:
+                print(f"🧠 Training {category} dictionary from {len(paths)} files")
+            dictionary = self._train(category, paths, drift_sample)
+            if dictionary is not None:
+                dictionaries[category] = dictionary
+        return dictionaries
+
+    def cached_for(self, files: List[Path]) -> Dict[str, zstd.ZstdCompressionDict]:
+        """Cached dictionaries for the categories of ``files`` as they are, without drift checks or training"""
+        dictionaries = {}
+        for category in sorted({dict_category(file_path) for file_path in files} - {None}):
+            dictionary = self.load(category)
+            if dictionary is not None:
+                dictionaries[category] = dictionary
+        return dictionaries
+
+# --- Incremental State ---
+class ArchiveCache:
+    """Per-file size, mtime, inode and hash as of the last archive of a project.
+
+    An incremental run only reads files whose size, mtime or inode differ from the cache and
+    writes those whose hash changed, plus tombstones for files that disappeared, as a delta
+    on top of the archive the cache points at.
+    """
+    def __init__(self, path: Path = ARCHIVE_CACHE):
+        self.path = path
+        self.project: Optional[str] = None
+        self.archive: Optional[str] = None
+        self.archive_id: Optional[str] = None
+        self.files: Dict[str, dict] = {}
+        try:
+            data = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        if isinstance(data, dict) and data.get("version") == ARCHIVE_CACHE_VERSION:
+            self.project = data.get("project")
+            self.archive = data.get("archive")
+            self.archive_id = data.get("archive_id")
+            self.files = data.get("files", {})
+
+    @staticmethod
+    def signature(stat: os.stat_result) -> dict:
+        return {"size": stat.st_size, "mtime": stat.st_mtime_ns, "inode": stat.st_ino}
+
+    def unchanged(self, rel_path: str, signature: dict) -> bool:
+        cached = self.files.get(rel_path)
+        return bool(cached) and all(cached[key] == signature[key] for key in ("size", "mtime", "inode"))
+
+    def base_for(self, project_path: Path) -> Optional[Path]:
+        """The archive an incremental run can build on, if the cache describes this project"""
+        if self.project != str(project_path.resolve()) or not self.archive:
+            return None
+        base = Path(self.archive)
+        try:
+            with ArchiveReader(base) as reader:
+                return base if reader.index.get("id") == self.archive_id else None
+        except (OSError, ValueError):
+            return None
+
+    def save(self, project_path: Path, archive: Path, archive_id: str, files: Dict[str, dict]) -> None:
+        self.project = str(project_path.resolve())
+        self.archive = str(archive.resolve())
+        self.archive_id = archive_id
+        self.files = files
+        tmp = self.path.with_suffix(".tmp")
+        tmp.write_text(json.dumps({
+            "version": ARCHIVE_CACHE_VERSION,
+            "project": self.project,
+            "archive": self.archive,
+            "archive_id": self.archive_id,
+            "files": self.files,
+        }, indent=1), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+# --- Archive Container ---
+class _BoundedReader:
+    """File-like view of the next ``length`` bytes of ``file``"""
+    def __init__(self, file, length: int):
+        self._file = file
+        self._remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self._remaining:
+            size = self._remaining
+        data = self._file.read(size)
+        self._remaining -= len(data)
+        return data
+
+class ArchiveWriter:
+    """Writes the framed container, one file frame at a time.
+
+    Frames go to ``<path>.partial``, which replaces ``path`` only once the index is written,
+    so an existing archive at ``path`` stays intact until the new one is complete.
+    """
+    def __init__(self, path: Path, codecs: CodecContext, base: Optional[Path] = None,
+                 base_id: Optional[str] = None):
+        self.path = path
+        self.codecs = codecs
+        self.id = uuid.uuid4().hex
+        self.base = None
+        if base is not None:
+            try:
+                base_path = os.path.relpath(base.resolve(), path.resolve().parent)
+            except ValueError:  # different drive
+                base_path = str(base.resolve())
+            self.base = {"path": Path(base_path).as_posix(), "id": base_id}
+        self.deleted: List[str] = []
+        self.entries: List[dict] = []
+        self.dictionaries: Dict[str, dict] = {}
+        self._pending_dictionaries: Dict[int, Tuple[zstd.ZstdCompressionDict, dict]] = {}
+        self._partial = path.with_name(path.name + ".partial")
+        self._file = open(self._partial, "wb")
+        self._file.write(ARCHIVE_HEADER.pack(ARCHIVE_MAGIC, ARCHIVE_VERSION))
+
+    def __enter__(self) -> "ArchiveWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if self._file.closed:
+            return  # already closed or discarded
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+            self._partial.unlink(missing_ok=True)  # never leave an archive without an index
+
+    def add_dictionary(self, dictionary: zstd.ZstdCompressionDict, **info) -> int:
+        """Make a zstd dictionary available to ``zstd-dict`` frames; it is stored at close
+        only if a frame used it, so small deltas don't carry every dictionary"""
+        dict_id = self.codecs.add_dictionary(dictionary)
+        self._pending_dictionaries[dict_id] = (dictionary, info)
+        return dict_id
+
+    def add_frame(self, entry: dict, frame: bytes) -> dict:
+        """Append a frame compressed elsewhere (e.g. in a worker process)"""
+        entry["offset"] = self._file.tell()
+        entry["length"] = len(frame)
+        self._file.write(frame)
+        self.entries.append(entry)
+        return entry
+
+    def add_file(self, rel_path: str, source: Path, choice: CodecChoice) -> dict:
+        """Stream ``source`` into a new frame and record it, with its codec, in the index"""
+        offset = self._file.tell()
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            stat = source.stat()
+            mtime = stat.st_mtime
+            encoder = self.codecs.encoder(choice, source.suffix in CRITICAL_EXTENSIONS, stat.st_size)
+            with open(source, "rb") as src:
+                # Read exactly the pledged size: zstd rejects a frame whose input differs from it
+                while size < stat.st_size:
+                    block = src.read(min(STREAM_BLOCK, stat.st_size - size))
+                    if not block:
+                        raise OSError(f"{source} shrank while it was being archived")
+                    digest.update(block)
+                    size += len(block)
+                    self._file.write(encoder.compress(block))
+            self._file.write(encoder.flush())
+        except Exception:
+            self._file.seek(offset)
+            self._file.truncate()
+            raise
+        entry = frame_entry(rel_path, size, mtime, digest.hexdigest(), choice)
+        entry["offset"] = offset
+        entry["length"] = self._file.tell() - offset
+        self.entries.append(entry)
+        return entry
+
+    def discard(self) -> None:
+        """Drop the partial archive, leaving whatever is at ``path`` untouched"""
+        self._file.close()
+        self._partial.unlink(missing_ok=True)
+
+    def close(self) -> None:
+        """Append the used dictionaries and the index footer, then close the file"""
+        used = {entry["dict"] for entry in self.entries if "dict" in entry}
+        for dict_id, (dictionary, info) in self._pending_dictionaries.items():
+            if dict_id in used:
+                data = dictionary.as_bytes()
+                self.dictionaries[str(dict_id)] = {"offset": self._file.tell(), "length": len(data), **info}
+                self._file.write(data)
+        index_offset = self._file.tell()
+        index = zstd.ZstdCompressor(level=19).compress(msgpack.packb({
+            "version": ARCHIVE_VERSION,
+            "id": self.id,
+            "created": time.time(),
+            "base": self.base,
+            "deleted": self.deleted,
+            "dictionaries": self.dictionaries,
+            "files": self.entries,
+        }))
+        self._file.write(index)
+        self._file.write(ARCHIVE_TRAILER.pack(index_offset, len(index), ARCHIVE_MAGIC))
+        self._file.close()
+        os.replace(self._partial, self.path)
+
+class ArchiveReader:
+    """Random access to the frames of a framed archive through its index footer"""
+    def __init__(self, path: Path):
+        self.path = path
+        self._file = open(path, "rb")
+        self.dctx = zstd.ZstdDecompressor()
+        self._dict_dctx: Dict[int, zstd.ZstdDecompressor] = {}
+        try:
+            magic, version = ARCHIVE_HEADER.unpack(self._file.read(ARCHIVE_HEADER.size))
+            if magic != ARCHIVE_MAGIC:
+                raise ValueError(f"{path} is not a framed archive")
+            if version > ARCHIVE_VERSION:
+                raise ValueError(f"{path} uses archive format {version}; this tool reads up to {ARCHIVE_VERSION}")
+            self._file.seek(-ARCHIVE_TRAILER.size, os.SEEK_END)
+            index_offset, index_length, magic = ARCHIVE_TRAILER.unpack(self._file.read(ARCHIVE_TRAILER.size))
+            if magic != ARCHIVE_MAGIC:
+                raise ValueError(f"{path} has no index footer (truncated archive?)")
+            self._file.seek(index_offset)
+            self.index = msgpack.unpackb(self.dctx.decompress(self._file.read(index_length)), raw=False)
+            self.entries: List[dict] = self.index["files"]
+        except (OSError, ValueError):
+            self._file.close()
+            raise
+        except Exception as e:
+            # struct.error from a short header or trailer, zstd/msgpack errors from a damaged
+            # index: callers only need to know the archive is unreadable.
+            self._file.close()
+            raise ValueError(f"{path} has a corrupt header or index: {e}") from e
+
+    def __enter__(self) -> "ArchiveReader":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self._file.close()
+
+    @staticmethod
+    def is_archive(path: Path) -> bool:
+        with open(path, "rb") as f:
+            return f.read(len(ARCHIVE_MAGIC)) == ARCHIVE_MAGIC
+
+    def _dictionary_dctx(self, dict_id: int) -> zstd.ZstdDecompressor:
+        if dict_id not in self._dict_dctx:
+            location = self.index["dictionaries"][str(dict_id)]
+            self._file.seek(location["offset"])
+            data = self._file.read(location["length"])
+            self._dict_dctx[dict_id] = zstd.ZstdDecompressor(dict_data=zstd.ZstdCompressionDict(data))
+        return self._dict_dctx[dict_id]
+
+    def _decoder(self, entry: dict, frame: _BoundedReader):
+        """File-like reader of the entry's decompressed content"""
+        codec = entry["codec"]
+        if codec == "stored":
+            return frame
+        if codec == "brotli":
+            return _BrotliReader(frame)
+        if codec == "zstd":
+            return self.dctx.stream_reader(frame, closefd=False)
+        if codec == "zstd-dict":
+            return self._dictionary_dctx(entry["dict"]).stream_reader(frame, closefd=False)
+        if codec == "zlib+zstd":
+            return _ZlibReader(self.dctx.stream_reader(frame, closefd=False))
+        raise ValueError(f"Unknown codec {codec!r} for {entry['path']}")
+
+    def iter_blocks(self, entry: dict) -> Iterator[bytes]:
+        """Decompressed content of one entry, at most STREAM_BLOCK bytes at a time.
+
+        Output past the entry's recorded size is treated as corruption, so a crafted frame
+        can't expand without bound.
+        """
+        reader = self._decoder(entry, _BoundedReader(self._file, entry["length"]))
+        self._file.seek(entry["offset"])  # after _decoder, which may read a dictionary from the archive
+        produced = 0
+        for block in iter(lambda: reader.read(STREAM_BLOCK), b""):
+            produced += len(block)
+            if produced > entry["size"]:
+                raise RuntimeError(f"{entry['path']} decompresses past its recorded size of {entry['size']} bytes")
+            yield block
+
+    def extract(self, entry: dict, output_path: Path) -> Path:
+        """Restore one entry below ``output_path``, verifying its hash before it replaces anything"""
+        root = output_path.resolve()
+        target = (root / entry["path"]).resolve()
+        if root not in target.parents:
+            raise ValueError(f"Refusing to extract outside {output_path}: {entry['path']}")
+        target.parent.mkdir(parents=True, exist_ok=True)
+        partial = target.with_name(target.name + ".partial")
+        digest = hashlib.sha256()
+        try:
+            with open(partial, "wb") as out:
+                for block in self.iter_blocks(entry):
+                    digest.update(block)
+                    out.write(block)
+            if digest.hexdigest() != entry["hash"]:
+                raise RuntimeError(f"Integrity check failed for {entry['path']}")
+            os.replace(partial, target)
+        finally:
+            partial.unlink(missing_ok=True)
+        os.utime(target, (entry["mtime"], entry["mtime"]))
+        return target
+
 # --- Core Archiver ---
 class ProjectArchiver:
-    def __init__(self, max_chunk_size: int = 12000, compression_level: int = 22):
-        self.max_chunk_size = max_chunk_size
+    def __init__(self, compression_level: int = 22, workers: int = COMPRESS_WORKERS,
+                 dict_cache_dir: Path = DICT_CACHE_DIR):
         self.compression_level = min(max(compression_level, 1), 22)
-        self.zstd_cctx = zstd.ZstdCompressor(level=self.compression_level, threads=-1)
+        self.workers = max(1, workers)
         self.zstd_dctx = zstd.ZstdDecompressor()
+        # Large files are streamed in this process, so give zstd the worker threads for those.
+        self.codecs = CodecContext(threads=self.workers if self.workers > 1 else 0)
+        self.dict_cache_dir = dict_cache_dir
+        self.dictionaries: Dict[str, zstd.ZstdCompressionDict] = {}
 
     def is_critical(self, path: Path) -> bool:
         """Check if path should be included in archive"""
         if any(part in NON_CRITICAL_DIRS for part in path.parts):
             return False
         if path.is_file():
-            return (path.suffix in CRITICAL_EXTENSIONS or 
-                    path.suffix not in NON_CRITICAL_FILES)
+            return is_critical_file(path)
         return True
 
     def get_project_files(self, project_path: Path) -> List[Path]:
-        """Get all critical files with progress tracking"""
+        """Get all critical files, pruning non-critical directories during the walk"""
         print("🔍 Scanning project directory...")
-        files = list(filter(self.is_critical, project_path.rglob('*')))
-        return [f for f in files if f.is_file()]
+        files = (Path(item.path) for item in walk(project_path, project_matcher(project_path), workers=WALK_WORKERS))
+        return sorted(f for f in files if is_critical_file(f))
 
-    def _preprocess_file(self, file_path: Path) -> Tuple[Path, bytes]:
-        """Preprocess file before compression"""
-        try:
-            raw_bytes = file_path.read_bytes()
-            if file_path.suffix in CRITICAL_EXTENSIONS:
-                return file_path, zlib.compress(raw_bytes, level=9)
-            return file_path, raw_bytes
-        except Exception as e:
-            print(f"⚠️ Error reading {file_path}: {str(e)}")
-            return file_path, b""
+    def use_dictionaries(self, dictionaries: Dict[str, zstd.ZstdCompressionDict]) -> None:
+        self.dictionaries = dictionaries
+        for dictionary in dictionaries.values():
+            self.codecs.add_dictionary(dictionary)
+
+    def choose_codec(self, file_path: Path, sample: bytes, size: int) -> CodecChoice:
+        """Pick a codec from the entropy and fast-compression ratio of the file's first block"""
+        if not sample or byte_entropy(sample) > STORED_ENTROPY_BITS:
+            return STORED
+        ratio = len(self.codecs.compress(sample, CodecChoice("zstd", PROBE_LEVEL), False)) / len(sample)
+        if ratio > STORED_RATIO:
+            return STORED  # already compressed (images, archives, fonts)
+
+        level = self.compression_level if ratio < ZSTD_FULL_LEVEL_RATIO else PROBE_LEVEL
+        if size < ZSTD_ULTRA_MIN_SIZE:
+            level = min(level, ZSTD_SMALL_FILE_LEVEL)
+        candidates = {CodecChoice("zstd", level): ratio}
+        dictionary = self.dictionaries.get(dict_category(file_path))
+        if dictionary is not None and size <= DICT_MAX_FILE_SIZE:
+            dict_id = dictionary.dict_id()
+            probe = self.codecs.compress(sample, CodecChoice("zstd-dict", PROBE_LEVEL, dict_id), False)
+            candidates[CodecChoice("zstd-dict", level, dict_id)] = len(probe) / len(sample)
+        if file_path.suffix in CRITICAL_EXTENSIONS and size <= BROTLI_MAX_FILE_SIZE:
+            probe = self.codecs.compress(sample, CodecChoice("brotli", BROTLI_PROBE_QUALITY), True)
+            candidates[CodecChoice("brotli", BROTLI_QUALITY)] = len(probe) / len(sample)
+        return min(candidates, key=candidates.get)
+
+    def compress_file(self, rel_path: str, file_path: Path) -> Tuple[dict, bytes]:
+        """Whole-file frame and index entry; only used below LARGE_FILE_SIZE"""
+        data = file_path.read_bytes()
+        mtime = file_path.stat().st_mtime
+        choice = self.choose_codec(file_path, data[:PROBE_BYTES], len(data))
+        frame = self.codecs.compress(data, choice, file_path.suffix in CRITICAL_EXTENSIONS)
+        return frame_entry(rel_path, len(data), mtime, hashlib.sha256(data).hexdigest(), choice), frame
 
-    def compress_project(self, project_path: Path) -> List[str]:
-        """Compress with progress tracking"""
+    def compress_batch(self, batch: List[Tuple[str, str]]) -> List[Tuple[str, Optional[dict], object]]:
+        """Compress a batch of (rel_path, path); failures come back as (rel_path, None, error)"""
+        results = []
+        for rel_path, path in batch:
+            try:
+                entry, frame = self.compress_file(rel_path, Path(path))
+                results.append((rel_path, entry, frame))
+            except OSError as e:
+                results.append((rel_path, None, str(e)))
+        return results
+
+    def save_compressed_project(self, project_path: Path, output_file: Path, incremental: bool = False,
+                                cache_path: Optional[Path] = ARCHIVE_CACHE) -> dict:
+        """Stream every critical file into a framed archive, choosing a codec per file.
+
+        Files below LARGE_FILE_SIZE are compressed in size-balanced batches across a process
+        pool and their frames appended as batches finish; larger files are streamed here with
+        zstd's own worker threads. At most two batches per worker are in flight at a time.
+
+        With ``incremental`` the archive is a delta against the archive recorded in
+        ``cache_path``: only changed files and tombstones for deleted ones. Without a usable
+        base a full archive is written. ``cache_path=None`` leaves the cache untouched.
+        """
         files = self.get_project_files(project_path)
         if not files:
             raise ValueError("No files found to compress")
-            
-        project_data = {}
-        raw_contents = []
-        progress = ProgressBar(len(files), "Compressing")
-        
-        with ThreadPoolExecutor() as executor:
-            futures = {executor.submit(self._preprocess_file, f): f for f in files}
-            
-            for i, future in enumerate(as_completed(futures), 1):
-                file_path, preprocessed = future.result()
-                if preprocessed:
-                    content_hash = hashlib.sha256(preprocessed).hexdigest()
-                    project_data[file_path.name] = {
-                        "content": base64.b85encode(zstd.compress(preprocessed)).decode('ascii'),
-                        "hash": content_hash,
-                        "type": "text" if file_path.suffix in CRITICAL_EXTENSIONS else "binary",
-                        "path": str(file_path.relative_to(project_path))
-                    }
-                    raw_contents.append(preprocessed)
-                progress.update(i)
-        
-        progress.close()
 
-        # Train dictionary if enough samples
-        if len(raw_contents) > 1:
+        started = time.perf_counter()
+        cache = ArchiveCache(cache_path) if cache_path is not None else None
+        base = cache.base_for(project_path) if cache is not None and incremental else None
+        if incremental and base is None:
+            print("ℹ️ No base archive recorded for this project; writing a full archive")
+        if base is not None:
+            chain = self.archive_chain(base)
+            for reader in chain:
+                reader.close()
+            if output_file.resolve() in {reader.path.resolve() for reader in chain}:
+                raise ValueError(f"{output_file} is part of the delta chain it would extend; "
+                                 f"write the delta to a new file")
+
+        signatures: Dict[str, dict] = {}
+        sized, large = [], []
+        for file_path in files:
+            rel_path = file_path.relative_to(project_path).as_posix()
             try:
-                dict_data = zstd.train_dictionary(512 * 1024, raw_contents)
-                self.zstd_cctx = zstd.ZstdCompressor(
-                    level=self.compression_level, 
-                    dict_data=dict_data, 
-                    threads=-1
-                )
-                project_data["__dict__"] = base64.b85encode(dict_data.as_bytes()).decode('ascii')
-            except Exception as e:
-                print(f"⚠️ Dictionary training failed: {str(e)}")
+                signature = ArchiveCache.signature(file_path.stat())
+            except OSError as e:
+                print(f"⚠️ Error reading {file_path}: {str(e)}")
+                continue
+            signatures[rel_path] = signature
+            if base is not None and cache.unchanged(rel_path, signature):
+                signature["hash"] = cache.files[rel_path]["hash"]
+                continue
+            (large if signature["size"] > LARGE_FILE_SIZE else sized).append((file_path, signature["size"]))
+        deleted = sorted(set(cache.files) - set(signatures)) if base is not None else []
+        if base is not None and not sized and not large and not deleted:
+            print(f"✅ No changes since {base}; nothing to archive")
+            return {"files": 0, "bytes": 0, "stored": 0, "seconds": time.perf_counter() - started}
 
-        print("📦 Final packaging...")
-        json_str = msgpack.packb(project_data)
-        compressed = self.zstd_cctx.compress(json_str)
-        encoded = base64.b85encode(compressed).decode('ascii')
-        
-        return [encoded[i:i + self.max_chunk_size] 
-                for i in range(0, len(encoded), self.max_chunk_size)]
-
-    def save_compressed_project(self, project_path: Path, output_file: Path) -> None:
-        """Save with progress tracking"""
-        chunks = self.compress_project(project_path)
-        with open(output_file, 'w', encoding='utf-8') as f:
-            for i, chunk in enumerate(chunks, 1):
-                f.write(chunk + '\n')
-                print(f"\r📁 Saving chunk {i}/{len(chunks)}", end="")
-        print("\n✅ Compression complete!")
+        def previous_hash(rel_path: str) -> Optional[str]:
+            return cache.files.get(rel_path, {}).get("hash") if base is not None else None
+
+        def failed(rel_path: str, error: str) -> None:
+            print(f"\n⚠️ Error reading {rel_path}: {error}")
+            if previous_hash(rel_path):
+                signatures[rel_path] = cache.files[rel_path]  # keep the version the base has
+            else:
+                signatures.pop(rel_path, None)
+
+        dict_cache = DictionaryCache(self.dict_cache_dir)
+        if base is not None:
+            # Drift checks and training sample the whole tree, which is what a delta avoids reading.
+            dictionaries = dict_cache.cached_for([path for path, _ in sized])
+        else:
+            dictionaries = dict_cache.dictionaries_for(files)
+        self.use_dictionaries({
+            category: dictionary for category, dictionary in dictionaries.items()
+            if _dictionary_pays_off(dictionary, [path for path, size in sized
+                                                 if size <= DICT_MAX_FILE_SIZE and dict_category(path) == category])
+        })
+        batches = [[(path.relative_to(project_path).as_posix(), str(path)) for path, _ in batch]
+                   for batch in size_balanced_batches(sized)]
+
+        codecs = Counter()
+        done = 0
+        progress = ProgressBar(len(sized) + len(large), "Compressing")
+
+        with ArchiveWriter(output_file, self.codecs, base, cache.archive_id if base else None) as archive:
+            archive.deleted = deleted
+            for category, dictionary in self.dictionaries.items():
+                archive.add_dictionary(dictionary, category=category, version=dict_cache.version(category))
+
+            def write(results):
+                nonlocal done
+                for rel_path, entry, frame in results:
+                    if entry is None:
+                        failed(rel_path, frame)
+                    else:
+                        signatures[rel_path]["hash"] = entry["hash"]
+                        if entry["hash"] != previous_hash(rel_path):  # otherwise only touched
+                            archive.add_frame(entry, frame)
+                            codecs[entry["codec"]] += 1
+                    done += 1
+                progress.update(done)
+
+            if self.workers > 1 and len(batches) > 1:
+                dictionaries = {category: d.as_bytes() for category, d in self.dictionaries.items()}
+                with ProcessPoolExecutor(self.workers, initializer=_init_worker,
+                                         initargs=(self.compression_level, dictionaries)) as pool:
+                    pending = set()
+                    for batch in batches:
+                        if len(pending) >= self.workers * 2:
+                            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                            for future in finished:
+                                write(future.result())
+                        pending.add(pool.submit(_compress_batch, batch))
+                    for future in as_completed(pending):
+                        write(future.result())
+            else:
+                for batch in batches:
+                    write(self.compress_batch(batch))
+
+            for file_path, size in large:
+                rel_path = file_path.relative_to(project_path).as_posix()
+                try:
+                    if previous_hash(rel_path):
+                        digest = hashlib.sha256()
+                        with open(file_path, "rb") as f:
+                            for block in iter(lambda: f.read(STREAM_BLOCK), b""):
+                                digest.update(block)
+                        if digest.hexdigest() == previous_hash(rel_path):
+                            signatures[rel_path]["hash"] = digest.hexdigest()
+                            done += 1
+                            progress.update(done)
+                            continue
+                    with open(file_path, "rb") as f:
+                        sample = f.read(PROBE_BYTES)
+                    choice = self.choose_codec(file_path, sample, size)
+                    entry = archive.add_file(rel_path, file_path, choice)
+                    signatures[rel_path]["hash"] = entry["hash"]
+                    codecs[choice.codec] += 1
+                except OSError as e:
+                    failed(rel_path, str(e))
+                done += 1
+                progress.update(done)
+
+            # Only touched files (same hash, new mtime): a delta would hold nothing but still
+            # lengthen the chain, so keep the base and just record the new signatures.
+            empty = base is not None and not archive.entries and not deleted
+            if empty:
+                archive.discard()
+        progress.close()
+
+        if cache is not None:
+            if empty:
+                cache.save(project_path, base, cache.archive_id, signatures)
+            else:
+                cache.save(project_path, output_file, archive.id, signatures)
+        if empty:
+            print(f"✅ No content changes since {base}; nothing to archive")
+            return {"files": 0, "bytes": 0, "stored": 0, "seconds": time.perf_counter() - started}
+
+        elapsed = time.perf_counter() - started
+        total = sum(entry["size"] for entry in archive.entries)
+        stored = output_file.stat().st_size
+        kind = f"Delta against {base.name}: " if base is not None else ""
+        print(f"✅ Compression complete! {kind}{len(archive.entries)} files"
+              f"{f', {len(deleted)} deleted' if base is not None else ''}, "
+              f"{total / 1024 / 1024:.2f} MB → {stored / 1024 / 1024:.2f} MB "
+              f"in {elapsed:.2f}s ({total / 1024 / 1024 / max(elapsed, 1e-9):.1f} MB/s, {self.workers} workers)")
+        print("📊 Codecs: " + ", ".join(f"{codec} {count}" for codec, count in codecs.most_common()))
+        return {"files": len(archive.entries), "bytes": total, "stored": stored, "seconds": elapsed}
+
+    def extract_archive(self, input_file: Path, output_path: Path) -> None:
+        """Restore every file of a framed archive"""
+        output_path.mkdir(parents=True, exist_ok=True)
+        with ArchiveReader(input_file) as archive:
+            progress = ProgressBar(len(archive.entries), "Decompressing")
+            for i, entry in enumerate(archive.entries, 1):
+                try:
+                    archive.extract(entry, output_path)
+                except Exception as e:
+                    print(f"\n⚠️ Error with {entry['path']}: {str(e)}")
+                progress.update(i)
+            progress.close()
+        print("✅ Decompression complete!")
+
+    @staticmethod
+    def archive_chain(archive_file: Path) -> List["ArchiveReader"]:
+        """Open an archive and every base it builds on, newest first"""
+        chain = [ArchiveReader(archive_file)]
+        try:
+            while chain[-1].index.get("base"):
+                if len(chain) > MAX_CHAIN_LENGTH:
+                    raise ValueError(f"Delta chain of {archive_file} is longer than {MAX_CHAIN_LENGTH}")
+                base = chain[-1].index["base"]
+                parent = chain[-1].path.parent / base["path"]
+                reader = ArchiveReader(parent)
+                chain.append(reader)
+                if reader.index.get("id") != base["id"]:
+                    raise ValueError(f"{parent} is not the base {chain[-2].path} was written against")
+        except Exception:
+            for reader in chain:
+                reader.close()
+            raise
+        return chain
+
+    def restore_snapshot(self, archive_file: Path, output_path: Path) -> None:
+        """Restore the project as of ``archive_file``: its base plus every delta up to it.
+
+        The chain is resolved newest first so each file is extracted once, from the latest
+        archive that has it; files tombstoned later in the chain are removed from the output.
+        """
+        chain = self.archive_chain(archive_file)
+        try:
+            resolved, plan, removed = set(), [], []
+            for reader in chain:
+                for entry in reader.entries:
+                    if entry["path"] not in resolved:
+                        resolved.add(entry["path"])
+                        plan.append((reader, entry))
+                for rel_path in reader.index.get("deleted", []):
+                    if rel_path not in resolved:
+                        resolved.add(rel_path)
+                        removed.append(rel_path)
+
+            print(f"🔗 Replaying {len(chain)} archive(s): " + " → ".join(r.path.name for r in reversed(chain)))
+            output_path.mkdir(parents=True, exist_ok=True)
+            progress = ProgressBar(max(1, len(plan)), "Restoring")
+            for i, (reader, entry) in enumerate(plan, 1):
+                try:
+                    reader.extract(entry, output_path)
+                except Exception as e:
+                    print(f"\n⚠️ Error with {entry['path']}: {str(e)}")
+                progress.update(i)
+            progress.close()
+
+            root = output_path.resolve()
+            for rel_path in removed:
+                target = (root / rel_path).resolve()
+                if root in target.parents and target.is_file():
+                    target.unlink()
+        finally:
+            for reader in chain:
+                reader.close()
+        print(f"✅ Restore complete! {len(plan)} files restored, {len(removed)} deleted")
 
     def decompress_project(self, chunks: List[str], output_path: Path) -> None:
-        """Decompress with progress tracking"""
+        """Decompress a legacy base85 text archive"""
         print("🔓 Starting decompression...")
         combined = ''.join(chunks)
         compressed = base64.b85decode(combined.encode('ascii'))
@@ -202,10 +1065,378 @@ class ProjectArchiver:
     @classmethod
     def load_and_decompress(cls, input_file: Path, output_path: Path) -> None:
         """Load compressed file and decompress to output directory"""
+        if ArchiveReader.is_archive(input_file):
+            cls().extract_archive(input_file, output_path)
+            return
         with open(input_file, 'r', encoding='utf-8') as f:
             chunks = f.readlines()
         cls().decompress_project(chunks, output_path)
 
+# --- Process pool workers ---
+_worker_archiver: Optional[ProjectArchiver] = None
+
+def _init_worker(compression_level: int, dictionaries: Dict[str, bytes]) -> None:
+    global _worker_archiver
+    _worker_archiver = ProjectArchiver(compression_level, workers=1)
+    _worker_archiver.use_dictionaries({category: zstd.ZstdCompressionDict(data)
+                                       for category, data in dictionaries.items()})
+
+def _compress_batch(batch: List[Tuple[str, str]]) -> List[Tuple[str, Optional[dict], object]]:
+    return _worker_archiver.compress_batch(batch)
+
+# --- Deduplicating Chunk Store ---
+# FastCDC-style gear hash: each byte shifts the hash left and adds a per-byte random value,
+# so the top bits depend on the last 64 bytes only and cut points move with the content,
+# not with offsets. The table is derived deterministically so boundaries are stable
+# across runs and machines.
+_GEAR = [int.from_bytes(hashlib.sha256(bytes([i])).digest()[:8], "big") for i in range(256)]
+_MASK64 = (1 << 64) - 1
+
+def _top_bits_mask(bits: int) -> int:
+    return ((1 << bits) - 1) << (64 - bits)
+
+# Normalized chunking: a stricter mask before CDC_AVG and a looser one after it keeps
+# chunk sizes clustered around the average.
+CDC_MASK_S = _top_bits_mask(CDC_AVG.bit_length() + 1)
+CDC_MASK_L = _top_bits_mask(CDC_AVG.bit_length() - 3)
+
+def cdc_boundary(data, start: int, end: int) -> int:
+    """End of the chunk starting at ``start``; ``end`` must be the end of the input or at
+    least CDC_MAX bytes away"""
+    size = end - start
+    if size <= CDC_MIN:
+        return end
+    normal = start + min(size, CDC_AVG)
+    limit = start + min(size, CDC_MAX)
+    gear = _GEAR
+    h = 0
+    i = start + CDC_MIN
+    # Iterating a slice avoids a bounds-checked index per byte (~25% faster than a while loop)
+    for byte in data[i:normal]:
+        h = ((h << 1) + gear[byte]) & _MASK64
+        i += 1
+        if not h & CDC_MASK_S:
+            return i
+    for byte in data[i:limit]:
+        h = ((h << 1) + gear[byte]) & _MASK64
+        i += 1
+        if not h & CDC_MASK_L:
+            return i
+    return limit
+
+def iter_chunks(stream) -> Iterator[bytes]:
+    """Content-defined chunks of a binary stream, holding at most STREAM_BLOCK + CDC_MAX bytes"""
+    buffer = bytearray()
+    pos = 0
+    eof = False
+    while True:
+        while not eof and len(buffer) - pos < CDC_MAX:
+            block = stream.read(STREAM_BLOCK)
+            if not block:
+                eof = True
+            else:
+                del buffer[:pos]
+                pos = 0
+                buffer += block
+        if pos >= len(buffer):
+            return
+        cut = cdc_boundary(buffer, pos, len(buffer))
+        yield bytes(buffer[pos:cut])
+        pos = cut
+
+class ChunkStore:
+    """Content-addressed chunks shared by every snapshot of a project.
+
+    Files are cut into content-defined chunks named by their sha256; a chunk already in
+    the store is never written again, so a snapshot only adds the chunks around what
+    changed. Each snapshot is a manifest (zstd msgpack) listing every file's chunks.
+    ``gc`` removes chunks no manifest references; don't run it while a snapshot is being
+    written (chunks younger than CHUNK_GC_GRACE_SECONDS are always kept).
+    """
+    def __init__(self, root: Path = CHUNK_STORE, compression_level: int = 19):
+        self.root = root
+        self.chunks_dir = root / "chunks"
+        self.snapshots_dir = root / "snapshots"
+        self.cctx = zstd.ZstdCompressor(level=compression_level)
+        self.dctx = zstd.ZstdDecompressor()
+
+    def _chunk_path(self, digest: bytes) -> Path:
+        name = digest.hex()
+        return self.chunks_dir / name[:2] / name
+
+    def has(self, digest: bytes) -> bool:
+        return self._chunk_path(digest).exists()
+
+    def encode(self, chunk: bytes) -> bytes:
+        compressed = self.cctx.compress(chunk)
+        return b"Z" + compressed if len(compressed) < len(chunk) else b"S" + chunk
+
+    def put(self, digest: bytes, payload: bytes) -> bool:
+        """Store an encoded chunk unless it is already present; True if it was written"""
+        path = self._chunk_path(digest)
+        if path.exists():
+            return False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp.write_bytes(payload)
+        os.replace(tmp, path)
+        return True
+
+    def get(self, digest: bytes) -> bytes:
+        payload = self._chunk_path(digest).read_bytes()
+        chunk = self.dctx.decompress(payload[1:]) if payload[:1] == b"Z" else payload[1:]
+        if hashlib.sha256(chunk).digest() != digest:
+            raise RuntimeError(f"Chunk {digest.hex()} is corrupt")
+        return chunk
+
+    def chunk_file(self, rel_path: str, path: Path, write: bool) -> Tuple[dict, List[Tuple[bytes, Optional[bytes], int]]]:
+        """Chunk one file; returns its manifest entry and (digest, payload, size) of the chunks
+        the store lacks.
+
+        With ``write`` new chunks are stored immediately (payload None in the result);
+        otherwise their encoded payloads are returned for the caller to store.
+        """
+        stat = path.stat()
+        file_digest = hashlib.sha256()
+        chunks, new, seen = [], [], set()
+        with open(path, "rb") as f:
+            for chunk in iter_chunks(f):
+                file_digest.update(chunk)
+                digest = hashlib.sha256(chunk).digest()
+                chunks.append(digest)
+                if digest in seen or self.has(digest):
+                    continue
+                seen.add(digest)
+                payload = self.encode(chunk)
+                if write:
+                    self.put(digest, payload)
+                    payload = None
+                new.append((digest, payload, len(chunk)))
+        entry = {"path": rel_path, **ArchiveCache.signature(stat), "hash": file_digest.hexdigest(),
+                 "chunks": chunks}
+        return entry, new
+
+    def chunk_batch(self, batch: List[Tuple[str, str]]) -> List[Tuple[str, Optional[dict], object]]:
+        """Chunk a batch of (rel_path, path) in a worker; failures come back as (rel_path, None, error)"""
+        results = []
+        for rel_path, path in batch:
+            try:
+                results.append((rel_path, *self.chunk_file(rel_path, Path(path), write=False)))
+            except OSError as e:
+                results.append((rel_path, None, str(e)))
+        return results
+
+    def chunk_large(self, rel_path: str, path: str) -> List[Tuple[str, Optional[dict], object]]:
+        """Chunk one large file, storing its new chunks directly instead of returning them"""
+        try:
+            return [(rel_path, *self.chunk_file(rel_path, Path(path), write=True))]
+        except OSError as e:
+            return [(rel_path, None, str(e))]
+
+    def _write_manifest(self, manifest: dict) -> Path:
+        self.snapshots_dir.mkdir(parents=True, exist_ok=True)
+        path = self.snapshots_dir / f"{manifest['id']}.snap"
+        tmp = path.with_suffix(".tmp")
+        tmp.write_bytes(zstd.ZstdCompressor(level=19).compress(msgpack.packb(manifest)))
+        os.replace(tmp, path)
+        return path
+
+    def load_manifest(self, snapshot_id: str) -> dict:
+        return msgpack.unpackb(self.dctx.decompress((self.snapshots_dir / f"{snapshot_id}.snap").read_bytes()),
+                               raw=False)
+
+    def snapshot_ids(self) -> List[str]:
+        """Snapshot ids, oldest first (ids start with their creation time)"""
+        if not self.snapshots_dir.exists():
+            return []
+        return sorted(path.stem for path in self.snapshots_dir.glob("*.snap"))
+
+    def resolve(self, snapshot: str) -> str:
+        """Full id for ``latest``, an exact id or a unique id prefix"""
+        ids = self.snapshot_ids()
+        if snapshot == "latest" and ids:
+            return ids[-1]
+        matches = [snapshot_id for snapshot_id in ids if snapshot_id.startswith(snapshot)]
+        if len(matches) != 1:
+            raise ValueError(f"{snapshot!r} matches {len(matches)} snapshots")
+        return matches[0]
+
+    def _previous(self, project: str) -> Dict[str, dict]:
+        for snapshot_id in reversed(self.snapshot_ids()):
+            manifest = self.load_manifest(snapshot_id)
+            if manifest.get("project") == project:
+                return {entry["path"]: entry for entry in manifest["files"]}
+        return {}
+
+    def snapshot(self, project_path: Path, workers: int = COMPRESS_WORKERS) -> str:
+        """Store a snapshot of the project's critical files and return its id.
+
+        Files whose size, mtime and inode match the project's previous snapshot reuse its
+        chunk list without being read. The rest are chunked on a process pool: large files
+        one per task, first, with workers writing their chunks straight to the store, and
+        the others in size-balanced batches. Only chunks the store lacks are written.
+        """
+        started = time.perf_counter()
+        project = str(project_path.resolve())
+        files = ProjectArchiver().get_project_files(project_path)
+        previous = self._previous(project)
+
+        entries: List[dict] = []
+        sized, large = [], []
+        for file_path in files:
+            rel_path = file_path.relative_to(project_path).as_posix()
+            try:
+                signature = ArchiveCache.signature(file_path.stat())
+            except OSError as e:
+                print(f"⚠️ Error reading {file_path}: {str(e)}")
+                continue
+            known = previous.get(rel_path)
+            if known and all(known[key] == signature[key] for key in ("size", "mtime", "inode")):
+                entries.append(known)
+                continue
+            (large if signature["size"] > LARGE_FILE_SIZE else sized).append((file_path, signature["size"]))
+
+        new_chunks = new_bytes = stored_bytes = 0
+        changed_bytes = sum(size for _, size in sized + large)
+        done = 0
+        progress = ProgressBar(max(1, len(sized) + len(large)), "Chunking")
+
+        def record(results):
+            nonlocal done, new_chunks, new_bytes, stored_bytes
+            for rel_path, entry, new in results:
+                if entry is None:
+                    print(f"\n⚠️ Error reading {rel_path}: {new}")
+                else:
+                    for digest, payload, size in new:
+                        if payload is None or self.put(digest, payload):
+                            new_chunks += 1
+                            new_bytes += size
+                            stored_bytes += self._chunk_path(digest).stat().st_size
+                    entries.append(entry)
+                done += 1
+            progress.update(done)
+
+        # Large files go first so the longest tasks don't end up trailing on one worker.
+        tasks = [(_chunk_large, (path.relative_to(project_path).as_posix(), str(path)))
+                 for path, _ in sorted(large, key=lambda item: item[1], reverse=True)]
+        tasks += [(_chunk_batch, ([(path.relative_to(project_path).as_posix(), str(path)) for path, _ in batch],))
+                  for batch in size_balanced_batches(sized)]
+        if workers > 1 and len(tasks) > 1:
+            with ProcessPoolExecutor(workers, initializer=_init_chunk_worker, initargs=(str(self.root),)) as pool:
+                pending = set()
+                for task, args in tasks:
+                    if len(pending) >= workers * 2:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            record(future.result())
+                    pending.add(pool.submit(task, *args))
+                for future in as_completed(pending):
+                    record(future.result())
+        else:
+            for task, args in tasks:
+                record(self.chunk_large(*args) if task is _chunk_large else self.chunk_batch(*args))
+        progress.close()
+
+        snapshot_id = f"{datetime.now().strftime('%Y%m%dT%H%M%S%f')}-{uuid.uuid4().hex[:8]}"
+        entries.sort(key=lambda entry: entry["path"])
+        self._write_manifest({"id": snapshot_id, "created": time.time(), "project": project, "files": entries})
+        print(f"✅ Snapshot {snapshot_id}: {len(entries)} files, {len(sized) + len(large)} changed "
+              f"({changed_bytes / 1024 / 1024:.2f} MB); {new_chunks} new chunks, "
+              f"{new_bytes / 1024 / 1024:.2f} MB → {stored_bytes / 1024 / 1024:.2f} MB stored "
+              f"in {time.perf_counter() - started:.2f}s")
+        return snapshot_id
+
+    def restore(self, snapshot: str, output_path: Path) -> None:
+        """Reassemble every file of a snapshot from its chunks, verifying file hashes"""
+        manifest = self.load_manifest(self.resolve(snapshot))
+        root = output_path.resolve()
+        progress = ProgressBar(max(1, len(manifest["files"])), "Restoring")
+        for i, entry in enumerate(manifest["files"], 1):
+            try:
+                target = (root / entry["path"]).resolve()
+                if root not in target.parents:
+                    raise ValueError(f"Refusing to extract outside {output_path}")
+                target.parent.mkdir(parents=True, exist_ok=True)
+                partial = target.with_name(target.name + ".partial")
+                digest = hashlib.sha256()
+                try:
+                    with open(partial, "wb") as out:
+                        for chunk_digest in entry["chunks"]:
+                            chunk = self.get(chunk_digest)
+                            digest.update(chunk)
+                            out.write(chunk)
+                    if digest.hexdigest() != entry["hash"]:
+                        raise RuntimeError("Integrity check failed")
+                    os.replace(partial, target)
+                finally:
+                    partial.unlink(missing_ok=True)
+                os.utime(target, ns=(entry["mtime"], entry["mtime"]))
+            except Exception as e:
+                print(f"\n⚠️ Error with {entry['path']}: {str(e)}")
+            progress.update(i)
+        progress.close()
+        print(f"✅ Restored snapshot {manifest['id']} ({len(manifest['files'])} files)")
+
+    def forget(self, snapshot: str) -> str:
+        """Delete a snapshot manifest; its chunks go at the next ``gc``"""
+        snapshot_id = self.resolve(snapshot)
+        (self.snapshots_dir / f"{snapshot_id}.snap").unlink()
+        return snapshot_id
+
+    def gc(self, grace_seconds: float = CHUNK_GC_GRACE_SECONDS) -> Tuple[int, int]:
+        """Delete chunks no snapshot references; returns (chunks removed, bytes freed)"""
+        referenced = set()
+        for snapshot_id in self.snapshot_ids():
+            for entry in self.load_manifest(snapshot_id)["files"]:
+                referenced.update(digest.hex() for digest in entry["chunks"])
+        cutoff = time.time() - grace_seconds
+        removed = freed = 0
+        if self.chunks_dir.exists():
+            for path in self.chunks_dir.glob("*/*"):
+                try:
+                    stat = path.stat()
+                    if path.name in referenced or stat.st_mtime > cutoff:
+                        continue
+                    path.unlink()
+                except OSError:
+                    continue
+                removed += 1
+                freed += stat.st_size
+        print(f"🧹 Removed {removed} unreferenced chunks ({freed / 1024 / 1024:.2f} MB), "
+              f"{len(referenced)} chunks referenced")
+        return removed, freed
+
+_worker_store: Optional[ChunkStore] = None
+
+def _init_chunk_worker(root: str) -> None:
+    global _worker_store
+    _worker_store = ChunkStore(Path(root))
+
+def _chunk_batch(batch: List[Tuple[str, str]]) -> List[Tuple[str, Optional[dict], object]]:
+    return _worker_store.chunk_batch(batch)
+
+def _chunk_large(rel_path: str, path: str) -> List[Tuple[str, Optional[dict], object]]:
+    return _worker_store.chunk_large(rel_path, path)
+
+def benchmark(project_path: Path, compression_level: int, max_workers: int) -> None:
+    """Archive the project with 1, 2, 4, ... workers and report throughput and speedup"""
+    counts, workers = [], 1
+    while workers < max_workers:
+        counts.append(workers)
+        workers *= 2
+    counts.append(max_workers)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for workers in counts:
+            stats = ProjectArchiver(compression_level, workers).save_compressed_project(
+                project_path, Path(tmp) / f"bench-{workers}.rra", cache_path=None)
+            results.append((workers, stats))
+    base = results[0][1]["seconds"]
+    print("\n📈 Throughput")
+    for workers, stats in results:
+        rate = stats["bytes"] / 1024 / 1024 / max(stats["seconds"], 1e-9)
+        print(f"  {workers:>3} workers: {rate:8.1f} MB/s  speedup {base / max(stats['seconds'], 1e-9):4.2f}x")
+
 # Assuming other necessary imports are already included
 
 def bcompress(src: Path, dest: Path, max_workers: int = 4, chunk_size: int = 65536, parse_percentage: float = 0.63) -> None:
@@ -222,10 +1453,9 @@ def bcompress(src: Path, dest: Path, max_workers: int = 4, chunk_size: int = 655
 
     # Get files with ownership check
     files = []
-    for f in src.rglob('*'):
-        if (f.is_file() 
-            and not any(p in NON_CRITICAL_DIRS for p in f.parts)
-            and f.suffix not in NON_CRITICAL_FILES):
+    for item in walk(src, project_matcher(src), workers=max_workers):
+        f = Path(item.path)
+        if f.suffix not in NON_CRITICAL_FILES:
             try:
                 take_ownership(f)  # Ensure we have access
                 files.append(f)
@@ -366,8 +1596,84 @@ def decompress_and_restore(base_path: str, expected_checksum: str, restore_to: s
     restore_files(packed_data, restore_to)
 
 def main():
-    decompress_and_restore(r"E:\Dev\websites\repairradar\scripts\archiver\upload.txt", r"14a128a3b7c3de8c5a6efded948bff4e24173f8844e4804298e09210f2352d5c", r"E:\Dev\websites\repairradar\scripts\archiver\brottest\decomp")
-    return exit()
+    parser = argparse.ArgumentParser(description="Archive and restore the project's critical files")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    archive = commands.add_parser("archive", help="write a framed archive of a project")
+    archive.add_argument("project", type=Path)
+    archive.add_argument("output", type=Path)
+    archive.add_argument("--level", type=int, default=22, help="zstd compression level (1-22)")
+    archive.add_argument("--workers", type=int, default=COMPRESS_WORKERS, help="compression processes")
+    archive.add_argument("--incremental", action="store_true",
+                         help="write only changes since the archive recorded in the cache")
+    archive.add_argument("--cache", type=Path, default=ARCHIVE_CACHE, help="incremental state file")
+
+    extract = commands.add_parser("extract", help="extract the files of one framed (or legacy text) archive")
+    extract.add_argument("archive", type=Path)
+    extract.add_argument("output", type=Path)
+
+    restore = commands.add_parser("restore", help="restore a snapshot by replaying its base and delta chain")
+    restore.add_argument("archive", type=Path)
+    restore.add_argument("output", type=Path)
+
+    bench = commands.add_parser("benchmark", help="measure compression throughput per worker count")
+    bench.add_argument("project", type=Path)
+    bench.add_argument("--level", type=int, default=19)
+    bench.add_argument("--max-workers", type=int, default=COMPRESS_WORKERS)
+
+    snapshot = commands.add_parser("snapshot", help="store a deduplicated snapshot in the chunk store")
+    snapshot.add_argument("project", type=Path)
+    snapshot.add_argument("--workers", type=int, default=COMPRESS_WORKERS)
+
+    snapshots = commands.add_parser("snapshots", help="list snapshots in the chunk store")
+
+    snapshot_restore = commands.add_parser("snapshot-restore", help="restore a snapshot from the chunk store")
+    snapshot_restore.add_argument("snapshot", help="snapshot id, unique id prefix or 'latest'")
+    snapshot_restore.add_argument("output", type=Path)
+
+    forget = commands.add_parser("forget", help="delete a snapshot (its chunks go at the next gc)")
+    forget.add_argument("snapshot")
+
+    gc = commands.add_parser("gc", help="delete chunks no snapshot references")
+    gc.add_argument("--grace", type=float, default=CHUNK_GC_GRACE_SECONDS,
+                    help="keep unreferenced chunks younger than this many seconds")
+
+    for command in (snapshot, snapshots, snapshot_restore, forget, gc):
+        command.add_argument("--store", type=Path, default=CHUNK_STORE)
+
+    parts = commands.add_parser("restore-parts", help="restore a split Brotli upload")
+    parts.add_argument("base_path")
+    parts.add_argument("checksum")
+    parts.add_argument("output")
+
+    args = parser.parse_args()
+    if args.command == "archive":
+        try:
+            ProjectArchiver(args.level, args.workers).save_compressed_project(
+                args.project, args.output, args.incremental, args.cache)
+        except ValueError as e:  # no files, or an output that is part of the delta chain
+            parser.error(str(e))
+    elif args.command == "snapshot":
+        ChunkStore(args.store).snapshot(args.project, args.workers)
+    elif args.command == "snapshots":
+        store = ChunkStore(args.store)
+        for snapshot_id in store.snapshot_ids():
+            manifest = store.load_manifest(snapshot_id)
+            print(f"{snapshot_id}  {len(manifest['files']):>6} files  {manifest['project']}")
+    elif args.command == "snapshot-restore":
+        ChunkStore(args.store).restore(args.snapshot, args.output)
+    elif args.command == "forget":
+        print(f"🗑️ Forgot snapshot {ChunkStore(args.store).forget(args.snapshot)}")
+    elif args.command == "gc":
+        ChunkStore(args.store).gc(args.grace)
+    elif args.command == "restore":
+        ProjectArchiver().restore_snapshot(args.archive, args.output)
+    elif args.command == "benchmark":
+        benchmark(args.project, args.level, args.max_workers)
+    elif args.command == "extract":
+        ProjectArchiver.load_and_decompress(args.archive, args.output)
+    else:
+        decompress_and_restore(args.base_path, args.checksum, args.output)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
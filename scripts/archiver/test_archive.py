@@ -0,0 +1,85 @@
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import main
+from main import ARCHIVE_CACHE_VERSION, ARCHIVE_MAGIC, ArchiveCache, ArchiveReader, ProjectArchiver
+
+class TruncatedArchive(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = Path(self._tmp.name)
+        self.project = self.tmp / "project"
+        self.project.mkdir()
+        self.archive = self.tmp / "project.rra"
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _cache(self) -> ArchiveCache:
+        path = self.tmp / "cache.json"
+        path.write_text(json.dumps({"version": ARCHIVE_CACHE_VERSION, "project": str(self.project.resolve()),
+                                    "archive": str(self.archive), "archive_id": "x", "files": {}}))
+        return ArchiveCache(path)
+
+    def test_short_header_is_a_value_error(self):
+        self.archive.write_bytes(ARCHIVE_MAGIC[:2])
+        with self.assertRaises(ValueError):
+            ArchiveReader(self.archive)
+
+    def test_base_for_ignores_a_truncated_archive(self):
+        for content in (ARCHIVE_MAGIC[:2], ARCHIVE_MAGIC + b"\x01\0\0\0" + b"\0" * 8):
+            self.archive.write_bytes(content)
+            self.assertIsNone(self._cache().base_for(self.project))
+
+class IncrementalArchive(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = Path(self._tmp.name)
+        self.project = self.tmp / "project"
+        (self.project / "src").mkdir(parents=True)
+        self.file = self.project / "src" / "service.ts"
+        self.file.write_text("export const status = 'open';\n")
+        self.cache = self.tmp / "cache.json"
+        self.archiver = ProjectArchiver(workers=1, dict_cache_dir=self.tmp / "dictionaries")
+        self.base = self.tmp / "base.rra"
+        self.archiver.save_compressed_project(self.project, self.base, cache_path=self.cache)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _touch(self):
+        stat = self.file.stat()
+        os.utime(self.file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    def test_touched_files_do_not_write_an_empty_delta(self):
+        self._touch()
+        delta = self.tmp / "delta.rra"
+        result = self.archiver.save_compressed_project(self.project, delta, True, self.cache)
+        self.assertEqual(result["files"], 0)
+        self.assertFalse(delta.exists())
+        self.assertFalse(delta.with_name("delta.rra.partial").exists())
+        cache = ArchiveCache(self.cache)
+        self.assertEqual(cache.base_for(self.project), self.base.resolve())
+        self.assertTrue(cache.unchanged("src/service.ts", ArchiveCache.signature(self.file.stat())))
+
+    def test_output_in_the_chain_is_a_cli_error(self):
+        self._touch()
+        self.file.write_text("export const status = 'closed';\n")
+        argv = ["main.py", "archive", str(self.project), str(self.base), "--incremental",
+                "--workers", "1", "--cache", str(self.cache)]
+        stderr = io.StringIO()
+        with mock.patch.object(sys, "argv", argv), contextlib.redirect_stderr(stderr):
+            with self.assertRaises(SystemExit) as raised:
+                main.main()
+        self.assertEqual(raised.exception.code, 2)
+        self.assertIn("part of the delta chain", stderr.getvalue())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import os
+import random
+import tempfile
+import unittest
+from pathlib import Path
+
+from main import ChunkStore
+
+def _source(lines: int, seed: int = 0) -> str:
+    rng = random.Random(seed)
+    words = ["const", "export", "function", "return", "await", "workOrder", "asset", "tenant",
+             "status", "prisma", "findMany", "where", "include", "select", "id", "name"]
+    return "".join(f"{' '.join(rng.choice(words) for _ in range(rng.randint(3, 12)))};\n"
+                   for _ in range(lines))
+
+class ChunkStoreRoundTrip(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.tmp = Path(self._tmp.name)
+        self.project = self.tmp / "project"
+        (self.project / "src").mkdir(parents=True)
+        self.file = self.project / "src" / "service.ts"
+        self.store = ChunkStore(self.tmp / "store")
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _chunks(self, snapshot_id: str) -> list:
+        return self.store.load_manifest(snapshot_id)["files"][0]["chunks"]
+
+    def _restored(self, snapshot_id: str) -> bytes:
+        target = self.tmp / f"restore-{snapshot_id}"
+        self.store.restore(snapshot_id, target)
+        return (target / "src" / "service.ts").read_bytes()
+
+    def test_insertion_keeps_chunks_and_gc_keeps_referenced(self):
+        lines = _source(4000).splitlines(keepends=True)
+        original = "".join(lines)
+        self.file.write_text(original)
+        first = self.store.snapshot(self.project, workers=1)
+
+        edited = "".join(lines[:2000] + ["export const inserted = true;\n"] + lines[2000:])
+        self.file.write_text(edited)
+        stat = self.file.stat()
+        os.utime(self.file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+        second = self.store.snapshot(self.project, workers=1)
+
+        old, new = self._chunks(first), self._chunks(second)
+        self.assertGreater(len(old), 10)
+        # Only the chunk holding the insertion (and at most its neighbour) may change.
+        self.assertLessEqual(len(set(new) - set(old)), 2)
+        self.assertEqual(self._restored(first), original.encode())
+        self.assertEqual(self._restored(second), edited.encode())
+
+        self.store.forget(first)
+        removed, _ = self.store.gc(grace_seconds=0)
+        self.assertEqual(removed, len(set(old) - set(new)))
+        self.assertTrue(all(self.store.has(digest) for digest in new))
+        self.assertEqual(self._restored(second), edited.encode())
+
+if __name__ == "__main__":
+    unittest.main()
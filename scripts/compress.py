@@ -26,10 +26,14 @@ import sys
 from dataclasses import dataclass
 import time
 
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+from pathfilter import IgnoreMatcher, walk
+
 # Configuration
 DEFAULT_CHUNK_SIZE = 50000  # characters per chunk
 MAX_WORKERS = 8  # for parallel file processing
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB (skip larger files)
+IGNORE_FILES = ('.gitignore',)  # ignore files merged into the exclusion patterns
 
 @dataclass
 class CompressionStats:
@@ -47,15 +51,18 @@ class ProjectCompressor:
             'node_modules', '.git', '.DS_Store', 
             '*.log', '*.tmp', '*.swp', '.env*'
         }
+        self.matcher: Optional[IgnoreMatcher] = None
+
+    def compile_excludes(self, root: Path) -> IgnoreMatcher:
+        """Compile exclusion patterns plus the project's ignore files once per run"""
+        self.matcher = IgnoreMatcher(root, patterns=self.exclude_patterns, ignore_files=IGNORE_FILES)
+        return self.matcher
 
     def should_exclude(self, path: Path) -> bool:
-        """Check if path matches any exclusion pattern"""
-        for pattern in self.exclude_patterns:
-            if pattern.startswith('.') and path.name.startswith(pattern[1:]):
-                return True
-            if path.match(pattern):
-                return True
-        return False
+        """Check if path (or any parent directory) matches an exclusion pattern"""
+        if self.matcher is None:
+            self.compile_excludes(Path.cwd())
+        return self.matcher.matches(path, path.is_dir())
 
     def is_binary_file(self, path: Path) -> bool:
         """Check if file is likely binary"""
@@ -66,10 +73,7 @@ class ProjectCompressor:
         return path.suffix.lower() not in text_extensions
 
     def process_file(self, path: Path) -> Optional[Dict]:
-        """Process a single file and return its metadata"""
-        if self.should_exclude(path):
-            return None
-
+        """Process a single file and return its metadata (callers filter exclusions)"""
         try:
             file_size = path.stat().st_size
             if file_size > MAX_FILE_SIZE and self.is_binary_file(path):
@@ -95,22 +99,18 @@ class ProjectCompressor:
         structure = {}
         files_to_process = []
 
-        # First pass: collect files and count directories
-        for item in root.rglob('*'):
-            rel_path = str(item.relative_to(root))
-            if self.should_exclude(item):
-                continue
-
-            if item.is_dir():
-                structure[rel_path] = {
+        # First pass: collect files and count directories, pruning excluded subtrees
+        for item in walk(root, self.compile_excludes(root), include_dirs=True, workers=MAX_WORKERS):
+            if item.is_dir:
+                structure[str(Path(item.rel_path))] = {
                     'type': 'dir',
                     'size': 0,
                     'hash': '',
-                    'mtime': item.stat().st_mtime
+                    'mtime': item.entry.stat().st_mtime
                 }
                 self.stats.dir_count += 1
-            elif item.is_file():
-                files_to_process.append(item)
+            elif item.entry.is_file():
+                files_to_process.append(Path(item.path))
 
         # Parallel file processing
         with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
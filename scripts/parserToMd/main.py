@@ -1,4 +1,5 @@
 import base64
+import sys
 from pathlib import Path
 from tkinter import filedialog, Tk
 from typing import Dict, List
@@ -12,6 +13,9 @@ from parser_prisma import PrismaExportParser, CodeEntity
 import brotli
 import csv
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from pathfilter import IgnoreMatcher, walk
+
 # Configure logging
 logging.basicConfig(
     level=logging.DEBUG,
@@ -24,6 +28,7 @@ logger = logging.getLogger(__name__)
 NON_CRITICAL_DIRS = {".git", "__pycache__", "node_modules", "venv", ".venv",
                      "dist", "build", ".next", "out", ".ai-assistant", ".vscode",
                      "public", "scripts", "ui"}
+SOURCE_SUFFIXES = ('.ts', '.tsx', '.prisma')
 
 class ProjectStructure:
     def __init__(self, root_dirs: List[Path]) -> None:
@@ -49,48 +54,48 @@ class ProjectStructure:
         if root_key not in self.structure:
             self.structure[root_key] = {}
 
-        for path in root_dir.rglob("*"):
-            if path.name in NON_CRITICAL_DIRS:
-                logger.debug(f"Skipping non-critical path: {path.name}")
-                continue
-            if any(part in NON_CRITICAL_DIRS for part in path.parts) or path.name in NON_CRITICAL_DIRS:
-                continue
+        matcher = IgnoreMatcher(root_dir, dir_names=NON_CRITICAL_DIRS, ignore_files=())
+        directories = []
+        files_by_dir: Dict[str, List[str]] = {}
+        for item in walk(root_dir, matcher, include_dirs=True):
+            if item.is_dir:
+                directories.append(item)
+            elif item.rel_path.endswith(SOURCE_SUFFIXES) and not item.entry.name.startswith('.'):
+                files_by_dir.setdefault(item.rel_path.rpartition('/')[0], []).append(item.entry.name)
 
-            if path.is_dir():
-                relative_path = path.relative_to(root_dir)
-                current_level = self.structure[root_key]
-                for part in relative_path.parts:
-                    if part not in current_level:
-                        current_level[part] = {}
-                    current_level = current_level[part]
+        for item in sorted(directories, key=lambda d: d.rel_path):
+            path = Path(item.path)
+            relative_path = Path(item.rel_path)
+            current_level = self.structure[root_key]
+            for part in relative_path.parts:
+                if part not in current_level:
+                    current_level[part] = {}
+                current_level = current_level[part]
 
-                full_path = str(root_dir.name / relative_path).replace('\\', '/')
-                visible_files = [
-                    f.name for f in path.iterdir()
-                    if f.is_file() and not f.name.startswith('.') and f.suffix in ('.ts', '.tsx', '.prisma')
-                ]
+            full_path = str(root_dir.name / relative_path).replace('\\', '/')
+            visible_files = sorted(files_by_dir.get(item.rel_path, []))
 
-                if not visible_files:
-                    continue
+            if not visible_files:
+                continue
 
-                logger.debug(f"Visible files in {full_path}: {visible_files}")
-                if full_path not in self.imports:
-                    self.imports[full_path] = []
-                    self.component_usages[full_path] = []
+            logger.debug(f"Visible files in {full_path}: {visible_files}")
+            if full_path not in self.imports:
+                self.imports[full_path] = []
+                self.component_usages[full_path] = []
 
-                current_level["files"] = current_level.get("files", {})
-                for file in visible_files:
-                    file_path = path / file
-                    logger.debug(f"Processing file: {file_path}")
-                    if file.endswith('.prisma'):
-                        logger.error(f"Skipping unsupported Prisma file: {file_path}")
-                        entities = self.prisma_parser.parse_prisma_file(str(file_path), self.all_entities)
-                        logger.debug(f"Parsed {len(entities)} Prisma entities from {file_path}")
-                    else:
-                        entities = self.ts_parser.parse_typescript_file(str(file_path), self.all_entities)
-                        logger.debug(f"Parsed {len(entities)} TS entities from {file_path}")
+            current_level["files"] = current_level.get("files", {})
+            for file in visible_files:
+                file_path = path / file
+                logger.debug(f"Processing file: {file_path}")
+                if file.endswith('.prisma'):
+                    logger.error(f"Skipping unsupported Prisma file: {file_path}")
+                    entities = self.prisma_parser.parse_prisma_file(str(file_path), self.all_entities)
+                    logger.debug(f"Parsed {len(entities)} Prisma entities from {file_path}")
+                else:
+                    entities = self.ts_parser.parse_typescript_file(str(file_path), self.all_entities)
+                    logger.debug(f"Parsed {len(entities)} TS entities from {file_path}")
 
-                    current_level["files"][file] = entities
+                current_level["files"][file] = entities
 
     def export_to_csv(self, data: dict, output_file: str = "project_structure.csv"):
         """
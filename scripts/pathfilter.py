@@ -0,0 +1,243 @@
+"""
+Shared ignore engine and pruned directory walker for the project tools.
+
+IgnoreMatcher compiles directory names, glob patterns and .gitignore/.dockerignore
+rules into regular expressions once; walk() uses it with os.scandir so that
+ignored subtrees (node_modules, .git, ...) are never descended into.
+"""
+
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from pathlib import Path
+from typing import Iterable, Iterator, List, NamedTuple, Optional, Tuple, Union
+
+DEFAULT_IGNORE_FILES = (".gitignore", ".dockerignore")
+
+PathLike = Union[str, os.PathLike]
+
+
+def _glob_to_regex(pattern: str) -> str:
+    """Translate a gitignore-style glob (without anchoring) into a regex fragment."""
+    out, i = [], 0
+    while i < len(pattern):
+        ch = pattern[i]
+        if ch == "*":
+            if pattern.startswith("**", i):
+                i += 2
+                if pattern.startswith("/", i):
+                    out.append("(?:.*/)?")
+                    i += 1
+                else:
+                    out.append(".*")
+                continue
+            out.append("[^/]*")
+        elif ch == "?":
+            out.append("[^/]")
+        elif ch == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                out.append(re.escape(ch))
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                out.append(f"[{body}]")
+                i = end
+        else:
+            out.append(re.escape(ch))
+        i += 1
+    return "".join(out)
+
+
+def _rule_to_regex(rule: str) -> Tuple[str, bool]:
+    """Return (regex, dir_only) for a single gitignore rule."""
+    dir_only = rule.endswith("/")
+    rule = rule.rstrip("/")
+    anchored = "/" in rule
+    body = _glob_to_regex(rule.lstrip("/"))
+    prefix = "^" if anchored else "^(?:.*/)?"
+    return f"{prefix}{body}(?:/.*)?$", dir_only
+
+
+def _docker_rule_to_regex(rule: str) -> Tuple[str, bool]:
+    """Return (regex, dir_only) for a single .dockerignore rule.
+
+    Docker matches every pattern against the whole path from the context root, and a
+    trailing slash is dropped rather than restricting the rule to directories.
+    """
+    body = _glob_to_regex(rule.strip("/"))
+    return f"^{body}(?:/.*)?$", False
+
+
+# Ignore files whose syntax isn't gitignore's.
+_RULE_DIALECTS = {".dockerignore": _docker_rule_to_regex}
+
+
+def _compile(rules: Iterable[str]) -> Tuple[Optional[re.Pattern], Optional[re.Pattern]]:
+    """Compile rules into (any-path regex, directory-only regex)."""
+    any_path, dirs_only = [], []
+    for rule in rules:
+        regex, dir_only = _rule_to_regex(rule)
+        (dirs_only if dir_only else any_path).append(regex)
+    join = lambda parts: re.compile("|".join(f"(?:{p})" for p in parts)) if parts else None
+    return join(any_path), join(dirs_only)
+
+
+class _IgnoreFile(NamedTuple):
+    """The rules of one ignore file, in file order, as (regex, dir_only, negated)."""
+    rules: List[Tuple[re.Pattern, bool, bool]]
+    any_rule: re.Pattern  # alternation of every rule, to reject most paths in one search
+
+    @classmethod
+    def parse(cls, lines: Iterable[str], to_regex=_rule_to_regex) -> Optional["_IgnoreFile"]:
+        rules = []
+        for line in lines:
+            negated = line.startswith("!")
+            if negated or line.startswith(("\\!", "\\#")):
+                line = line[1:]
+            if line:
+                regex, dir_only = to_regex(line)
+                rules.append((re.compile(regex), dir_only, negated))
+        if not rules:
+            return None
+        return cls(rules, re.compile("|".join(f"(?:{r.pattern})" for r, _, _ in rules)))
+
+    def ignores(self, rel_path: str, is_dir: bool) -> bool:
+        """Last matching rule wins, so a later rule can re-ignore what a ``!`` rule kept."""
+        if not self.any_rule.match(rel_path):
+            return False
+        for regex, dir_only, negated in reversed(self.rules):
+            if (is_dir or not dir_only) and regex.match(rel_path):
+                return not negated
+        return False
+
+
+class IgnoreMatcher:
+    """Compiled ignore rules for paths relative to ``root``.
+
+    Directory names and patterns passed in from a tool's config always win. Each ignore
+    file is evaluated on its own with its tool's syntax, where the last matching rule wins
+    and ``!`` re-includes; a path is ignored if any of the files ignores it.
+    """
+
+    def __init__(self, root: PathLike = ".", dir_names: Iterable[str] = (),
+                 patterns: Iterable[str] = (), ignore_files: Iterable[str] = DEFAULT_IGNORE_FILES):
+        self.root = os.path.abspath(root)
+        self.dir_names = frozenset(dir_names)
+        self._config_any, self._config_dirs = _compile(p for p in patterns if p)
+
+        self._ignore_files: List[_IgnoreFile] = []
+        for name in ignore_files:
+            dialect = _RULE_DIALECTS.get(Path(name).name, _rule_to_regex)
+            parsed = _IgnoreFile.parse(self._read_rules(Path(self.root) / name), dialect)
+            if parsed is not None:
+                self._ignore_files.append(parsed)
+
+    @staticmethod
+    def _read_rules(path: Path) -> List[str]:
+        try:
+            lines = path.read_text(encoding="utf-8").splitlines()
+        except OSError:
+            return []
+        return [line.strip() for line in lines if line.strip() and not line.lstrip().startswith("#")]
+
+    @staticmethod
+    def _search(regex: Optional[re.Pattern], rel_path: str) -> bool:
+        return bool(regex and regex.match(rel_path))
+
+    def is_ignored(self, rel_path: str, is_dir: bool) -> bool:
+        """Check a single POSIX-style path relative to root (ancestors are not checked)."""
+        name = rel_path.rsplit("/", 1)[-1]
+        if is_dir and name in self.dir_names:
+            return True
+        if self._search(self._config_any, rel_path) or (is_dir and self._search(self._config_dirs, rel_path)):
+            return True
+        return any(ignore_file.ignores(rel_path, is_dir) for ignore_file in self._ignore_files)
+
+    def relative(self, path: PathLike) -> Optional[str]:
+        """POSIX path relative to root, or None if the path lies outside root."""
+        rel = os.path.relpath(os.path.abspath(path), self.root)
+        if rel == os.curdir:
+            return ""
+        if rel == os.pardir or rel.startswith(os.pardir + os.sep):
+            return None
+        return rel.replace(os.sep, "/")
+
+    def matches(self, path: PathLike, is_dir: bool = False) -> bool:
+        """Check an arbitrary path, including all of its ancestor directories.
+
+        Paths outside root are never matched: the rules only describe paths below it.
+        """
+        rel = self.relative(path)
+        if not rel:
+            return False
+        parts = rel.split("/")
+        for i in range(1, len(parts)):
+            if self.is_ignored("/".join(parts[:i]), True):
+                return True
+        return self.is_ignored(rel, is_dir)
+
+
+class WalkEntry(NamedTuple):
+    path: str
+    rel_path: str
+    is_dir: bool
+    entry: os.DirEntry
+
+
+def _scan(path: str, rel: str, matcher: Optional[IgnoreMatcher]) -> Tuple[List[WalkEntry], List[WalkEntry]]:
+    dirs, files = [], []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                rel_path = f"{rel}/{entry.name}" if rel else entry.name
+                try:
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                except OSError:
+                    continue
+                if matcher is not None and matcher.is_ignored(rel_path, is_dir):
+                    continue
+                (dirs if is_dir else files).append(WalkEntry(entry.path, rel_path, is_dir, entry))
+    except OSError:
+        pass
+    return dirs, files
+
+
+def walk(root: PathLike, matcher: Optional[IgnoreMatcher] = None, include_dirs: bool = False,
+         max_depth: Optional[int] = None, workers: int = 0) -> Iterator[WalkEntry]:
+    """Yield entries below ``root``, pruning ignored directories before descending.
+
+    ``max_depth`` limits how many directory levels below root are entered. With
+    ``workers > 1`` directories are scanned concurrently and the order is not stable.
+    """
+    root = os.fspath(root)
+
+    def descend(rel: str) -> bool:
+        return max_depth is None or rel.count("/") + 1 <= max_depth
+
+    if workers <= 1:
+        stack = [(root, "")]
+        while stack:
+            path, rel = stack.pop()
+            dirs, files = _scan(path, rel, matcher)
+            yield from files
+            for item in reversed(dirs):
+                if include_dirs:
+                    yield item
+                if descend(item.rel_path):
+                    stack.append((item.path, item.rel_path))
+        return
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = {pool.submit(_scan, root, "", matcher)}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                dirs, files = future.result()
+                yield from files
+                for item in dirs:
+                    if include_dirs:
+                        yield item
+                    if descend(item.rel_path):
+                        pending.add(pool.submit(_scan, item.path, item.rel_path, matcher))
@@ -0,0 +1,39 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from pathfilter import IgnoreMatcher
+
+class IgnoreRuleOrder(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = Path(self._tmp.name)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _matcher(self, name: str, rules: str) -> IgnoreMatcher:
+        (self.root / name).write_text(rules)
+        return IgnoreMatcher(self.root, ignore_files=(name,))
+
+    def test_last_matching_gitignore_rule_wins(self):
+        matcher = self._matcher(".gitignore", "*.log\n!keep.log\nlogs/keep.log\n")
+        self.assertTrue(matcher.is_ignored("debug.log", False))
+        self.assertFalse(matcher.is_ignored("keep.log", False))
+        self.assertTrue(matcher.is_ignored("logs/keep.log", False))
+
+    def test_gitignore_negation_only_affects_its_own_pattern(self):
+        matcher = self._matcher(".gitignore", "!src/keep.ts\nsrc/\n")
+        self.assertTrue(matcher.is_ignored("src", True))
+        self.assertTrue(matcher.matches(self.root / "src" / "keep.ts"))
+
+    def test_dockerignore_patterns_are_anchored_at_the_root(self):
+        matcher = self._matcher(".dockerignore", "build/\n*.md\n!README.md\n")
+        self.assertTrue(matcher.is_ignored("build", False))
+        self.assertFalse(matcher.is_ignored("src/build", True))
+        self.assertTrue(matcher.is_ignored("CHANGES.md", False))
+        self.assertFalse(matcher.is_ignored("docs/guide.md", False))
+        self.assertFalse(matcher.is_ignored("README.md", False))
+
+if __name__ == "__main__":
+    unittest.main()
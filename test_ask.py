@@ -0,0 +1,130 @@
+import os
+import subprocess
+import tempfile
+import time
+import unittest
+
+from pathlib import Path
+from unittest import mock
+
+import ask
+from ask import FileContentCache, OllamaClient, ProjectIndex, build_arg_parser, verify_ref_range
+
+class DiffArguments(unittest.TestCase):
+    def test_diff_flag_does_not_swallow_the_question(self):
+        args = build_arg_parser().parse_args(["--diff", "review my changes"])
+        self.assertTrue(args.diff)
+        self.assertIsNone(args.diff_range)
+        self.assertEqual(args.question, "review my changes")
+
+    def test_diff_range_takes_its_own_value(self):
+        args = build_arg_parser().parse_args(["--diff-range", "main..HEAD", "what changed?"])
+        self.assertFalse(args.diff)
+        self.assertEqual(args.diff_range, "main..HEAD")
+        self.assertEqual(args.question, "what changed?")
+
+class VerifyRefRange(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self._cwd = os.getcwd()
+        os.chdir(self._tmp.name)
+        git = lambda *args: subprocess.run(["git", *args], check=True, capture_output=True)
+        git("init", "-q")
+        git("-c", "user.name=t", "-c", "user.email=t@t", "commit", "-q", "--allow-empty", "-m", "one")
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def test_known_refs_pass(self):
+        self.assertIsNone(verify_ref_range("HEAD"))
+        self.assertIsNone(verify_ref_range("HEAD..HEAD"))
+        self.assertIsNone(verify_ref_range("HEAD..."))
+
+    def test_question_passed_as_range_is_rejected(self):
+        self.assertIn("review my changes", verify_ref_range("review my changes"))
+
+class TokenCalibration(unittest.TestCase):
+    def setUp(self):
+        self._ratios = dict(OllamaClient._token_ratio)
+        OllamaClient._token_ratio.clear()
+
+    def tearDown(self):
+        OllamaClient._token_ratio.clear()
+        OllamaClient._token_ratio.update(self._ratios)
+
+    def _record(self, prompt: str, prompt_eval_count: int):
+        options = OllamaClient.options_for("test-model", prompt)
+        OllamaClient.record("test-model", "generate", prompt, options, time.perf_counter(),
+                            {"prompt_eval_count": prompt_eval_count})
+        return options
+
+    def test_low_prompt_count_does_not_shrink_num_ctx(self):
+        prompt = "x" * 24000  # ~6000 estimated tokens
+        before = self._record(prompt, 12)["num_ctx"]  # e.g. a prompt-cache hit
+        self.assertEqual(OllamaClient.options_for("test-model", prompt)["num_ctx"], before)
+
+    def test_higher_prompt_count_grows_the_estimate(self):
+        prompt = "x" * 4000  # ~1000 estimated tokens
+        self._record(prompt, 2000)
+        self.assertGreater(OllamaClient.measure_prompt("test-model", prompt), 1001)
+
+class FileContentCacheInvalidation(unittest.TestCase):
+    def test_invalidate_during_read_is_not_lost(self):
+        with tempfile.TemporaryDirectory() as root:
+            path = os.path.join(root, "service.ts")
+            Path(path).write_text("old")
+            cache = FileContentCache()
+            cache.watch(root)
+            read_text = Path.read_text
+
+            def racing_read(self, *args, **kwargs):
+                text = read_text(self, *args, **kwargs)
+                Path(path).write_text("new")
+                cache.invalidate(path)  # the watcher fires before get() inserts
+                return text
+
+            with mock.patch.object(Path, "read_text", racing_read):
+                self.assertEqual(cache.get(path)["text"], "old")
+            self.assertEqual(cache.get(path)["text"], "new")
+
+class IndexSnapshotFingerprint(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.root = self._tmp.name
+        git = lambda *args: subprocess.run(["git", "-C", self.root, *args], check=True, capture_output=True)
+        git("init", "-q")
+        Path(self.root, "tracked.ts").write_text("export function tracked() {}\n")
+        git("add", "tracked.ts")
+        git("-c", "user.name=t", "-c", "user.email=t@t", "commit", "-q", "-m", "one")
+        Path(self.root, "untracked.ts").write_text("export function draft() {}\n")
+        self.snapshot = os.path.join(self.root, ".ai-assistant", "index.snapshot")
+        os.makedirs(os.path.dirname(self.snapshot))
+        index = ProjectIndex(self.snapshot, self.root)
+        index.load()
+        index.save()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def _edit(self, name: str, text: str):
+        path = Path(self.root, name)
+        stat = path.stat()
+        path.write_text(text)
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+    def test_unchanged_tree_skips_the_walk_but_sees_in_place_edits(self):
+        self._edit("tracked.ts", "export function editedTracked() {}\n")
+        self._edit("untracked.ts", "export function editedDraft() {}\n")
+        index = ProjectIndex(self.snapshot, self.root)
+        with mock.patch.object(ask, "walk", side_effect=AssertionError("walked the tree")):
+            self.assertEqual(index.load(), (2, 2))
+        edited = {str(Path(self.root, name)) for name in ("tracked.ts", "untracked.ts")}
+        self.assertEqual(index.postings["edited"], edited)
+
+    def test_new_file_falls_back_to_the_walk(self):
+        Path(self.root, "added.ts").write_text("export function added() {}\n")
+        self.assertEqual(ProjectIndex(self.snapshot, self.root).load(), (3, 1))
+
+if __name__ == "__main__":
+    unittest.main()